@@ -0,0 +1,111 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "DailyRollup.py 2026-10-19T12:30-03:00"
+
+import json
+import logging
+from datetime import datetime, timedelta
+from google.appengine.api import taskqueue
+from admin.parser.GetEvents import GetEvents
+from models import DailyAggregate
+from config import *
+
+class DailyRollup(GetEvents):
+    """Store the partial aggregates of a day of events as DailyAggregate entities.
+
+GET, meant for cron, enqueues the rollup of both event types for a day,
+yesterday by default. POST extracts one event type for one day. Rollups of
+complete days are reused by sharded extractions of their period, so the
+monthly run only has to merge them. A rollup written by a day shard keeps the
+run of that shard, so refreshing it does not hide it from the run's merge.
+"""
+    def get(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        day = self.request.get('day', None)
+        if not day:
+            day = (datetime.utcnow() - timedelta(days=1)).strftime('%Y%m%d')
+
+        for t in ["download", "search"]:
+            taskqueue.add(url=URI_DAILY_ROLLUP,
+                          params={"day": day, "t": t},
+                          queue_name=QUEUENAME)
+
+        resp = {
+            "status": "success",
+            "message": "Daily rollups enqueued",
+            "data": {
+                "day": day
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+        return
+
+    def post(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        s =  "Version: %s\n" % __version__
+        s += "Arguments from POST:"
+        for arg in self.request.arguments():
+            s += '\n%s:%s' % (arg, self.request.get(arg))
+        logging.info(s)
+
+        self.day = self.request.get('day', None)
+        self.t = self.request.get('t', None)
+        if not self.day or len(self.day) != 8 or \
+                self.t not in ["download", "search"]:
+            self.error(400)
+            resp = {
+                "status": "error",
+                "message": "Malformed parameters. Provide 'day' as YYYYMMDD "
+                           "and 't' as 'download' or 'search'"
+            }
+            logging.error(resp)
+            self.response.write(json.dumps(resp) + "\n")
+            return
+
+        # Rollups always come from the default table
+        self.period = self.day[:6]
+        self.table_name = CDB_TABLE
+        try:
+            self.page_size = int(self.request.get('page_size', CDB_PAGE_SIZE))
+        except ValueError:
+            self.page_size = CDB_PAGE_SIZE
+        self.aggregation = self.request.get('aggregation', 'client').lower()
+
+        # Keep the run of the rollup, a sharded extraction may be merging it
+        existing = DailyAggregate.build_key(
+            self.t, datetime.strptime(self.day, '%Y%m%d')
+        ).get()
+        run_id = None
+        if existing is not None:
+            run_id = existing.run_id
+
+        err = self.extract_day(run_id)
+        if err:
+            return
+
+        resp = {
+            "status": "success",
+            "message": "Daily rollup of %s events stored" % self.t,
+            "data": {
+                "day": self.day,
+                "event_type": self.t,
+                "event_number": self.events_count,
+                "resources": len(self.resources),
+                "country_lookups": self.country_stats
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+        return
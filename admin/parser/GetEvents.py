@@ -9,7 +9,7 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "GetEvents.py 2018-12-11T13:58-03:00"
+__version__ = "GetEvents.py 2026-10-19T15:00-03:00"
 
 import json
 import logging
@@ -17,9 +17,16 @@ from datetime import datetime, timedelta
 from google.appengine.ext import ndb
 from google.appengine.api import taskqueue
 import webapp2
-from models import ReportToProcess, StatsRun
-from util import ApiQueryMaxRetriesExceededError
-from util import add_time_limit, carto_query, geonames_query
+from models import DailyAggregate, ReportToProcess, StatsRun
+from util import ApiQueryMaxRetriesExceededError, CartoQueryTooLargeError
+from util import add_time_window, month_days, month_window
+from util import carto_query, country_key, resolve_countries
+from countrycache import country_cache
+from aggregate import ResourceAggregate
+from queryterms import TermDictionary
+from renderer import invalidate
+from counters import increment, period_counter
+from reportbuilder import build_reports, index_reports, report_key
 from config import *
 
 class GetEvents(webapp2.RequestHandler):
@@ -97,6 +104,25 @@ class GetEvents(webapp2.RequestHandler):
                 # Table name not provided, use default
                 self.table_name = CDB_TABLE
 
+            # 'page_size' parameter
+            try:
+                self.page_size = int(self.request.get('page_size', CDB_PAGE_SIZE))
+            except ValueError:
+                # Page size not valid, use default
+                self.page_size = CDB_PAGE_SIZE
+
+            # 'aggregation' parameter
+            self.aggregation = self.request.get('aggregation', 'client').lower()
+
+            # 'sharded' parameter
+            self.sharded = self.request.get('sharded').lower() == 'true'
+
+            # 'pipeline' parameter
+            self.pipeline = self.request.get('pipeline').lower() == 'true'
+
+            # 'terms_sketch' parameter
+            self.terms_sketch = self.request.get('terms_sketch').lower() == 'true'
+
             # 'downloads_extracted' parameter
             try:
                 self.downloads_extracted = self.request.get('downloads_extracted').\
@@ -130,6 +156,23 @@ class GetEvents(webapp2.RequestHandler):
                 # default value for 'table_name' if not provided is None
                 self.table_name = CDB_TABLE
 
+            # 'page_size' parameter
+            self.page_size = period_entity.page_size
+            if self.page_size is None:
+                self.page_size = CDB_PAGE_SIZE
+
+            # 'aggregation' parameter
+            self.aggregation = period_entity.aggregation
+
+            # 'sharded' parameter
+            self.sharded = period_entity.sharded is True
+
+            # 'pipeline' parameter
+            self.pipeline = period_entity.pipeline is True
+
+            # 'terms_sketch' parameter
+            self.terms_sketch = period_entity.terms_sketch is True
+
             # 'downloads_extracted' parameter
             try:
                 self.downloads_extracted = period_entity.downloads_extracted
@@ -150,10 +193,38 @@ class GetEvents(webapp2.RequestHandler):
                 logging.error(s)
                 return
 
+        if self.aggregation != 'server':
+            self.aggregation = 'client'
+        # Bound the query terms kept per resource
+        self.terms_capacity = None
+        if self.terms_sketch is True:
+            self.terms_capacity = TERMS_SKETCH_CAPACITY
         s =  "Version: %s\n" % __version__
         s += "Using %s as data table" % self.table_name
+        if self.aggregation == 'server':
+            s += " with server-side aggregation"
+        else:
+            s += " with page size %d" % self.page_size
         logging.info(s)
 
+        # A day shard extracts a single day of a single event type
+        self.day = self.request.get('day', None)
+        if self.day:
+            self.t = self.request.get('t')
+            self.attempt = self.request.get('attempt', None)
+            self.extract_shard(period_entity)
+            return
+
+        # In sharded mode, fan out one task per event type and day
+        if self.sharded is True and self.table_name == CDB_TABLE:
+            self.fan_out(period_entity)
+            return
+
+        # In pipeline mode, extract both event types and build the Reports
+        if self.pipeline is True:
+            self.run_pipeline(period_entity)
+            return
+
         # Start with downloads
         if self.downloads_extracted == False:
             self.t = "download"
@@ -166,9 +237,9 @@ class GetEvents(webapp2.RequestHandler):
             taskqueue.add(url=URI_PROCESS_EVENTS, queue_name=QUEUENAME)
             return
 
-        # Get events
+        # Get and parse events
         s =  "Version: %s\n" % __version__
-        s += "Getting events"
+        s += "Getting and parsing events"
         logging.info(s)
         err = self.get_events()
         if err:
@@ -177,17 +248,6 @@ class GetEvents(webapp2.RequestHandler):
             logging.error(s)
             return
 
-        # Parse events
-        s =  "Version: %s\n" % __version__
-        s += "Parsing events"
-        logging.info(s)
-        err = self.parse_events()
-        if err:
-            s =  "Version: %s\n" % __version__
-            s += "Error from parse_events(): %s" % err
-            logging.error(s)
-            return
-
         # Update Period counts
         s =  "Version: %s\n" % __version__
         s += "Updating Period counts"
@@ -201,12 +261,8 @@ class GetEvents(webapp2.RequestHandler):
 
         r = []
         for resource in self.resources:
-            params = {
-                "t": self.t,
-                "gbifdatasetid": resource,
-                "resource": self.resources[resource]
-            }
-            r.append(ReportToProcess(**params))
+            r.extend(ReportToProcess.build(self.t, resource,
+                                           self.resources[resource]))
 
         # Store temporary entities
         s =  "Version: %s\n" % __version__
@@ -240,8 +296,10 @@ class GetEvents(webapp2.RequestHandler):
             "data": {
                 "period": self.period,
                 "event_type": self.t,
-                "event_number": len(self.data),
-                "resources_to_process": len(self.resources)
+                "event_number": self.events_count,
+                "resources_to_process": len(self.resources),
+                "time_windows": self.windows,
+                "country_lookups": self.country_stats
             }
         }
         self.response.write(json.dumps(resp) + "\n")
@@ -281,13 +339,451 @@ class GetEvents(webapp2.RequestHandler):
             taskqueue.add(url=URI_GET_EVENTS, queue_name=QUEUENAME)
         return
 
-    def get_events(self):
-        """Build query and extract records."""
+    def run_pipeline(self, period_entity):
+        """Extract all pending event types and build the Reports in memory.
+
+Skips the ReportToProcess round trip. If the resources held in memory grow
+past PIPELINE_MAX_RESOURCES, they are spilled to ReportToProcess entities,
+and so are those of the remaining event types, and 'process_events' builds
+the Reports as in the regular flow.
+"""
+        held = {}
+        spilled = False
+        types = self.pending_types(period_entity)
+        # Lookups of the event types extracted by this task, if any
+        self.country_stats = {}
+        for t in types:
+            self.t = t
+            s =  "Version: %s\n" % __version__
+            s += "Getting and parsing %s events in pipeline mode" % t
+            logging.info(s)
+            err = self.get_events()
+            if err:
+                s =  "Version: %s\n" % __version__
+                s += "Error from get_events(): %s" % err
+                logging.error(s)
+                return
+            err = self.update_period_counts()
+            if err:
+                s =  "Version: %s\n" % __version__
+                s += "Error from update_period_counts(): %s" % err
+                logging.error(s)
+                return
+
+            held[t] = self.resources
+            if spilled is False and \
+                    sum([len(x) for x in held.values()]) > PIPELINE_MAX_RESOURCES:
+                s =  "Version: %s\n" % __version__
+                s += "More than %d resources in memory. " % PIPELINE_MAX_RESOURCES
+                s += "Spilling to ReportToProcess"
+                logging.warning(s)
+                spilled = True
+
+            # Once spilling, every event type goes through ReportToProcess.
+            # Event types are only marked as extracted once stored
+            if spilled is True:
+                for spill_t in held:
+                    self.spill(spill_t, held[spill_t])
+                self.mark_extracted(period_entity, held.keys())
+                held = {}
+
+        if len(types) == 0:
+            # Every event type was stored by a previous try of this task,
+            # either as Reports or as ReportToProcess entities. The regular
+            # flow processes what is left, if anything, and finalizes
+            self.launch_process_events()
+            message = "Events already extracted. Launching process_events"
+            reports = 0
+        elif spilled is True:
+            self.launch_process_events()
+            message = "Events extracted and spilled. Launching process_events"
+            reports = 0
+        else:
+            reports = self.write_reports(period_entity, held)
+            # Same progress counters as 'process_events', counted along with
+            # the extracted flags so a retried task does not count them again
+            self.mark_extracted(period_entity, held.keys(),
+                                dict((t, len(x)) for t, x in held.items()))
+            self.launch_process_events({"period": self.period,
+                                        "finalize": "true"})
+            message = "Reports built in pipeline mode. Finalizing"
+
+        resp = {
+            "status": "success",
+            "message": message,
+            "data": {
+                "period": self.period,
+                "reports": reports,
+                "spilled": spilled,
+                "country_lookups": self.country_stats
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+        return
+
+    @ndb.transactional(xg=True)
+    def mark_extracted(self, period_entity, types, processed=None):
+        """Store in the Period that the given event types are extracted.
+
+'processed' maps event types to the number of resources processed into
+Reports, added to the progress counters of the run in the same transaction.
+Event types already marked, by an earlier try of this task, are not counted.
+"""
+        # Read again, update_period_counts() stores its own copy
+        period_entity = period_entity.key.get()
+        fields = {"search": ("searches_extracted", "processed_searches"),
+                  "download": ("downloads_extracted", "processed_downloads")}
+        for t in types:
+            flag, counter = fields[t]
+            if getattr(period_entity, flag) is True:
+                continue
+            setattr(period_entity, flag, True)
+            # The increments join this transaction
+            if processed and processed.get(t, 0) > 0:
+                increment(period_counter(period_entity, counter), processed[t])
+        period_entity.put()
+
+    def launch_process_events(self, params=None):
+        """Enqueue the 'process_events' task that follows this one.
+
+The task is named after this task, so retries of this task do not enqueue it
+again. When not run from the task queue, the task is not named.
+"""
+        name = None
+        task_name = self.request.headers.get('X-AppEngine-TaskName', None)
+        if task_name:
+            name = "process-after-%s" % task_name
+        try:
+            taskqueue.add(name=name, url=URI_PROCESS_EVENTS,
+                          params=params or {}, queue_name=QUEUENAME)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            s =  "Version: %s\n" % __version__
+            s += "Task %s already enqueued" % name
+            logging.info(s)
+
+    def spill(self, t, resources):
+        """Store the resources of an event type as ReportToProcess entities."""
+        r = []
+        for resource in resources:
+            r.extend(ReportToProcess.build(t, resource, resources[resource]))
+        futures = []
+        for i in range(0, len(r), PIPELINE_BATCH_SIZE):
+            futures.extend(ndb.put_multi_async(r[i:i + PIPELINE_BATCH_SIZE]))
+        for future in futures:
+            future.get_result()
+        s =  "Version: %s\n" % __version__
+        s += "Spilled %d %s resources" % (len(resources), t)
+        logging.info(s)
+
+    def write_reports(self, period_entity, held):
+        """Build and store the Reports of the resources held in memory.
+
+Reports are written in asynchronous batches, so the writes of a batch overlap
+with building the next one. Return the number of Reports written.
+"""
+        datasets = {}
+        for t, resources in held.items():
+            for gbifdatasetid, aggregate in resources.items():
+                datasets.setdefault(gbifdatasetid, {})[t] = aggregate
+
+        ids = sorted(datasets.keys())
+        futures = []
+        reports = []
+        for i in range(0, len(ids), PIPELINE_BATCH_SIZE):
+            batch = dict((x, datasets[x]) for x in ids[i:i + PIPELINE_BATCH_SIZE])
+            entities, stale = build_reports(self.period, batch)
+            futures.extend(ndb.put_multi_async(entities))
+            futures.extend(ndb.delete_multi_async(stale))
+            reports.extend([x for x in entities if x.key.kind() == 'Report'])
+        for future in futures:
+            future.get_result()
+        invalidate([report_key(self.period, x) for x in ids])
+        index_reports(reports)
+
+        s =  "Version: %s\n" % __version__
+        s += "Stored %d reports" % len(ids)
+        logging.info(s)
+        return len(ids)
+
+    def fan_out(self, period_entity):
+        """Enqueue one GetEvents task per event type and day of the period.
+
+Each task extracts one day of events into a DailyAggregate entity. Days that
+already have a reusable daily rollup are not extracted again. The last shard
+to finish enqueues MergeEvents (see check_shards). Each fan-out is a new
+attempt, kept in the Period, so running the extraction again within the same
+run names its merge task anew.
+"""
+        types = self.pending_types(period_entity)
+        if len(types) == 0:
+            # Nothing left to extract, call 'process_events' and move on
+            taskqueue.add(url=URI_PROCESS_EVENTS, queue_name=QUEUENAME)
+            return
+
+        # Existing rollups
+        shards = [(t, day) for t in types for day in month_days(self.period)]
+        rollups = ndb.get_multi([DailyAggregate.build_key(t, day)
+                                 for t, day in shards])
+        shards = [shards[i] for i in range(len(shards))
+                  if rollups[i] is None
+                  or not rollups[i].ready_for(period_entity)]
+
+        self.attempt = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        period_entity = period_entity.key.get()
+        period_entity.extraction_attempt = self.attempt
+        period_entity.put()
+
+        params = {
+            "period": self.period,
+            "table_name": self.table_name,
+            "page_size": self.page_size,
+            "aggregation": self.aggregation,
+            "attempt": self.attempt
+        }
+        tasks = []
+        for t, day in shards:
+            task_params = dict(params, t=t, day=day.strftime('%Y%m%d'))
+            tasks.append(taskqueue.Task(url=URI_GET_EVENTS,
+                                        params=task_params))
+
+        # Add in batches, the maximum the task queue API accepts per call
+        queue = taskqueue.Queue(QUEUENAME)
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+        resp = {
+            "status": "in progress",
+            "message": "Extraction fanned out in %d day shards" % len(tasks),
+            "data": {
+                "period": self.period,
+                "event_types": types,
+                "shards": len(tasks),
+                "reused_rollups": len(rollups) - len(tasks)
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+
+        # If every day was reused, there is no shard left to trigger the merge
+        if len(tasks) == 0:
+            self.check_shards(period_entity)
+        return
+
+    def pending_types(self, period_entity):
+        """Return the event types not yet extracted for the period."""
+        types = []
+        if period_entity.downloads_extracted is not True:
+            types.append("download")
+        if period_entity.searches_extracted is not True:
+            types.append("search")
+        return types
+
+    def extract_shard(self, period_entity):
+        """Extract a single day of events and store it as a DailyAggregate."""
+        err = self.extract_day(period_entity.run_id)
+        if err:
+            return
+
+        resp = {
+            "status": "success",
+            "message": "Day %s of %s events extracted" % (self.day, self.t),
+            "data": {
+                "period": self.period,
+                "event_type": self.t,
+                "day": self.day,
+                "event_number": self.events_count,
+                "resources": len(self.resources),
+                "country_lookups": self.country_stats
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+
+        self.check_shards(period_entity)
+        return
+
+    def extract_day(self, run_id=None):
+        """Extract the events of type self.t and day self.day into a rollup."""
+        start = datetime.strptime(self.day, '%Y%m%d')
+        end = start + timedelta(days=1)
+        # Rollups are reused by later runs, so query terms are counted exactly
+        self.terms_capacity = None
 
+        s =  "Version: %s\n" % __version__
+        s += "Extracting %s events for day %s" % (self.t, self.day)
+        logging.info(s)
+        err = self.get_events(start, end)
+        if err:
+            s =  "Version: %s\n" % __version__
+            s += "Error from get_events(): %s" % err
+            logging.error(s)
+            return err
+
+        rollup = DailyAggregate(
+            key=DailyAggregate.build_key(self.t, start),
+            period=start.strftime('%Y%m'),
+            run_id=run_id,
+            t=self.t,
+            day=start.date(),
+            complete=end <= datetime.utcnow(),
+            events=self.events_count,
+            records=self.records_count,
+            resources=dict((k, v.to_dict())
+                           for k, v in self.resources.items())
+        )
+        rollup.put()
+        return 0
+
+    def check_shards(self, period_entity):
+        """Enqueue MergeEvents if every day shard of this run has reported.
+
+Shards are looked up by key, which is strongly consistent, and the merge task
+is named after the run and the fan-out attempt, so only one of the shards that
+see the run complete gets to enqueue it. Shards of an earlier attempt leave
+the merge to those of the current one.
+"""
+        if period_entity.extraction_attempt != self.attempt:
+            s =  "Version: %s\n" % __version__
+            s += "Day shard of an earlier attempt, not checking the merge"
+            logging.info(s)
+            return
+
+        keys = [DailyAggregate.build_key(t, day)
+                for t in self.pending_types(period_entity)
+                for day in month_days(self.period)]
+        shards = ndb.get_multi(keys)
+        done = [x for x in shards
+                if x is not None and x.ready_for(period_entity)]
+        if len(done) < len(keys):
+            s =  "Version: %s\n" % __version__
+            s += "%d of %d day shards done" % (len(done), len(keys))
+            logging.info(s)
+            return
+
+        name = "merge-%s-%s-%s" % (self.period, period_entity.run_id,
+                                   self.attempt)
+        try:
+            taskqueue.add(name=name, url=URI_MERGE_EVENTS,
+                          params={"period": self.period},
+                          queue_name=QUEUENAME)
+            s =  "Version: %s\n" % __version__
+            s += "All %d day shards done. Merge task %s enqueued" % (len(keys), name)
+            logging.info(s)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            s =  "Version: %s\n" % __version__
+            s += "Merge task %s already enqueued" % name
+            logging.info(s)
+        return
+
+    def get_events(self, start=None, end=None):
+        """Build query, extract records and parse them into resources.
+
+If aggregation is 'server', Carto returns already aggregated groups instead of
+events. Otherwise, if page_size is greater than 0, the table is walked in
+cartodb_id order, one page at a time, and each page is parsed as soon as it
+arrives. Otherwise, all events are extracted in a single query.
+"""
+
+        # Initialize aggregates. Query terms are referred to by their ID in
+        # the term dictionary while parsing
+        self.resources = {}
+        self.term_dictionary = TermDictionary(CANONICAL_QUERY_TERMS)
+        self.countries = {}
+        country_stats = country_cache.snapshot()
+        self.events_count = 0
+        self.records_count = 0
+        self.windows = 0
+
+        # Only restrict time if using default table. Extract the whole period
+        # unless a narrower window was given
+        if self.table_name != CDB_TABLE:
+            start, end = None, None
+        elif start is None or end is None:
+            start, end = month_window(self.period)
+
+        err = self.extract_window(start, end)
+        if err:
+            return err
+        self.term_dictionary.resolve(self.resources)
+
+        # Finish method
+        self.country_stats = country_cache.since(country_stats)
+        s =  "Version: %s\n" % __version__
+        s += "Extracted %d %s events " % (self.events_count, self.t)
+        s += "in %d time windows " % self.windows
+        s += "into %d resources\n" % len(self.resources)
+        s += "Query terms: %s\n" % self.term_dictionary.summary()
+        s += "Country lookups: %s" % self.country_stats
+        logging.info(s)
+        return 0
+
+    def extract_window(self, start, end, after_id=0):
+        """Extract the events created in [start, end), splitting on failure.
+
+If Carto rejects a query as too expensive, the window is bisected and both
+halves are extracted in turn, recursively, until each sub-query succeeds or
+the window cannot be split any further (see split_window). Partial results are
+merged as they are parsed, because both parsers add to the same aggregates.
+
+'after_id' is the last cartodb_id already parsed in a paginated walk; rows up
+to it are skipped in both halves, so a walk interrupted after some pages does
+not parse them twice.
+"""
         # Extract Carto data, base query
         s =  "Version: %s\n" % __version__
         s += "Building %s query" % self.t
+        if start is not None:
+            s += " for events between %s and %s" % (start, end)
         logging.info(s)
+        query = self.build_query(start, end)
+
+        try:
+            if self.aggregation == 'server':
+                err = self.get_aggregates(query)
+            elif self.page_size > 0:
+                err = self.get_events_paginated(query, after_id)
+            else:
+                err = self.get_events_single(query)
+            if err:
+                return err
+            self.windows += 1
+            return 0
+
+        except CartoQueryTooLargeError as e:
+            mid = self.split_window(start, end)
+            if mid is None:
+                s =  "Version: %s\n" % __version__
+                s += "Query too large and time window can't be split further"
+                logging.error(s)
+                return self.carto_error()
+
+            after_id = getattr(e, 'after_id', after_id)
+            s =  "Version: %s\n" % __version__
+            s += "Query too large for events between %s and %s. " % (start, end)
+            s += "Splitting at %s" % mid
+            logging.warning(s)
+            err = self.extract_window(start, mid, after_id)
+            if err:
+                return err
+            return self.extract_window(mid, end, after_id)
+
+    def split_window(self, start, end):
+        """Return the day at which to bisect [start, end), or None.
+
+Windows are split at day boundaries (halves, then about weeks, then days), and
+single days are not split at all. Custom tables are not time restricted, so
+they can't be split either.
+"""
+        if start is None or end is None:
+            return None
+        days = (end - start).days
+        if days < 2:
+            return None
+        return start + timedelta(days=days // 2)
+
+    def build_query(self, start=None, end=None):
+        """Build the query for the current event type and time window."""
         if self.t == 'download':
             # Line #6 of SQL is to avoid too large queries
             query = "SELECT cartodb_id, lat, lon, created_at, " \
@@ -313,115 +809,211 @@ class GetEvents(webapp2.RequestHandler):
         # Just production portal downloads
         query += " AND client='portal-prod'"
 
-        # Only restrict time if using default table
-        if self.table_name == CDB_TABLE:
-            queried_date = datetime(
-                int(self.period[:4]),
-                int(self.period[-2:]),
-                1
-            )
-            queried_date += timedelta(days=32)
-            query = add_time_limit(query=query, today=queried_date)
+        # Only restrict time if a window was given
+        if start is not None and end is not None:
+            query = add_time_window(query, start, end)
+
+        return query
 
+    def get_events_single(self, query):
+        """Extract all events in a single query and parse them."""
         s =  "Version: %s\n" % __version__
         s += "Executing query:\n%s" % query
         logging.info(s)
         try:
             data = carto_query(query)
         except ApiQueryMaxRetriesExceededError:
-            self.error(504)
-            resp = {
-                "status": "error",
-                "message": "Could not retrieve data from Carto",
-                "data": {
-                    "period": self.period,
-                    "event_type": self.t
-                }
-            }
-            self.response.write(json.dumps(resp) + "\n")
-            return 1
+            return self.carto_error()
 
-        # Store 'data' in class property
-        self.data = data
+        self.parse_events(data)
+        return 0
+
+    def get_events_paginated(self, query, after_id=0):
+        """Walk the table in cartodb_id order, parsing one page at a time.
+
+Pages are requested with keyset pagination (cartodb_id greater than the last
+one seen), so each query is cheap regardless of how deep into the period it is,
+and only one page of raw events is held in memory at any time.
+
+Pages start after 'after_id'. If Carto rejects a page as too expensive, the
+CartoQueryTooLargeError is re-raised with the last cartodb_id parsed so far.
+"""
+        last_id = after_id
+        pages = 0
+        while True:
+            page_query = query
+            page_query += " AND cartodb_id>%d" % last_id
+            page_query += " ORDER BY cartodb_id LIMIT %d" % self.page_size
+
+            s =  "Version: %s\n" % __version__
+            s += "Executing query for page %d:\n%s" % (pages + 1, page_query)
+            logging.info(s)
+            try:
+                data = carto_query(page_query)
+            except ApiQueryMaxRetriesExceededError:
+                return self.carto_error()
+            except CartoQueryTooLargeError as e:
+                e.after_id = last_id
+                raise
+
+            if len(data) == 0:
+                break
+
+            pages += 1
+            last_id = data[-1]['cartodb_id']
+            self.parse_events(data)
+
+            # A short page means the end of the table was reached
+            if len(data) < self.page_size:
+                break
 
-        # Finish method
         s =  "Version: %s\n" % __version__
-        s += "Extracted %d %s events" % (len(data), self.t)
+        s += "Walked %d pages of %s events" % (pages, self.t)
         logging.info(s)
         return 0
 
-    def parse_events(self):
-        """Preformat some special fields and redistribute records into resources."""
+    def get_aggregates(self, query):
+        """Aggregate events per resource in Carto and parse the groups.
+
+Four queries are sent, all over the same events as 'query': period totals, and
+per resource groups by date, by query terms and by 2-decimal location cell.
+results_by_resource is expanded with json_each, so the amount of data
+transferred and parsed depends on the number of groups, not of events.
+
+Groups are only parsed once all four queries have succeeded, so that a query
+rejected as too expensive leaves the aggregates untouched.
+"""
+        # Expand each event into one row per resource it returned records from
+        expanded = "FROM (%s) AS e, " \
+                   "json_each(e.results_by_resource::json) AS r" % query
+        queries = {
+            'totals': "SELECT count(*) AS events, " \
+                      "coalesce(sum(e.response_records::bigint), 0) AS records " \
+                      "FROM (%s) AS e" % query,
+            'dates': "SELECT r.key AS resource, " \
+                     "to_char(e.created_at, 'YYYY-MM-DD') AS query_date, " \
+                     "count(*) AS times, " \
+                     "sum(r.value::text::bigint) AS records " \
+                     "%s GROUP BY 1, 2" % expanded,
+            'terms': "SELECT r.key AS resource, e.query_terms, " \
+                     "count(*) AS times, " \
+                     "sum(r.value::text::bigint) AS records " \
+                     "%s GROUP BY 1, 2" % expanded,
+            'cells': "SELECT r.key AS resource, " \
+                     "round(e.lat::numeric, 2) AS lat, " \
+                     "round(e.lon::numeric, 2) AS lon, " \
+                     "count(*) AS times " \
+                     "%s GROUP BY 1, 2, 3" % expanded
+        }
+
+        groups = {}
+        for kind in ['totals', 'dates', 'terms', 'cells']:
+            s =  "Version: %s\n" % __version__
+            s += "Executing %s query:\n%s" % (kind, queries[kind])
+            logging.info(s)
+            try:
+                groups[kind] = carto_query(queries[kind])
+            except ApiQueryMaxRetriesExceededError:
+                return self.carto_error()
+
+        self.parse_aggregates(groups)
+        return 0
+
+    def parse_aggregates(self, groups):
+        """Add the groups returned by get_aggregates() to self.resources."""
+        resources = self.resources
+
+        def resource_entry(resource):
+            if resource not in resources:
+                resources[resource] = ResourceAggregate(self.terms_capacity)
+            return resources[resource]
+
+        # Period totals
+        for row in groups['totals']:
+            self.events_count += int(row['events'])
+            self.records_count += int(row['records'])
+
+        # Records and dates. Each event has one date, so events and records
+        # per resource are the sums of those of all its date groups
+        for row in groups['dates']:
+            entry = resource_entry(row['resource'])
+            entry.events += int(row['times'])
+            entry.records += int(row['records'])
+            entry.add_date(row['query_date'], int(row['times']))
+
+        # Query terms
+        for row in groups['terms']:
+            resource_entry(row['resource']).add_terms(
+                self.term_dictionary.intern(row['query_terms']),
+                int(row['times']), int(row['records']))
+
+        # Countries, resolved once per distinct cell
+        countries = resolve_countries(
+            [(row['lat'], row['lon']) for row in groups['cells']],
+            resolved=self.countries
+        )
+        for row in groups['cells']:
+            country = countries[country_key(row['lat'], row['lon'])]
+            resource_entry(row['resource']).add_country(country, int(row['times']))
 
-        # Format according to the Model classes
         s =  "Version: %s\n" % __version__
-        s += "Formatting results"
+        s += "Parsed %d date, " % len(groups['dates'])
+        s += "%d terms and " % len(groups['terms'])
+        s += "%d location groups" % len(groups['cells'])
         logging.info(s)
-        resources = {}
+        return 0
+
+    def carto_error(self):
+        """Write the error response for a failed Carto extraction."""
+        self.error(504)
+        resp = {
+            "status": "error",
+            "message": "Could not retrieve data from Carto",
+            "data": {
+                "period": self.period,
+                "event_type": self.t
+            }
+        }
+        self.response.write(json.dumps(resp) + "\n")
+        return 1
 
-        for event in self.data:
+    def parse_events(self, data):
+        """Preformat some special fields and redistribute records into resources.
+
+Events are added to the aggregates already in self.resources, so this method
+can be called once per extracted page.
+"""
+        resources = self.resources
+
+        # Resolve all distinct locations in the page before aggregating
+        countries = resolve_countries(
+            [(event['lat'], event['lon']) for event in data],
+            resolved=self.countries
+        )
+
+        for event in data:
+
+            # Update period totals
+            self.events_count += 1
+            self.records_count += int(event['response_records'])
 
             # Preformat some fields
             event_created = datetime.strptime(event['created_at'], '%Y-%m-%dT%H:%M:%SZ')
             # Keep just YMD
             event_created = event_created.strftime('%Y-%m-%d')
             event_results = json.loads(event['results_by_resource'])
-            event_country = geonames_query(event['lat'], event['lon'])
-            event_terms = event['query_terms']
+            event_country = countries[country_key(event['lat'], event['lon'])]
+            event_terms = self.term_dictionary.intern(event['query_terms'])
 
             for resource in event_results:
-
-                # Initialize resource if not existing
                 if resource not in resources:
-                    resources[resource] = {
-                        'records': 0,
-                        'query_countries': {},
-                        'query_dates': {},
-                        'query_terms': {}
-                    }
-
-                # Add records
-                resources[resource]['records'] += event_results[resource]
-
-                # Add query country
-                if event_country not in resources[resource]['query_countries']:
-                    resources[resource]['query_countries'][event_country] = {
-                        'query_country': event_country,
-                        'times': 1
-                    }
-                else:
-                    resources[resource]['query_countries'][event_country]['times'] += 1
-
-                # Add query date
-                if event_created not in resources[resource]['query_dates']:
-                    resources[resource]['query_dates'][event_created] = {
-                        'query_date': event_created,
-                        'times': 1
-                    }
-                else:
-                    resources[resource]['query_dates'][event_created]['times'] += 1
-
-                # Add query terms
-                if event_terms not in resources[resource]['query_terms']:
-                    resources[resource]['query_terms'][event_terms] = {
-                        'query_terms': event_terms,
-                        'times': 1,
-                        'records': event_results[resource]
-                    }
-                else:
-                    et = resources[resource]['query_terms'][event_terms]
-                    et['times'] += 1
-                    et['records'] += event_results[resource]
-#                     resources[resource]['query_terms'][event_terms]['times'] += 1
-#                     resources[resource]['query_terms'][event_terms]['records'] \
-#                        += event_results[resource]
-
-        # Store 'resources' in class property
-        self.resources = resources
+                    resources[resource] = ResourceAggregate(self.terms_capacity)
+                resources[resource].add_event(event_results[resource],
+                                              event_country, event_created,
+                                              event_terms)
 
-        # Finish method
         s =  "Version: %s\n" % __version__
-        s += "Created %d resources" % len(self.resources)
+        s += "Parsed %d events, %d resources so far" % (len(data), len(resources))
         logging.info(s)
         return 0
 
@@ -435,14 +1027,12 @@ class GetEvents(webapp2.RequestHandler):
         # Update (downloads|searches)_in_period and
         # (downloads|searches)_to_process in Period
         if self.t == 'download':
-            period_entity.downloads_in_period = len(self.data)
-            period_entity.records_downloaded_in_period = \
-                sum([int(x['response_records']) for x in self.data])
+            period_entity.downloads_in_period = self.events_count
+            period_entity.records_downloaded_in_period = self.records_count
             period_entity.downloads_to_process = len(self.resources)
         elif self.t == 'search':
-            period_entity.searches_in_period = len(self.data)
-            period_entity.records_searched_in_period = \
-                sum([int(x['response_records']) for x in self.data])
+            period_entity.searches_in_period = self.events_count
+            period_entity.records_searched_in_period = self.records_count
             period_entity.searches_to_process = len(self.resources)
 
         # Store updated period data
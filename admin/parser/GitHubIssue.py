@@ -9,7 +9,7 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "GitHubIssue.py 2018-12-11T14:59-03:00"
+__version__ = "GitHubIssue.py 2026-10-19T14:30-03:00"
 
 import time
 import json
@@ -20,6 +20,11 @@ from google.appengine.runtime import DeadlineExceededError
 import webapp2
 from models import Report
 from config import *
+from renderer import invalidate
+from admin.parser.PublishReports import put_and_publish
+from entitycache import entity_cache
+from timebudget import TimeBudget, checkpoint_name, continue_task
+from timebudget import next_slice_number, save_checkpoint
 from util import apikey
 
 PAGE_SIZE = 1
@@ -154,13 +159,20 @@ class GitHubIssue(webapp2.RequestHandler):
             s += "Cursor built: %s" % cursor
             logging.info(s)
 
+        # Work until the time budget is used, then hand over to a new task
+        self.budget = TimeBudget()
+        self.checkpoint = checkpoint_name("github_issue", self.period,
+                                          period_entity.run_id)
+        self.slice = next_slice_number(self.checkpoint,
+                                       self.request.get("slice", None))
+
         # Initialize loop
         if reports_query.count==0:
             more = False
         else:
             more = True
 
-        # Loop until DeadlineExceededError
+        # Loop until the time budget is used
         # or until there are no more reports left to store
         try:
             # Keep track of dataset for which Reports have been stored in this run
@@ -181,10 +193,28 @@ class GitHubIssue(webapp2.RequestHandler):
                     self.send_issue(report[0])
                     gbifdatasetid = report[0].reported_resource.id()
                     datasets.append(gbifdatasetid)
+                    self.budget.tick()
 
                 if more is True:
                     cursor = new_cursor
 
+                    # Stop between reports if another one may not fit
+                    if self.budget.exhausted():
+                        params = continue_task(self.checkpoint, self.slice,
+                                               self.budget, URI_GITHUB_ISSUE, {},
+                                               cursor.urlsafe())
+                        resp = {
+                            "status": "in progress",
+                            "message": "Time budget used. Continuing in a new task",
+                            "data": dict(params, period=self.period,
+                                         datasets=datasets)
+                        }
+                        logging.info(resp)
+                        self.response.write(json.dumps(resp)+"\n")
+                        return
+
+            save_checkpoint(self.checkpoint, self.slice, self.budget, done=True)
+
             s =  "Version: %s\n" % __version__
             s += "Finished creating all %d issues" % len(datasets)
             logging.info(s)
@@ -212,8 +242,9 @@ Issues submitted for (%d) datasets:
 Code version: %s
 """ % (self.period, len(datasets), datasets, __version__) )
 
-            # In any case, store period data, show message and finish
-            period_entity.put()
+            # Store period data and publish again the JSON reports, which
+            # include the GitHub flags, once the Period is stored as done
+            put_and_publish(period_entity, {"formats": "json"})
             s =  "Version: %s\n" % __version__
             s += "Response: %s" % resp
             logging.info(s)
@@ -221,10 +252,14 @@ Code version: %s
 
             return
 
+        # Safety net, in case a single report overruns the time budget
         except DeadlineExceededError:
             # Launch new instance with current (failed) cursor
+            params = {}
+            if cursor is not None:
+                params["cursor"] = cursor.urlsafe()
             taskqueue.add(url=URI_GITHUB_ISSUE,
-                          params={"cursor": cursor.urlsafe()},
+                          params=params,
                           queue_name=QUEUENAME)
             s =  "Version: %s\n" % __version__
             s += "Caught a DeadlineExceededError. Relaunching."
@@ -233,10 +268,7 @@ Code version: %s
             resp = {
                 "status": "in progress",
                 "message": s,
-                "data": {
-                    "period": self.period,
-                    "cursor": cursor.urlsafe()
-                }
+                "data": dict(params, period=self.period)
             }
             logging.info(resp)
             self.response.write(json.dumps(resp)+"\n")
@@ -255,7 +287,9 @@ Code version: %s
         # Build variables
         dataset_key = report_entity.reported_resource
         period_key = report_entity.reported_period
-        dataset_entity, period_entity = ndb.get_multi([dataset_key, period_key])
+        dataset_entity, period_entity = entity_cache.get_multi(
+            [dataset_key, period_key]
+        )
 
         # Check that dataset exists
         if not dataset_entity:
@@ -281,6 +315,7 @@ Code version: %s
 
             # Store updated version of Report entity
             report_entity.put()
+            invalidate([report_entity.key], formats=['json'])
 
             return
 
@@ -400,6 +435,7 @@ Thank you for being a part of VertNet.
 
         # Store updated version of Report entity
         report_entity.put()
+        invalidate([report_entity.key], formats=['json'])
 
         # Wait 2 seconds to avoid GitHub abuse triggers, 1 isn't sufficient
         time.sleep(2)
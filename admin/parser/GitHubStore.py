@@ -9,7 +9,7 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "GitHubStore.py 2018-12-11T13:58-03:00"
+__version__ = "GitHubStore.py 2026-10-19T14:30-03:00"
 
 import time
 import base64
@@ -21,7 +21,11 @@ from google.appengine.runtime import DeadlineExceededError
 import webapp2
 from models import Report, StatsRun
 from config import *
-from jinjafilters import JINJA_ENVIRONMENT
+from renderer import get_rendered, invalidate
+from admin.parser.PublishReports import put_and_publish
+from entitycache import entity_cache
+from timebudget import TimeBudget, checkpoint_name, continue_task
+from timebudget import next_slice_number, save_checkpoint
 from util import apikey
 
 PAGE_SIZE = 1
@@ -176,13 +180,20 @@ class GitHubStore(webapp2.RequestHandler):
             s += "Cursor built: %s" % cursor
             logging.info(s)
 
+        # Work until the time budget is used, then hand over to a new task
+        self.budget = TimeBudget()
+        self.checkpoint = checkpoint_name("github_store", self.period,
+                                          period_entity.run_id)
+        self.slice = next_slice_number(self.checkpoint,
+                                       self.request.get("slice", None))
+
         # Initialize loop
         if reports_query.count==0:
             more = False
         else:
             more = True
 
-        # Loop until DeadlineExceededError
+        # Loop until the time budget is used
         # or until there are no more reports left to store
         try:
             # Keep track of dataset for which Reports have been stored in this run
@@ -203,10 +214,28 @@ class GitHubStore(webapp2.RequestHandler):
                     self.store_report(report[0])
                     gbifdatasetid = report[0].reported_resource.id()
                     datasets.append(gbifdatasetid)
+                    self.budget.tick()
 
                 if more is True:
                     cursor = new_cursor
 
+                    # Stop between reports if another one may not fit
+                    if self.budget.exhausted():
+                        params = continue_task(self.checkpoint, self.slice,
+                                               self.budget, URI_GITHUB_STORE, {},
+                                               cursor.urlsafe())
+                        resp = {
+                            "status": "in progress",
+                            "message": "Time budget used. Continuing in a new task",
+                            "data": dict(params, period=self.period,
+                                         datasets=datasets)
+                        }
+                        logging.info(resp)
+                        self.response.write(json.dumps(resp)+"\n")
+                        return
+
+            save_checkpoint(self.checkpoint, self.slice, self.budget, done=True)
+
             s =  "Version: %s\n" % __version__
             s += "Finished storing all %d reports" % len(datasets)
             logging.info(s)
@@ -217,6 +246,7 @@ class GitHubStore(webapp2.RequestHandler):
             }
 
             # Launch process to create issues on GitHub, if applicable
+            publish = False
             if self.github_issue is True:
                 resp['message'] += ". Launching GitHub issue process"
                 taskqueue.add(url=URI_GITHUB_ISSUE, queue_name=QUEUENAME)
@@ -225,6 +255,8 @@ class GitHubStore(webapp2.RequestHandler):
             else:
                 resp['message'] += ". No GitHub Issues process launched"
                 period_entity.status = "done"
+                # Publish again the JSON reports, which include the GitHub flags
+                publish = True
                 mail.send_mail(
                     sender=EMAIL_SENDER,
                     to=EMAIL_ADMINS,
@@ -242,8 +274,12 @@ Reports (%d) stored for datasets:
 Code version: %s
 """ % (self.period, len(datasets), datasets, __version__ ) )
 
-            # In any case, store period data, show message and finish
-            period_entity.put()
+            # In any case, store period data, show message and finish. The
+            # JSON reports are published once the Period is stored as done
+            if publish is True:
+                put_and_publish(period_entity, {"formats": "json"})
+            else:
+                period_entity.put()
             s =  "Version: %s\n" % __version__
             s += "Response: %s" % resp
             logging.info(s)
@@ -251,10 +287,14 @@ Code version: %s
 
             return
 
+        # Safety net, in case a single report overruns the time budget
         except DeadlineExceededError:
             # Launch new instance with current (failed) cursor
+            params = {}
+            if cursor is not None:
+                params["cursor"] = cursor.urlsafe()
             taskqueue.add(url=URI_GITHUB_STORE,
-                          params={"cursor": cursor.urlsafe()},
+                          params=params,
                           queue_name=QUEUENAME)
             s =  "Version: %s\n" % __version__
             s += "Caught a DeadlineExceededError. Relaunching."
@@ -263,10 +303,7 @@ Code version: %s
             resp = {
                 "status": "in progress",
                 "message": s,
-                "data": {
-                    "period": self.period,
-                    "cursor": cursor.urlsafe()
-                }
+                "data": dict(params, period=self.period)
             }
             logging.info(resp)
             self.response.write(json.dumps(resp)+"\n")
@@ -279,7 +316,9 @@ Code version: %s
         # Build variables
         dataset_key = report_entity.reported_resource
         period_key = report_entity.reported_period
-        dataset_entity, period_entity = ndb.get_multi([dataset_key, period_key])
+        dataset_entity, period_entity = entity_cache.get_multi(
+            [dataset_key, period_key]
+        )
         report_key = report_entity.key
         gbifdatasetid = report_entity.reported_resource.id()
 
@@ -307,6 +346,7 @@ Code version: %s
 
             # Store updated version of Report entity
             report_entity.put()
+            invalidate([report_entity.key], formats=['json'])
 
             return
 
@@ -330,15 +370,8 @@ Code version: %s
             "Accept": "application/vnd.github.v3+json"
         }
 
-        # Load template
-        template = JINJA_ENVIRONMENT.get_template('report.txt')
-
-        # Render template with values from Report
-        content = template.render(
-            dataset=dataset_entity,
-            report=report_entity,
-            period=period_entity
-        )
+        # Published TXT report, rendered only if it was not published
+        content = get_rendered(report_entity.key, 'txt')['body'].decode('utf-8')
 
         # Build GitHub request parameters: message
         message = content.split("\n")[1]  # 2nd line of txt report
@@ -418,6 +451,7 @@ Code version: %s
 
         # Store updated version of Report entity
         report_entity.put()
+        invalidate([report_entity.key], formats=['json'])
 
         # Wait 2 seconds to avoid GitHub abuse triggers. 1 isn't sufficient.
         time.sleep(2)
@@ -9,14 +9,18 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "InitExtraction.py 2018-12-10T17:43-03:00"
+__version__ = "InitExtraction.py 2026-10-19T10:00-03:00"
 
 import json
 import logging
+from datetime import datetime
 from google.appengine.ext import ndb
 from google.appengine.api import taskqueue
 import webapp2
 from models import Period, ReportToProcess, Report, StatsRun
+from models import ReportToProcessChunk
+from renderer import invalidate
+from reportbuilder import archive_key, unindex_reports
 from config import *
 
 class InitExtraction(webapp2.RequestHandler):
@@ -64,6 +68,24 @@ class InitExtraction(webapp2.RequestHandler):
         self.github_issue = self.request.get('github_issue').lower() == 'true'
         # Get default table name, CDB_TABLE, from config.py
         self.table_name = self.request.get('table_name', CDB_TABLE)
+        # Get default extraction page size, CDB_PAGE_SIZE, from config.py
+        try:
+            self.page_size = int(self.request.get('page_size', CDB_PAGE_SIZE))
+        except ValueError:
+            self.page_size = CDB_PAGE_SIZE
+        # Aggregate events in Carto ('server') or in GetEvents ('client')
+        self.aggregation = self.request.get('aggregation', 'client').lower()
+        if self.aggregation not in ['client', 'server']:
+            self.aggregation = 'client'
+        # Extract each day of the period in a separate task
+        self.sharded = self.request.get('sharded').lower() == 'true'
+        # Extract again days already stored as daily rollups
+        self.refresh_rollups = \
+            self.request.get('refresh_rollups').lower() == 'true'
+        # Build Reports straight from the extracted events, in memory
+        self.pipeline = self.request.get('pipeline').lower() == 'true'
+        # Count query terms with a bounded sketch
+        self.terms_sketch = self.request.get('terms_sketch').lower() == 'true'
         return 0
 
     def persist_parameters(self):
@@ -115,6 +137,13 @@ class InitExtraction(webapp2.RequestHandler):
         period_entity.github_store = self.github_store
         period_entity.github_issue = self.github_issue
         period_entity.table_name = self.table_name
+        period_entity.page_size = self.page_size
+        period_entity.aggregation = self.aggregation
+        period_entity.sharded = self.sharded
+        period_entity.refresh_rollups = self.refresh_rollups
+        period_entity.pipeline = self.pipeline
+        period_entity.terms_sketch = self.terms_sketch
+        period_entity.run_id = datetime.now().strftime('%Y%m%d%H%M%S')
         period_entity.searches_extracted = False
         period_entity.downloads_extracted = False
         period_entity.processed_searches = 0
@@ -148,6 +177,13 @@ class InitExtraction(webapp2.RequestHandler):
         s += "\n%s" % period_entity.github_store
         s += "\n%s" % period_entity.github_issue
         s += "\n%s" % period_entity.table_name
+        s += "\n%s" % period_entity.page_size
+        s += "\n%s" % period_entity.aggregation
+        s += "\n%s" % period_entity.sharded
+        s += "\n%s" % period_entity.refresh_rollups
+        s += "\n%s" % period_entity.pipeline
+        s += "\n%s" % period_entity.terms_sketch
+        s += "\n%s" % period_entity.run_id
         s += "\n%s" % period_entity.searches_extracted
         s += "\n%s" % period_entity.downloads_extracted
         s += "\n%s" % period_entity.processed_searches
@@ -210,17 +246,26 @@ class InitExtraction(webapp2.RequestHandler):
                 s += "Overriding."
                 logging.warning(s)
 
-                # Delete Reports referencing period
+                # Delete Reports referencing period, with their query terms
+                # archives
                 r = Report.query().filter(Report.reported_period == period_key)
                 to_delete = r.fetch(keys_only=True)
                 s =  "Version: %s\n" % __version__
                 s += "Deleting %d Report entities" % len(to_delete)
                 logging.info(s)
                 deleted = ndb.delete_multi(to_delete)
+                ndb.delete_multi([archive_key(x, t) for x in to_delete
+                                  for t in ["search", "download"]])
+
+                # Stop serving their cached and published renderings
+                invalidate(to_delete)
                 s =  "Version: %s\n" % __version__
                 s += "%d Report entities removed" % len(deleted)
                 logging.info(s)
 
+                # Remove the period from the indexes of the datasets
+                unindex_reports(to_delete)
+
                 # Delete Period itself
                 s =  "Version: %s\n" % __version__
                 s += "Deleting Period %s" % period_key
@@ -261,6 +306,7 @@ class InitExtraction(webapp2.RequestHandler):
 
         # Clear temporary entities
         keys_to_delete = ReportToProcess.query().fetch(keys_only=True)
+        keys_to_delete += ReportToProcessChunk.query().fetch(keys_only=True)
         s =  "Version: %s\n" % __version__
         s += "Deleting %d temporal (internal use only) entities" % len(keys_to_delete)
         logging.info(s)
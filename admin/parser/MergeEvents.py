@@ -0,0 +1,146 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "MergeEvents.py 2026-10-18T19:20-03:00"
+
+import json
+import logging
+from google.appengine.ext import ndb
+from google.appengine.api import taskqueue
+import webapp2
+from aggregate import ResourceAggregate
+from models import DailyAggregate, ReportToProcess
+from util import month_days
+from config import *
+
+class MergeEvents(webapp2.RequestHandler):
+    """Merge the day shards of a sharded extraction into ReportToProcess entities.
+
+Enqueued by the last 'GetEvents' day shard to finish. Plays the role of the
+final steps of a serial 'GetEvents' run for every event type extracted in
+shards: updates the Period counts, stores the resources to process and
+launches 'ProcessEvents'.
+"""
+    def post(self):
+
+        s =  "Version: %s\n" % __version__
+        s += "Arguments from POST:"
+        for arg in self.request.arguments():
+            s += '\n%s:%s' % (arg, self.request.get(arg))
+        logging.info(s)
+
+        # Try to get period from the request
+        self.period = self.request.get("period", None)
+
+        # If not in request, get it from StatsRun entity
+        if self.period is None or len(self.period)==0:
+            run_key = ndb.Key("StatsRun", 5759180434571264)
+            run_entity = run_key.get()
+            self.period = run_entity.period
+
+        # If Period not already stored, halt
+        period_key = ndb.Key("Period", self.period)
+        period_entity = period_key.get()
+        if not period_entity:
+            self.error(400)
+            resp = {
+                "status": "error",
+                "message": "Provided period does not exist in datastore",
+                "data": {
+                    "period": self.period
+                }
+            }
+            logging.error(resp)
+            self.response.write(json.dumps(resp)+"\n")
+            return
+
+        counts = {}
+        for t in ["download", "search"]:
+            if t == "download" and period_entity.downloads_extracted is True:
+                continue
+            if t == "search" and period_entity.searches_extracted is True:
+                continue
+
+            keys = [DailyAggregate.build_key(t, day)
+                    for day in month_days(self.period)]
+            shards = ndb.get_multi(keys)
+            missing = [k.id() for k, x in zip(keys, shards)
+                       if x is None or not x.ready_for(period_entity)]
+            if len(missing) > 0:
+                self.error(500)
+                resp = {
+                    "status": "error",
+                    "message": "Missing day shards, can't merge",
+                    "data": {
+                        "period": self.period,
+                        "missing": missing
+                    }
+                }
+                logging.error(resp)
+                self.response.write(json.dumps(resp)+"\n")
+                return
+
+            counts[t] = self.merge(t, shards, period_entity)
+
+        # Everything extracted, store Period and move on
+        period_entity.downloads_extracted = True
+        period_entity.searches_extracted = True
+        period_entity.put()
+
+        taskqueue.add(url=URI_PROCESS_EVENTS, queue_name=QUEUENAME)
+
+        resp = {
+            "status": "success",
+            "message": "All day shards merged. Launching process_events",
+            "data": {
+                "period": self.period,
+                "counts": counts
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp)+"\n")
+        return
+
+    def merge(self, t, shards, period_entity):
+        """Merge the shards of one event type and store the resources."""
+        resources = {}
+        events = 0
+        records = 0
+        for shard in shards:
+            events += shard.events
+            records += shard.records
+            for resource, aggregate in shard.resources.items():
+                if resource not in resources:
+                    resources[resource] = ResourceAggregate()
+                resources[resource].merge(ResourceAggregate.from_dict(aggregate))
+
+        # Update Period counts
+        if t == 'download':
+            period_entity.downloads_in_period = events
+            period_entity.records_downloaded_in_period = records
+            period_entity.downloads_to_process = len(resources)
+        else:
+            period_entity.searches_in_period = events
+            period_entity.records_searched_in_period = records
+            period_entity.searches_to_process = len(resources)
+
+        # Store temporary entities. Keys are deterministic, so a retried
+        # merge overwrites the entities of a previous attempt
+        r = []
+        for resource in resources:
+            r.extend(ReportToProcess.build(t, resource, resources[resource]))
+        ndb.put_multi(r)
+
+        s =  "Version: %s\n" % __version__
+        s += "Merged %d %s shards: %d events " % (len(shards), t, events)
+        s += "into %d resources" % len(resources)
+        logging.info(s)
+        return {"events": events, "records": records, "resources": len(resources)}
@@ -9,25 +9,37 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "ProcessEvents.py 2018-12-11T11:36-03:00"
+__version__ = "ProcessEvents.py 2026-10-19T14:45-03:00"
 
 import json
 import logging
 from datetime import datetime
-from google.appengine.api import mail, taskqueue
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 from google.appengine.runtime import DeadlineExceededError
 from google.appengine.datastore.datastore_query import Cursor
 import webapp2
+from aggregate import ResourceAggregate
+from counters import get_counts, increment, period_counter
 from models import ReportToProcess
-from models import QueryCountry, QueryDate, QueryTerms
-from models import Report, Search, Download, StatsRun
+from models import StatsRun, ProcessShard
+from renderer import invalidate
+from reportbuilder import build_reports, index_reports
+from timebudget import TimeBudget, checkpoint_name, continue_task
+from timebudget import next_slice_number, save_checkpoint
 from config import *
 
 PAGE_SIZE = 10
 
 class ProcessEvents(webapp2.RequestHandler):
-    """Process a single resource and create a Report entity."""
+    """Process the ReportToProcess entities and create Report entities.
+
+Without a 'shard' parameter, launches 'shards' tasks (PROCESS_SHARDS by
+default), each over a range of gbifdatasetid, that run in parallel. The last
+shard to finish launches a single 'finalize' task, which publishes the
+reports (see PublishReports), then starts the GitHub processes or closes the
+run.
+"""
     def post(self):
 
         s =  "Version: %s\n" % __version__
@@ -82,20 +94,55 @@ class ProcessEvents(webapp2.RequestHandler):
 
         self.github_store = period_entity.github_store
         self.github_issue = period_entity.github_issue
+        self.counters = dict((x, period_counter(period_entity, x))
+                             for x in ["processed_searches", "processed_downloads"])
+
+        # Last step, launched once by the last shard to finish
+        if self.request.get("finalize", "").lower() == "true":
+            self.finalize()
+            return
+
+        # No shard in request, launch them
+        shard = self.request.get("shard", None)
+        if shard is None or len(shard) == 0:
+            try:
+                shards = int(self.request.get("shards", PROCESS_SHARDS))
+            except ValueError:
+                shards = PROCESS_SHARDS
+            self.fan_out(period_entity, max(shards, 1))
+            return
+
+        self.shard = int(shard)
+        self.shards = int(self.request.get("shards"))
+        self.attempt = self.request.get("attempt", None)
+        cursor = None
+
+        # Work until the time budget is used, then hand over to a new task
+        self.budget = TimeBudget()
+        self.checkpoint = checkpoint_name("process_events", self.period,
+                                          period_entity.run_id, self.shard)
+        self.slice = next_slice_number(self.checkpoint,
+                                       self.request.get("slice", None))
 
-        # Start the loop, until deadline
+        # Start the loop, until the time budget is used
         try:
 
-            # Prepare query for all Reports to process
+            # Prepare query for the Reports to process in this shard
             query = ReportToProcess.query()
+            lower, upper = shard_range(self.shard, self.shards)
+            if lower is not None:
+                query = query.filter(ReportToProcess.gbifdatasetid >= lower)
+            if upper is not None:
+                query = query.filter(ReportToProcess.gbifdatasetid < upper)
             query = query.order(ReportToProcess.gbifdatasetid)
             s =  "Version: %s\n" % __version__
-            s += "ReportToProcess queried"
+            s += "ReportToProcess queried for shard %d of %d " % (self.shard,
+                                                                 self.shards)
+            s += "(gbifdatasetid from %s to %s)" % (lower, upper)
             logging.info(s)
 
             # Get cursor from request, if any
             cursor_str = self.request.get('cursor', None)
-            cursor = None
             if cursor_str:
                 cursor = Cursor(urlsafe=cursor_str)
             s =  "Version: %s\n" % __version__
@@ -109,16 +156,31 @@ class ProcessEvents(webapp2.RequestHandler):
             while more is True:
 
                 # Get the next (or first) round of elements
-                logging.info("Fetching %d entities" % PAGE_SIZE)
+                logging.info("Fetching %d keys" % PAGE_SIZE)
                 results, new_cursor, more = query.fetch_page(
-                    PAGE_SIZE, start_cursor=cursor
+                    PAGE_SIZE, start_cursor=cursor, keys_only=True
                 )
                 s =  "Version: %s\n" % __version__
                 s += "Got %d results" % len(results)
                 logging.info(s)
 
-                # Process and store transactionally
-                self.process_and_store(results)
+                # Both event types of a dataset are processed together, so
+                # only the datasets are taken from the page. Entities stored
+                # before they were keyed by dataset have integer ids, and are
+                # read by their own keys
+                datasets = sorted(set([x.id().split("|", 1)[1]
+                                       for x in results
+                                       if isinstance(x.id(), basestring)]))
+                legacy_keys = [x for x in results
+                               if not isinstance(x.id(), basestring)]
+
+                # Process and store transactionally, then drop the cached
+                # renderings of the rewritten Reports and add them to the
+                # period indexes of their datasets
+                reports = self.process_and_store(datasets, legacy_keys)
+                invalidate([x.key for x in reports])
+                index_reports(reports)
+                self.budget.tick(len(datasets))
 
                 # Restart with new cursor (if any)
                 if more is True:
@@ -127,62 +189,58 @@ class ProcessEvents(webapp2.RequestHandler):
                     s += "New cursor: %s" % cursor.urlsafe()
                     logging.info(s)
 
+                    # Stop between batches if another one may not fit
+                    if self.budget.exhausted():
+                        params = continue_task(
+                            self.checkpoint, self.slice, self.budget,
+                            URI_PROCESS_EVENTS,
+                            {"period": self.period, "shard": self.shard,
+                             "shards": self.shards, "attempt": self.attempt},
+                            cursor.urlsafe()
+                        )
+                        resp = {
+                            "status": "in progress",
+                            "message": "Time budget used. Continuing in a new task",
+                            "data": dict(params, processed=self.budget.units)
+                        }
+                        logging.info(resp)
+                        self.response.write(json.dumps(resp)+"\n")
+                        return
+
             s =  "Version: %s\n" % __version__
-            s += "Finished processing reports"
+            s += "Finished processing reports of shard %d" % self.shard
             logging.info(s)
+            save_checkpoint(self.checkpoint, self.slice, self.budget, done=True)
 
-            period_entity = ndb.Key("Period", self.period).get()
+            self.check_shards(period_entity)
 
             resp = {
                 "status": "success",
-                "message": "Successfully finished processing all reports",
+                "message": "Successfully finished processing shard",
                 "data": {
-                    "processed_searches": period_entity.processed_searches,
-                    "processed_downloads": period_entity.processed_downloads
+                    "period": self.period,
+                    "shard": self.shard,
+                    "shards": self.shards
                 }
             }
-
-            # Launch process to store reports on GitHub, if applicable
-            if self.github_store is True:
-                resp['message'] += ". Launching GitHub storing process"
-                taskqueue.add(url=URI_GITHUB_STORE,
-                              queue_name=QUEUENAME)
-
-            # Launch process to create issues on GitHub, if applicable
-            elif self.github_issue is True:
-                resp['message'] += ". Launching GitHub issue process"
-                taskqueue.add(url=URI_GITHUB_ISSUE,
-                              queue_name=QUEUENAME)
-
-            # Otherwise, consider finished
-            else:
-                resp['message'] += ". No GitHub process launched"
-                period_entity.status = "done"
-                mail.send_mail(
-                    sender=EMAIL_SENDER,
-                    to=EMAIL_RECIPIENT,
-                    subject="Usage reports for period %s" % self.period,
-                    body="""
-Hey there!
-
-Just a brief note to let you know the extraction of %s stats has 
-successfully finished, with no GitHub processes launched.
-
-Congrats!
-""" % self.period)
-
-            # In any case, store the status, show message and finish
-            period_entity.put()
             logging.info(resp)
             self.response.write(json.dumps(resp)+"\n")
 
             return
 
-        # When timeout arrives...
+        # When timeout arrives anyway (e.g., a batch slower than the margin)...
         except DeadlineExceededError:
-            # Launch new instance with current (failed) cursor
+            # Launch new instance of the shard with current (failed) cursor
+            params = {
+                "period": self.period,
+                "shard": self.shard,
+                "shards": self.shards,
+                "attempt": self.attempt
+            }
+            if cursor is not None:
+                params["cursor"] = cursor.urlsafe()
             taskqueue.add(url=URI_PROCESS_EVENTS,
-                          params={"cursor": cursor.urlsafe()},
+                          params=params,
                           queue_name=QUEUENAME)
             s =  "Version: %s\n" % __version__
             s += "Caught a DeadlineExceededError. Relaunching"
@@ -192,166 +250,228 @@ Congrats!
                 "status": "in progress",
                 "message": "Caught a DeadlineExceededError."
                            " Relaunching with new cursor",
-                "data": {
-                    "period": self.period,
-                    "cursor": cursor.urlsafe()
-                }
+                "data": params
             }
             logging.info(resp)
             self.response.write(json.dumps(resp)+"\n")
 
         return
 
+    def fan_out(self, period_entity, shards):
+        """Launch one task per range of gbifdatasetid.
+
+Each fan-out is a new attempt, so running process_events again within the
+same run names its finalize task anew (see check_shards).
+"""
+        attempt = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        ndb.put_multi([ProcessShard(
+            key=ProcessShard.build_key(self.period, period_entity.run_id, i),
+            period=self.period,
+            run_id=period_entity.run_id,
+            shard=i,
+            attempt=attempt
+        ) for i in range(shards)])
+
+        tasks = [taskqueue.Task(url=URI_PROCESS_EVENTS,
+                                params={"period": self.period,
+                                        "shard": i,
+                                        "shards": shards,
+                                        "attempt": attempt})
+                 for i in range(shards)]
+        queue = taskqueue.Queue(QUEUENAME)
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+        resp = {
+            "status": "success",
+            "message": "Launched %d process_events shards" % shards,
+            "data": {
+                "period": self.period,
+                "shards": shards,
+                "attempt": attempt
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp)+"\n")
+        return
+
+    def check_shards(self, period_entity):
+        """Mark this shard as done and finalize if every shard is.
+
+Shards are looked up by key, which is strongly consistent, so at least the
+last shard to finish sees all of them done. The finalize task is named after
+the run and the fan-out attempt, so it is enqueued only once even if several
+shards see it. Shards of an earlier attempt of the same run are ignored.
+"""
+        run_id = period_entity.run_id
+        key = ProcessShard.build_key(self.period, run_id, self.shard)
+        shard_entity = key.get()
+        if shard_entity is not None and shard_entity.attempt != self.attempt:
+            s =  "Version: %s\n" % __version__
+            s += "Shard %d belongs to an earlier attempt" % self.shard
+            logging.info(s)
+            return
+        shard_entity = ProcessShard(
+            key=key,
+            period=self.period,
+            run_id=run_id,
+            shard=self.shard,
+            attempt=self.attempt,
+            done=True
+        )
+        shard_entity.put()
+
+        keys = [ProcessShard.build_key(self.period, run_id, i)
+                for i in range(self.shards)]
+        done = [x for x in ndb.get_multi(keys) if x is not None and x.done
+                and x.attempt == self.attempt]
+        if len(done) < len(keys):
+            s =  "Version: %s\n" % __version__
+            s += "%d of %d process shards done" % (len(done), len(keys))
+            logging.info(s)
+            return
+
+        name = "process-%s-%s-%s" % (self.period, run_id, self.attempt)
+        try:
+            taskqueue.add(name=name, url=URI_PROCESS_EVENTS,
+                          params={"period": self.period, "finalize": "true",
+                                  "attempt": self.attempt},
+                          queue_name=QUEUENAME)
+            s =  "Version: %s\n" % __version__
+            s += "All %d process shards done. Task %s enqueued" % (len(keys), name)
+            logging.info(s)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            s =  "Version: %s\n" % __version__
+            s += "Task %s already enqueued" % name
+            logging.info(s)
+        return
+
+    def finalize(self):
+        """Keep the final counts in the Period and publish the reports."""
+        period_entity = ndb.Key("Period", self.period).get()
+
+        # Keep the final progress counts in the Period
+        counts = get_counts(self.counters.values())
+        period_entity.processed_searches = counts[self.counters["processed_searches"]]
+        period_entity.processed_downloads = counts[self.counters["processed_downloads"]]
+
+        resp = {
+            "status": "success",
+            "message": "Successfully finished processing all reports",
+            "data": {
+                "processed_searches": period_entity.processed_searches,
+                "processed_downloads": period_entity.processed_downloads
+            }
+        }
+
+        # Render and store the reports once. The publishing task starts the
+        # GitHub processes, or closes the run, when done. It is named after
+        # the fan-out attempt; a finalize launched by hand is a new attempt
+        attempt = self.request.get("attempt", None)
+        if not attempt:
+            attempt = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        name = "publish-%s-%s-%s" % (self.period, period_entity.run_id, attempt)
+        # Store the final counts first, the publishing task renders them. The
+        # task name makes a retried finalize enqueue it only once
+        period_entity.put()
+        try:
+            taskqueue.add(name=name, url=URI_PUBLISH_REPORTS,
+                          params={"period": self.period, "launch": "true"},
+                          queue_name=QUEUENAME)
+            resp['message'] += ". Publishing reports"
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            resp['message'] += ". Reports already being published"
+
+        logging.info(resp)
+        self.response.write(json.dumps(resp)+"\n")
+        return
+
     @ndb.transactional(xg=True)
-    def process_and_store(self, results):
-        """Process the batch of results into new reports.
+    def process_and_store(self, datasets, legacy_keys=()):
+        """Process the pending searches and downloads of a batch of datasets.
 
 This function is executed transactionally, meaning either all reports are
 processed and stored or none are. This ensures integrity in the number of
-reports that are stored even when the DeadlineExceededError is raised.
+reports that are stored even when the DeadlineExceededError is raised. The
+progress counters are incremented within the same transaction.
+
+The ReportToProcess entities are read by key inside the transaction, so those
+already processed along with the other event type of their dataset are not
+processed again. Entities with integer ids, written before they were keyed by
+dataset, are read by the keys in 'legacy_keys'.
 """
 
+        # Batch-get the pending entities of both event types
+        keys = [ReportToProcess.build_key(t, gbifdatasetid)
+                for gbifdatasetid in datasets
+                for t in ["search", "download"]]
+        keys += list(legacy_keys)
+        results = [x for x in ndb.get_multi(keys) if x is not None]
+
         # Batch-process the reports
         reports_to_store, keys_to_delete, counts = self.process_events(results)
 
         # Batch-store the new Reports
         ndb.put_multi(reports_to_store)
 
-        # Update count in period
-        period_entity = ndb.Key("Period", self.period).get()
-        period_entity.processed_searches=\
-          period_entity.processed_searches+counts['processed_searches']
-        period_entity.processed_downloads=\
-          period_entity.processed_downloads+counts['processed_downloads']
-
-        period_entity.put()
+        # Update progress counters, not the Period entity, so parallel
+        # shards do not contend for it
+        for field in counts:
+            if counts[field] > 0:
+                increment(self.counters[field], counts[field])
 
-        # Batch-delete the ReportsToProcess entities
+        # Batch-delete the ReportsToProcess entities, and the query terms
+        # archives the new Reports no longer need
         ndb.delete_multi(keys_to_delete)
 
+        return [x for x in reports_to_store if x.key.kind() == 'Report']
+
     def process_events(self, results):
-        """Transform the batch of ReportsToProcess entities into Reports."""
+        """Transform the batch of ReportsToProcess entities into Reports.
+
+Each Report is read once and built with the searches and downloads of its
+dataset, so it is written once per batch.
+"""
 
-        reports_to_store = []
         keys_to_delete = []
         counts = {"processed_searches": 0, "processed_downloads": 0}
 
+        datasets = {}
         for resource_entry in results:
-            reports_to_store.append(self.process_resource(resource_entry))
+            s =  "Version: %s\n" % __version__
+            s += "Processing %s %s" % (resource_entry.t,
+                                       resource_entry.gbifdatasetid)
+            logging.info(s)
+
+            datasets.setdefault(resource_entry.gbifdatasetid, {})\
+                [resource_entry.t] = self.load_aggregate(resource_entry)
             keys_to_delete.append(resource_entry.key)
+            keys_to_delete.extend(resource_entry.chunk_keys())
             if resource_entry.t == "search":
                 counts['processed_searches'] += 1
             else:
                 counts['processed_downloads'] += 1
 
-        return reports_to_store, keys_to_delete, counts
-
-    def process_resource(self, resource_entry):
-        """Transform each ReportToProcess into a proper Report."""
-
-        # Load variables from stored entity
-        t = resource_entry.t
-        gbifdatasetid = resource_entry.gbifdatasetid
-        event = resource_entry.resource
-
-        s =  "Version: %s\n" % __version__
-        s += "Processing %s" % gbifdatasetid
-        logging.info(s)
-
-        # Extract useful information
-        number_of_records = event['records']
-
-        query_countries = [QueryCountry(**x)
-                           for x in event['query_countries'].values()]
-        query_dates = [QueryDate(query_date=datetime.strptime(
-                                                          x['query_date'],
-                                                          '%Y-%m-%d'),
-                                 times=x['times'])
-                       for x in event['query_dates'].values()]
-        query_terms = [QueryTerms(**x) for x in event['query_terms'].values()]
+        reports_to_store, stale_archives = build_reports(self.period, datasets)
+        keys_to_delete.extend(stale_archives)
 
-        # Build report ID
-        report_id = "|".join([self.period, gbifdatasetid])
-
-        # Build dataset key
-        dataset_key = ndb.Key("Dataset", gbifdatasetid)
-
-        # Build period key
-        period_key = ndb.Key("Period", self.period)
+        return reports_to_store, keys_to_delete, counts
 
-        # QC
-        sum_query_countries = 0
-        for i in event['query_countries'].values():
-            sum_query_countries += i['times']
-
-        sum_query_dates = 0
-        for i in event['query_dates'].values():
-            sum_query_dates += i['times']
-
-        sum_query_terms = 0
-        for i in event['query_terms'].values():
-            sum_query_terms += i['times']
-
-        if sum_query_countries != sum_query_dates or \
-            sum_query_countries != sum_query_terms or \
-                sum_query_dates != sum_query_terms:
-            logging.warning("WARNING: lengths of query entities keys list"
-                            "do not match:")
-            logging.warning("Query countries: %d" % sum_query_countries)
-            logging.warning("Query dates: %d" % sum_query_dates)
-            logging.warning("Query terms: %d" % sum_query_terms)
-            number_of_events = max([sum_query_countries,
-                                    sum_query_countries,
-                                    sum_query_countries])
-        else:
-            number_of_events = sum_query_countries
-
-        # Get existing or create new Report entity
-        s =  "Version: %s\n" % __version__
-        s += "Retrieving existing report or creating new one"
-        logging.info(s)
-        report = Report.get_or_insert(
-            report_id,
-            parent=period_key,
-            created=datetime.today(),
-            reported_period=period_key,
-            reported_resource=dataset_key,
-            searches=Search(
-                events=0,
-                records=0,
-                query_countries=[],
-                query_dates=[],
-                query_terms=[],
-                # status="in progress"
-            ),
-            downloads=Download(
-                events=0,
-                records=0,
-                query_countries=[],
-                query_dates=[],
-                query_terms=[],
-                # status="in progress"
-            ),
-            stored=False,
-            issue_sent=False
-        )
+    def load_aggregate(self, resource_entry):
+        """Return the ResourceAggregate stored in a ReportToProcess."""
+        if resource_entry.data is not None:
+            return ResourceAggregate.decode(resource_entry.get_data())
+        return ResourceAggregate.from_dict(resource_entry.resource)
 
-        # Populate event data
-        s =  "Version: %s\n" % __version__
-        s += "Storing %s data" % t
-        logging.info(s)
+def shard_range(shard, shards):
+    """Return the gbifdatasetid bounds (lower, upper) of a shard.
 
-        if t == 'search':
-            report.searches.records = number_of_records
-            report.searches.events = number_of_events
-            report.searches.query_countries = query_countries
-            report.searches.query_dates = query_dates
-            report.searches.query_terms = query_terms
-        elif t == 'download':
-            report.downloads.records = number_of_records
-            report.downloads.events = number_of_events
-            report.downloads.query_countries = query_countries
-            report.downloads.query_dates = query_dates
-            report.downloads.query_terms = query_terms
-
-        return report
+The hexadecimal space of gbifdatasetid is split in equal ranges. The first
+shard has no lower bound and the last one has no upper bound, so every id
+falls in exactly one shard. A bound of None means unbounded.
+"""
+    def bound(i):
+        if i <= 0 or i >= shards:
+            return None
+        return "%04x" % (i * 0x10000 // shards)
+    return bound(shard), bound(shard + 1)
@@ -0,0 +1,180 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "PublishReports.py 2026-10-19T14:30-03:00"
+
+import json
+import logging
+from google.appengine.api import mail, taskqueue
+from google.appengine.ext import ndb
+import webapp2
+from models import Report
+from renderer import RENDER_FORMATS, publish_reports
+from entitycache import entity_cache
+from timebudget import TimeBudget, checkpoint_name, continue_task
+from timebudget import next_slice_number, save_checkpoint
+from config import *
+
+PAGE_SIZE = 50
+
+@ndb.transactional
+def put_and_publish(period_entity, params):
+    """Store a Period and enqueue the publication of its Reports, atomically.
+
+The task is added only if the Period is stored, so it never reads the Period
+as it was before.
+"""
+    period_entity.put()
+    taskqueue.add(url=URI_PUBLISH_REPORTS,
+                  params=dict(params, period=period_entity.key.id()),
+                  queue_name=QUEUENAME, transactional=True)
+
+class PublishReports(webapp2.RequestHandler):
+    """Render the Reports of a period and store them as artifacts.
+
+Each Report is rendered once in each format (HTML, TXT and gzipped JSON) and
+stored in the artifact store (see artifacts.py), from which the viewers and
+GitHubStore read them, without rendering the Report again.
+
+Parameters:
+  period: YYYYMM period to publish. If not provided, the one being processed
+  formats: comma-separated formats to publish (default html,txt,json)
+  launch: true/false, start the GitHub processes, or close the run, once all
+          Reports are published (default False)
+"""
+    def post(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        s =  "Version: %s\n" % __version__
+        s += "Arguments from POST:"
+        for arg in self.request.arguments():
+            s += '\n%s:%s' % (arg, self.request.get(arg))
+        logging.info(s)
+
+        # Period from the request, or the one being processed
+        self.period = self.request.get("period", None)
+        if not self.period:
+            run_entity = ndb.Key("StatsRun", 5759180434571264).get()
+            self.period = run_entity.period
+
+        period_key = ndb.Key("Period", self.period)
+        period_entity = period_key.get()
+        if not period_entity:
+            self.error(400)
+            resp = {
+                "status": "error",
+                "message": "Provided period does not exist in datastore",
+                "data": {
+                    "period": self.period
+                }
+            }
+            logging.error(resp)
+            self.response.write(json.dumps(resp)+"\n")
+            return
+
+        formats = self.request.get("formats", ",".join(RENDER_FORMATS))
+        formats = [x.strip() for x in formats.split(",")
+                   if x.strip() in RENDER_FORMATS]
+        launch = self.request.get("launch").lower() == "true"
+
+        reports_query = Report.query(Report.reported_period == period_key)
+
+        # Get cursor from request, if any
+        cursor_str = self.request.get("cursor", None)
+        cursor = None
+        if cursor_str:
+            cursor = ndb.Cursor(urlsafe=cursor_str)
+
+        # Work until the time budget is used, then hand over to a new task
+        budget = TimeBudget()
+        checkpoint = checkpoint_name("publish_reports", self.period,
+                                     period_entity.run_id, *formats)
+        slice_number = next_slice_number(checkpoint,
+                                         self.request.get("slice", None))
+
+        cache_stats = entity_cache.snapshot()
+        published = 0
+        more = True
+        while more is True:
+            reports, cursor, more = reports_query.fetch_page(
+                PAGE_SIZE, start_cursor=cursor
+            )
+            if len(reports) > 0:
+                published += publish_reports(reports, period_entity, formats)
+            budget.tick(len(reports))
+
+            # Stop between pages if another one may not fit
+            if more is True and budget.exhausted():
+                params = continue_task(checkpoint, slice_number, budget,
+                                       URI_PUBLISH_REPORTS,
+                                       {"period": self.period,
+                                        "formats": ",".join(formats),
+                                        "launch": str(launch).lower()},
+                                       cursor.urlsafe())
+                resp = {
+                    "status": "in progress",
+                    "message": "Time budget used. Continuing in a new task",
+                    "data": dict(params, published=published,
+                                 entity_cache=entity_cache.since(cache_stats))
+                }
+                logging.info(resp)
+                self.response.write(json.dumps(resp)+"\n")
+                return
+
+        save_checkpoint(checkpoint, slice_number, budget, done=True)
+
+        resp = {
+            "status": "success",
+            "message": "Reports of period %s published" % self.period,
+            "data": {
+                "period": self.period,
+                "formats": formats,
+                "artifacts": published,
+                "entity_cache": entity_cache.since(cache_stats)
+            }
+        }
+        if launch is True:
+            self.launch_github(period_entity, resp)
+        logging.info(resp)
+        self.response.write(json.dumps(resp)+"\n")
+
+    def launch_github(self, period_entity, resp):
+        """Launch the GitHub processes, or finish the run."""
+
+        # Launch process to store reports on GitHub, if applicable
+        if period_entity.github_store is True:
+            resp['message'] += ". Launching GitHub storing process"
+            taskqueue.add(url=URI_GITHUB_STORE,
+                          queue_name=QUEUENAME)
+
+        # Launch process to create issues on GitHub, if applicable
+        elif period_entity.github_issue is True:
+            resp['message'] += ". Launching GitHub issue process"
+            taskqueue.add(url=URI_GITHUB_ISSUE,
+                          queue_name=QUEUENAME)
+
+        # Otherwise, consider finished
+        else:
+            resp['message'] += ". No GitHub process launched"
+            period_entity.status = "done"
+            period_entity.put()
+            mail.send_mail(
+                sender=EMAIL_SENDER,
+                to=EMAIL_RECIPIENT,
+                subject="Usage reports for period %s" % self.period,
+                body="""
+Hey there!
+
+Just a brief note to let you know the extraction of %s stats has
+successfully finished, with no GitHub processes launched.
+
+Congrats!
+""" % self.period)
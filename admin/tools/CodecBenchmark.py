@@ -0,0 +1,147 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "CodecBenchmark.py 2026-10-19T00:15-03:00"
+
+import json
+import logging
+import random
+import time
+import zlib
+from google.appengine.ext import ndb
+import webapp2
+from aggregate import ResourceAggregate
+from models import DailyAggregate
+from util import month_days
+
+class CodecBenchmark(webapp2.RequestHandler):
+    """Compare the ReportToProcess resource encodings in size and speed.
+
+Encodes the same aggregates as the former JSON format (as stored by a
+JsonProperty), as the same JSON zlib-compressed, and with the binary codec of
+ResourceAggregate.encode().
+
+Parameters:
+  period: YYYYMM period whose stored daily rollups are merged and used as
+          input. If not provided, a synthetic aggregate is generated
+  events: number of events of the synthetic aggregate (default 100000)
+  terms: number of distinct query terms of the synthetic aggregate
+         (default 20000)
+  seed: random seed of the synthetic aggregate (default 0)
+  repeat: number of times each encoding is timed (default 5)
+"""
+    def get(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        period = self.request.get('period', None)
+        repeat = max(int(self.request.get('repeat', 5)), 1)
+
+        if period:
+            aggregates = self.from_rollups(period)
+        else:
+            aggregates = [synthetic_aggregate(
+                int(self.request.get('events', 100000)),
+                int(self.request.get('terms', 20000)),
+                random.Random(int(self.request.get('seed', 0)))
+            )]
+
+        if len(aggregates) == 0:
+            self.error(404)
+            resp = {
+                "status": "error",
+                "message": "No daily rollups found for period",
+                "data": {"period": period}
+            }
+            self.response.write(json.dumps(resp) + "\n")
+            return
+
+        encodings = {
+            "json": (lambda x: json.dumps(legacy_dict(x)),
+                     json.loads),
+            "json_zlib": (lambda x: zlib.compress(json.dumps(legacy_dict(x))),
+                          lambda x: json.loads(zlib.decompress(x))),
+            "codec": (lambda x: x.encode(),
+                      ResourceAggregate.decode)
+        }
+
+        results = {}
+        for name, (encode, decode) in encodings.items():
+            start = time.time()
+            for i in range(repeat):
+                encoded = [encode(x) for x in aggregates]
+            encode_time = (time.time() - start) / repeat
+
+            start = time.time()
+            for i in range(repeat):
+                for x in encoded:
+                    decode(x)
+            decode_time = (time.time() - start) / repeat
+
+            sizes = [len(x) for x in encoded]
+            results[name] = {
+                "total_bytes": sum(sizes),
+                "largest_bytes": max(sizes),
+                "encode_ms": round(1000 * encode_time, 2),
+                "decode_ms": round(1000 * decode_time, 2)
+            }
+
+        resp = {
+            "status": "success",
+            "data": {
+                "source": period or "synthetic",
+                "aggregates": len(aggregates),
+                "events": sum([x.events for x in aggregates]),
+                "encodings": results
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+
+    def from_rollups(self, period):
+        """Merge the stored daily rollups of a period, one aggregate per resource."""
+        resources = {}
+        for t in ["search", "download"]:
+            keys = [DailyAggregate.build_key(t, day) for day in month_days(period)]
+            for rollup in ndb.get_multi(keys):
+                if rollup is None:
+                    continue
+                for resource, aggregate in rollup.resources.items():
+                    key = (t, resource)
+                    if key not in resources:
+                        resources[key] = ResourceAggregate()
+                    resources[key].merge(ResourceAggregate.from_dict(aggregate))
+        return resources.values()
+
+def synthetic_aggregate(events, terms, rnd):
+    """Build an aggregate of a popular resource with made up events."""
+    countries = ["Country %d" % i for i in range(200)]
+    dates = ["2026-01-%02d" % i for i in range(1, 32)]
+    agg = ResourceAggregate()
+    for i in range(events):
+        agg.add_event(rnd.randint(1, 1000),
+                      countries[int(rnd.paretovariate(1.2)) % 200],
+                      rnd.choice(dates),
+                      "genus:Puma specificepithet:concolor %d"
+                      % int(rnd.paretovariate(0.8) % terms))
+    return agg
+
+def legacy_dict(agg):
+    """Return an aggregate in the former nested JSON format."""
+    return {
+        'records': agg.records,
+        'query_countries': dict((k, {'query_country': k, 'times': v})
+                                for k, v in agg.countries.items()),
+        'query_dates': dict((k, {'query_date': k, 'times': v})
+                            for k, v in agg.dates.items()),
+        'query_terms': dict((k, {'query_terms': k, 'times': v[0],
+                                 'records': v[1]})
+                            for k, v in agg.terms.items())
+    }
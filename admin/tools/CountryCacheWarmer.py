@@ -0,0 +1,111 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "CountryCacheWarmer.py 2026-10-18T12:30-03:00"
+
+import json
+import logging
+from datetime import datetime, timedelta
+from google.appengine.api import memcache
+import webapp2
+from countrycache import country_cache
+from models import CountryLookup
+from util import add_time_limit, carto_query, resolve_countries
+from config import *
+
+# Number of locations resolved, or entities preloaded, per batch
+BATCH_SIZE = 1000
+
+class CountryCacheWarmer(webapp2.RequestHandler):
+    """Fill the country cache from the locations of already processed periods.
+
+Parameters:
+  period: comma-separated list of YYYYMM periods whose distinct locations
+          are resolved into every cache tier
+  table_name: table to read locations from (default CDB_TABLE)
+  preload: true/false, copy all durable CountryLookup entities to memcache
+"""
+    def post(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        periods = [x.strip() for x in self.request.get('period', '').split(',')
+                   if len(x.strip()) > 0]
+        table_name = self.request.get('table_name', CDB_TABLE)
+        preload = self.request.get('preload').lower() == 'true'
+
+        stats = country_cache.snapshot()
+        locations = {}
+        for period in periods:
+            if len(period) != 6:
+                self.error(400)
+                resp = {
+                    "status": "error",
+                    "message": "Malformed period. Should be YYYYMM (e.g., 201603)",
+                    "data": {"period": period}
+                }
+                self.response.write(json.dumps(resp) + "\n")
+                return
+            locations[period] = self.warm_period(period, table_name)
+
+        preloaded = 0
+        if preload is True:
+            preloaded = self.preload()
+
+        resp = {
+            "status": "success",
+            "message": "Country cache warmed up",
+            "data": {
+                "locations": locations,
+                "preloaded": preloaded,
+                "country_lookups": country_cache.since(stats)
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+        return
+
+    def warm_period(self, period, table_name):
+        """Resolve all distinct locations of a period. Return how many."""
+        query = "SELECT DISTINCT round(lat::numeric, 2) AS lat, " \
+                "round(lon::numeric, 2) AS lon " \
+                "FROM %s " \
+                "WHERE client='portal-prod'" % table_name
+        if table_name == CDB_TABLE:
+            queried_date = datetime(int(period[:4]), int(period[-2:]), 1)
+            queried_date += timedelta(days=32)
+            query = add_time_limit(query=query, today=queried_date)
+
+        s =  "Version: %s\n" % __version__
+        s += "Executing query:\n%s" % query
+        logging.info(s)
+        rows = carto_query(query)
+        coords = [(x['lat'], x['lon']) for x in rows]
+
+        for i in range(0, len(coords), BATCH_SIZE):
+            resolve_countries(coords[i:i + BATCH_SIZE])
+
+        s =  "Version: %s\n" % __version__
+        s += "Warmed up %d locations for period %s" % (len(coords), period)
+        logging.info(s)
+        return len(coords)
+
+    def preload(self):
+        """Copy the durable tier into memcache. Return the number of entries."""
+        query = CountryLookup.query()
+        cursor = None
+        more = True
+        total = 0
+        while more is True:
+            results, cursor, more = query.fetch_page(BATCH_SIZE,
+                                                     start_cursor=cursor)
+            memcache.set_multi(dict((e.key.id(), e.country) for e in results))
+            total += len(results)
+        return total
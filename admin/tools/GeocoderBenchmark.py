@@ -0,0 +1,90 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "GeocoderBenchmark.py 2026-10-18T10:05-03:00"
+
+import json
+import logging
+import random
+import time
+import webapp2
+from geocoder import get_geocoder
+from util import geonames_http_query
+
+class GeocoderBenchmark(webapp2.RequestHandler):
+    """Compare the offline country geocoder with the GeoNames HTTP path.
+
+Parameters:
+  n: number of random points resolved offline (default 10000)
+  http: number of those points also sent to GeoNames (default 20)
+  seed: random seed, to repeat a run with the same points (default 0)
+"""
+    def get(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        n = int(self.request.get('n', 10000))
+        http = min(int(self.request.get('http', 20)), n)
+        rnd = random.Random(int(self.request.get('seed', 0)))
+
+        # Random points, mostly over inhabited latitudes
+        lats = [round(rnd.uniform(-60, 75), 2) for x in range(n)]
+        lons = [round(rnd.uniform(-180, 180), 2) for x in range(n)]
+
+        # Loading the boundaries happens once per instance, time it apart
+        start = time.time()
+        geocoder = get_geocoder()
+        load_time = time.time() - start
+
+        if geocoder.available is False:
+            self.error(500)
+            resp = {
+                "status": "error",
+                "message": "Country boundaries not available. "
+                           "Build them with data/build_countries.py"
+            }
+            self.response.write(json.dumps(resp) + "\n")
+            return
+
+        start = time.time()
+        offline = geocoder.countries(lats, lons)
+        offline_time = time.time() - start
+
+        start = time.time()
+        online = [geonames_http_query(lats[i], lons[i]) for i in range(http)]
+        http_time = time.time() - start
+
+        # GeoNames answers "Unknown" where the offline geocoder answers None
+        matches = len([i for i in range(http)
+                       if (offline[i] or "Unknown") == online[i]])
+
+        resp = {
+            "status": "success",
+            "data": {
+                "offline": {
+                    "points": n,
+                    "load_seconds": round(load_time, 3),
+                    "total_seconds": round(offline_time, 3),
+                    "ms_per_point": round(1000 * offline_time / max(n, 1), 4),
+                    "resolved": len([x for x in offline if x is not None])
+                },
+                "http": {
+                    "points": http,
+                    "total_seconds": round(http_time, 3),
+                    "ms_per_point": round(1000 * http_time / max(http, 1), 4)
+                },
+                "agreement": {
+                    "compared": http,
+                    "matching": matches
+                }
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
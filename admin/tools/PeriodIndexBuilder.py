@@ -0,0 +1,101 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "PeriodIndexBuilder.py 2026-10-19T09:00-03:00"
+
+import json
+import logging
+from datetime import datetime
+from google.appengine.ext import ndb
+import webapp2
+from models import Report
+from reportbuilder import index_reports
+from timebudget import TimeBudget, checkpoint_name, continue_task
+from timebudget import next_slice_number, save_checkpoint
+from config import *
+
+INDEX_URI = "/admin/tools/period_index"
+PAGE_SIZE = 50
+
+class PeriodIndexBuilder(webapp2.RequestHandler):
+    """Add existing Reports to the DatasetPeriodIndex of their datasets.
+
+process_events and get_events keep the indexes of the Reports they write, so
+this is only needed for Reports written before the indexes existed. Reports
+already indexed are written again with the same summary, so it can be run
+any number of times.
+
+Parameters:
+  period: YYYYMM period whose Reports are indexed. If not provided, all
+          Reports are
+"""
+    def post(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        period = self.request.get("period", None)
+        query = Report.query()
+        if period:
+            query = query.filter(Report.reported_period ==
+                                 ndb.Key("Period", period))
+
+        # Continuations carry the run of the task that started the walk
+        run = self.request.get("run", None)
+        if not run:
+            run = datetime.now().strftime("%Y%m%d%H%M%S")
+
+        cursor_str = self.request.get("cursor", None)
+        cursor = None
+        if cursor_str:
+            cursor = ndb.Cursor(urlsafe=cursor_str)
+
+        budget = TimeBudget()
+        checkpoint = checkpoint_name("period_index", period or "all", run)
+        slice_number = next_slice_number(checkpoint,
+                                         self.request.get("slice", None))
+
+        indexed = 0
+        more = True
+        while more is True:
+            reports, cursor, more = query.fetch_page(
+                PAGE_SIZE, start_cursor=cursor
+            )
+            index_reports(reports)
+            indexed += len(reports)
+            budget.tick(len(reports))
+
+            # Stop between pages if another one may not fit
+            if more is True and budget.exhausted():
+                params = continue_task(checkpoint, slice_number, budget,
+                                       INDEX_URI,
+                                       {"period": period or "", "run": run},
+                                       cursor.urlsafe())
+                resp = {
+                    "status": "in progress",
+                    "message": "Time budget used. Continuing in a new task",
+                    "data": dict(params, indexed=indexed)
+                }
+                logging.info(resp)
+                self.response.write(json.dumps(resp) + "\n")
+                return
+
+        save_checkpoint(checkpoint, slice_number, budget, done=True)
+
+        resp = {
+            "status": "success",
+            "message": "Reports added to the period indexes",
+            "data": {
+                "period": period,
+                "run": run,
+                "indexed": indexed
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
@@ -0,0 +1,68 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "PeriodPreview.py 2026-10-18T18:10-03:00"
+
+import json
+from google.appengine.ext import ndb
+import webapp2
+from aggregate import ResourceAggregate
+from models import DailyAggregate
+from util import month_days
+
+class PeriodPreview(webapp2.RequestHandler):
+    """Preview the usage of a period from the daily rollups stored so far.
+
+Merges whatever DailyAggregate entities exist for the period, without touching
+Carto, so it can be used in the middle of a month. With a 'gbifdatasetid'
+parameter, returns the full merged aggregates of that dataset.
+"""
+    def get(self, period):
+        self.response.headers["content-type"] = "application/json"
+        gbifdatasetid = self.request.get('gbifdatasetid', None)
+
+        resp = {
+            "Requested period": period,
+            "Days included": {},
+            "Totals": {},
+            "Datasets": {}
+        }
+
+        for t in ["search", "download"]:
+            keys = [DailyAggregate.build_key(t, day) for day in month_days(period)]
+            rollups = [x for x in ndb.get_multi(keys) if x is not None]
+            resp["Days included"][t] = [x.day.strftime('%Y-%m-%d') for x in rollups]
+            resp["Totals"][t] = {
+                "events": sum([x.events for x in rollups]),
+                "records": sum([x.records for x in rollups])
+            }
+
+            resources = {}
+            for rollup in rollups:
+                for resource, aggregate in rollup.resources.items():
+                    if gbifdatasetid and resource != gbifdatasetid:
+                        continue
+                    if resource not in resources:
+                        resources[resource] = ResourceAggregate()
+                    resources[resource].merge(
+                        ResourceAggregate.from_dict(aggregate))
+
+            for resource, aggregate in resources.items():
+                dataset = resp["Datasets"].setdefault(resource, {})
+                if gbifdatasetid:
+                    dataset[t] = aggregate.to_dict()
+                else:
+                    dataset[t] = {
+                        "events": aggregate.events,
+                        "records": aggregate.records
+                    }
+
+        self.response.write(json.dumps(resp))
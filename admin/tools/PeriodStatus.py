@@ -9,12 +9,13 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "PeriodStatus.py 2018-10-15T22:42-03:00"
+__version__ = "PeriodStatus.py 2026-10-18T21:15-03:00"
 
 import json
 from google.appengine.api.modules import modules
 from google.appengine.ext import ndb
 import jinja2
+from counters import get_counts, period_counter
 from models import Period, Dataset, Report, CartoDownloadEntry
 from util import *
 import webapp2
@@ -41,11 +42,14 @@ class PeriodStatus(webapp2.RequestHandler):
         }
 
         if entity.status == "in progress":
+            downloads = period_counter(entity, "processed_downloads")
+            searches = period_counter(entity, "processed_searches")
+            counts = get_counts([downloads, searches])
             resp['Extraction status'] = [
                 {"Downloads to process": entity.downloads_to_process},
-                {"Downloads processed": entity.processed_downloads},
+                {"Downloads processed": counts[downloads]},
                 {"Searches to process": entity.searches_to_process},
-                {"Searches processed": entity.processed_searches}
+                {"Searches processed": counts[searches]}
             ]
         elif entity.status == 'done':
             resp['Period data'] = [
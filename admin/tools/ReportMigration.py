@@ -0,0 +1,288 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "ReportMigration.py 2026-10-19T14:15-03:00"
+
+import json
+import logging
+from datetime import datetime
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+import webapp2
+from counters import get_count, get_counts, increment
+from models import MigrationBatch, MigrationStatus, Report
+from models import REPORT_SCHEMA_VERSION
+from renderer import invalidate
+from reportbuilder import cap_terms
+from timebudget import TimeBudget, checkpoint_name, continue_task
+from timebudget import next_slice_number, save_checkpoint
+from config import *
+
+MIGRATION_URI = "/admin/tools/report_migration"
+MIGRATION_NAME = "report-v%d" % REPORT_SCHEMA_VERSION
+
+class ReportMigration(webapp2.RequestHandler):
+    """Rewrite all existing Report entities with the current schema.
+
+A walker task reads the Report keys with a keys-only query and enqueues one
+task per MIGRATION_BATCH_SIZE keys in MIGRATION_QUEUENAME, a low-rate queue,
+so the migration runs in the background without competing with the viewers.
+Each batch task rewrites the Reports not yet at REPORT_SCHEMA_VERSION, so the
+migration can be run again, or resumed, at no cost for migrated entities.
+Each batch task records its completion once, in a MigrationBatch named after
+the task, together with its counters, so retried tasks are not counted twice.
+The last of the batch tasks, or the walker if they finish first, marks the
+migration done.
+
+GET returns the progress and throughput of the migration.
+
+POST starts the migration, or resumes it from the last position of the walker.
+  restart: true/false, walk all Reports again from the start (default False)
+"""
+    def get(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        status = ndb.Key(MigrationStatus, MIGRATION_NAME).get()
+        if status is None:
+            self.error(404)
+            resp = {
+                "status": "error",
+                "message": "Migration %s not started" % MIGRATION_NAME
+            }
+            self.response.write(json.dumps(resp) + "\n")
+            return
+
+        fields = ["migrated", "skipped", "batches_done"]
+        names = dict((x, counter_name(status.run_id, x)) for x in fields)
+        counts = get_counts(names.values())
+        counts = dict((x, counts[names[x]]) for x in fields)
+
+        elapsed = (datetime.utcnow() - status.started).total_seconds()
+        rewritten = counts["migrated"] + counts["skipped"]
+        resp = {
+            "status": "success",
+            "data": {
+                "migration": MIGRATION_NAME,
+                "run_id": status.run_id,
+                "state": status.status,
+                "started": status.started.isoformat(),
+                "reports_walked": status.walked,
+                "batches_enqueued": status.batches,
+                "batches_done": counts["batches_done"],
+                "reports_migrated": counts["migrated"],
+                "reports_already_migrated": counts["skipped"],
+                "reports_per_second": round(rewritten / max(elapsed, 1), 2)
+            }
+        }
+        self.response.write(json.dumps(resp) + "\n")
+
+    def post(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        keys = self.request.get_all('key')
+        if len(keys) > 0:
+            self.migrate_batch(self.request.get('run_id'), keys)
+        else:
+            self.walk()
+
+    def walk(self):
+        """Enqueue a batch task per page of Report keys, until time runs out."""
+        key = ndb.Key(MigrationStatus, MIGRATION_NAME)
+        status = key.get()
+        restart = self.request.get('restart').lower() == 'true'
+        cursor_str = self.request.get('cursor', None)
+
+        if status is None or restart is True:
+            status = MigrationStatus(
+                key=key,
+                run_id=datetime.now().strftime('%Y%m%d%H%M%S'),
+                status='running',
+                started=datetime.utcnow()
+            )
+            cursor_str = None
+        elif not cursor_str:
+            # Resumed by hand
+            if status.status != 'running':
+                resp = {
+                    "status": "success",
+                    "message": "All Reports already walked. Use restart=true "
+                               "to walk them again",
+                    "data": {"migration": MIGRATION_NAME, "state": status.status}
+                }
+                self.response.write(json.dumps(resp) + "\n")
+                return
+            cursor_str = status.cursor
+
+        budget = TimeBudget()
+        checkpoint = checkpoint_name("report_migration", status.run_id)
+        slice_number = next_slice_number(checkpoint, self.request.get('slice', None))
+
+        query = Report.query()
+        cursor = None
+        if cursor_str:
+            cursor = Cursor(urlsafe=cursor_str)
+
+        more = True
+        while more is True:
+            keys, cursor, more = query.fetch_page(
+                MIGRATION_BATCH_SIZE, start_cursor=cursor, keys_only=True
+            )
+            if len(keys) > 0:
+                self.enqueue_batch(status, keys)
+            budget.tick(len(keys))
+
+            if more is True and budget.exhausted():
+                status.cursor = cursor.urlsafe()
+                status.put()
+                params = continue_task(checkpoint, slice_number, budget,
+                                       MIGRATION_URI, {}, status.cursor,
+                                       queue_name=MIGRATION_QUEUENAME)
+                resp = {
+                    "status": "in progress",
+                    "message": "Time budget used. Continuing in a new task",
+                    "data": dict(params, walked=status.walked,
+                                 batches=status.batches)
+                }
+                logging.info(resp)
+                self.response.write(json.dumps(resp) + "\n")
+                return
+
+        status.status = 'walked'
+        status.cursor = None
+        status.put()
+        save_checkpoint(checkpoint, slice_number, budget, done=True)
+        # Batches may have finished before the walker
+        finish_if_done(status.run_id)
+
+        resp = {
+            "status": "success",
+            "message": "All Reports walked",
+            "data": {
+                "migration": MIGRATION_NAME,
+                "walked": status.walked,
+                "batches": status.batches
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+
+    def enqueue_batch(self, status, keys):
+        """Enqueue the rewrite of a batch of Reports.
+
+The task is named after the run and the batch number, so a walker slice that
+is retried from its last checkpoint does not enqueue its batches twice.
+"""
+        name = "%s-%s-%d" % (MIGRATION_NAME, status.run_id, status.batches)
+        try:
+            taskqueue.add(name=name, url=MIGRATION_URI,
+                          params={"run_id": status.run_id,
+                                  "key": [x.urlsafe() for x in keys]},
+                          queue_name=MIGRATION_QUEUENAME)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            s =  "Version: %s\n" % __version__
+            s += "Batch %s already enqueued" % name
+            logging.info(s)
+        status.batches += 1
+        status.walked += len(keys)
+
+    def migrate_batch(self, run_id, keys):
+        """Rewrite the Reports of a batch that are not in the current schema."""
+        keys = [ndb.Key(urlsafe=x) for x in keys]
+
+        # Reports are children of their Period, one transaction per Period
+        groups = {}
+        for key in keys:
+            groups.setdefault(key.parent(), []).append(key)
+
+        migrated = 0
+        found = 0
+        for group in groups.values():
+            m, f = rewrite_reports(group)
+            invalidate(group)
+            migrated += m
+            found += f
+
+        batch = self.request.headers.get('X-AppEngine-TaskName', None)
+        if batch:
+            if record_batch(batch, run_id, migrated, found - migrated):
+                finish_if_done(run_id)
+            else:
+                s =  "Version: %s\n" % __version__
+                s += "Batch %s already counted" % batch
+                logging.info(s)
+        else:
+            s =  "Version: %s\n" % __version__
+            s += "Batch not run as a task. Not counted in the progress"
+            logging.warning(s)
+
+        resp = {
+            "status": "success",
+            "data": {
+                "migration": MIGRATION_NAME,
+                "migrated": migrated,
+                "already_migrated": found - migrated,
+                "missing": len(keys) - found
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+
+@ndb.transactional
+def rewrite_reports(keys):
+    """Put again the Reports, of a single Period, not in the current schema.
+
+Return the number of Reports rewritten and the number of Reports found.
+"""
+    reports = [x for x in ndb.get_multi(keys) if x is not None]
+    stale = [x for x in reports if x.schema_version != REPORT_SCHEMA_VERSION]
+    archives = []
+    for report in stale:
+        archives.extend(cap_terms(report))
+    # Report._pre_put_hook sets the current schema_version
+    ndb.put_multi(stale + archives)
+    return len(stale), len(reports)
+
+@ndb.transactional(xg=True)
+def record_batch(name, run_id, migrated, skipped):
+    """Mark a batch as done and add it to the counters of its run, once.
+
+Return False if the batch had already been recorded.
+"""
+    key = ndb.Key(MigrationBatch, name)
+    if key.get() is not None:
+        return False
+    MigrationBatch(key=key, run_id=run_id, migrated=migrated,
+                   skipped=skipped).put()
+    # The increments join this transaction
+    if migrated > 0:
+        increment(counter_name(run_id, "migrated"), migrated)
+    if skipped > 0:
+        increment(counter_name(run_id, "skipped"), skipped)
+    increment(counter_name(run_id, "batches_done"))
+    return True
+
+def finish_if_done(run_id):
+    """Mark the migration done if it has been walked and every batch of the
+run has been recorded."""
+    mark_done(run_id, get_count(counter_name(run_id, "batches_done")))
+
+@ndb.transactional
+def mark_done(run_id, batches_done):
+    status = ndb.Key(MigrationStatus, MIGRATION_NAME).get()
+    if status is None or status.run_id != run_id:
+        return
+    if status.status == 'walked' and batches_done >= status.batches:
+        status.status = 'done'
+        status.put()
+
+def counter_name(run_id, field):
+    return "|".join(["migration", MIGRATION_NAME, str(run_id), field])
@@ -0,0 +1,201 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "ReportWriteBenchmark.py 2026-10-19T00:15-03:00"
+
+import json
+import logging
+import random
+import time
+from google.appengine.ext import ndb
+import webapp2
+from admin.tools.CodecBenchmark import synthetic_aggregate
+from models import Report
+from reportbuilder import add_aggregate, new_report
+
+# Report schema before its statistics were unindexed, for comparison
+class IndexedQueryTerms(ndb.Model):
+    query_terms = ndb.StringProperty()
+    records = ndb.IntegerProperty(default=0)
+    times = ndb.IntegerProperty(default=0)
+
+class IndexedQueryCountry(ndb.Model):
+    query_country = ndb.StringProperty()
+    times = ndb.IntegerProperty(default=0)
+
+class IndexedQueryDate(ndb.Model):
+    query_date = ndb.DateProperty()
+    times = ndb.IntegerProperty(default=0)
+
+class IndexedEvents(ndb.Model):
+    events = ndb.IntegerProperty(default=0)
+    records = ndb.IntegerProperty(default=0)
+    query_terms = ndb.StructuredProperty(IndexedQueryTerms, repeated=True)
+    query_countries = ndb.StructuredProperty(IndexedQueryCountry, repeated=True)
+    query_dates = ndb.StructuredProperty(IndexedQueryDate, repeated=True)
+
+class IndexedReportBenchmark(ndb.Model):
+    created = ndb.DateProperty(required=True)
+    sha = ndb.StringProperty(default="")
+    reported_period = ndb.KeyProperty(required=True)
+    reported_resource = ndb.KeyProperty(required=True)
+    searches = ndb.StructuredProperty(IndexedEvents)
+    downloads = ndb.StructuredProperty(IndexedEvents)
+    stored = ndb.BooleanProperty()
+    issue_sent = ndb.BooleanProperty()
+    done = ndb.ComputedProperty(lambda self:
+                                self.issue_sent is True and
+                                self.stored is True)
+
+class ReportBenchmark(Report):
+    """Report with the current schema, in a kind of its own."""
+    pass
+
+# Rows written to the composite index of Report (see index.yaml)
+COMPOSITE_INDEX_ROWS = 1
+
+class ReportWriteBenchmark(webapp2.RequestHandler):
+    """Compare the write cost of a Report with indexed and unindexed statistics.
+
+Each Report is copied into two throwaway kinds, one with the former schema,
+in which every statistic was indexed, and one with the current schema. Both
+copies are put one at a time, timed and deleted.
+
+Parameters:
+  period: YYYYMM period whose Reports are used as input. If not provided,
+          synthetic Reports are generated
+  n: number of Reports (default 10)
+  events: number of events per event type of each synthetic Report
+          (default 20000)
+  terms: number of distinct query terms of the synthetic Reports
+         (default 5000)
+  seed: random seed of the synthetic Reports (default 0)
+"""
+    def get(self):
+        self.response.headers['Content-Type'] = 'application/json'
+
+        period = self.request.get('period', None)
+        n = int(self.request.get('n', 10))
+
+        if period:
+            reports = Report.query(
+                Report.reported_period == ndb.Key("Period", period)
+            ).fetch(n)
+        else:
+            rnd = random.Random(int(self.request.get('seed', 0)))
+            events = int(self.request.get('events', 20000))
+            terms = int(self.request.get('terms', 5000))
+            reports = []
+            for i in range(n):
+                report = new_report("000000", "benchmark-%d" % i)
+                for t in ["search", "download"]:
+                    add_aggregate(report, t,
+                                  synthetic_aggregate(events, terms, rnd))
+                reports.append(report)
+
+        if len(reports) == 0:
+            self.error(404)
+            resp = {
+                "status": "error",
+                "message": "No Reports found for period",
+                "data": {"period": period}
+            }
+            self.response.write(json.dumps(resp) + "\n")
+            return
+
+        resp = {
+            "status": "success",
+            "data": {
+                "source": period or "synthetic",
+                "reports": len(reports),
+                "indexed": self.measure([indexed_copy(x) for x in reports]),
+                "unindexed": self.measure([unindexed_copy(x) for x in reports])
+            }
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+
+    def measure(self, entities):
+        """Put entities one at a time, then delete them. Return the costs."""
+        index_values = []
+        sizes = []
+        for entity in entities:
+            pb = entity._to_pb()
+            index_values.append(pb.property_size())
+            sizes.append(pb.ByteSize())
+
+        # Writing a new entity costs 2 operations, plus 2 per indexed value
+        # (ascending and descending built-in indexes) and 1 per composite row
+        ops = [2 + 2 * x + COMPOSITE_INDEX_ROWS for x in index_values]
+
+        times = []
+        errors = []
+        for entity in entities:
+            start = time.time()
+            try:
+                entity.put(use_cache=False, use_memcache=False)
+                times.append(time.time() - start)
+            except Exception as e:
+                errors.append("%s: %s" % (type(e).__name__, e))
+        ndb.delete_multi([x.key for x in entities])
+
+        return {
+            "indexed_values_per_report": sum(index_values) / len(entities),
+            "write_ops_per_report": sum(ops) / len(entities),
+            "bytes_per_report": sum(sizes) / len(entities),
+            "put_ms_per_report": round(1000 * sum(times) / max(len(times), 1), 1),
+            "failed_puts": errors
+        }
+
+def indexed_copy(report):
+    """Copy a Report into the former, fully indexed, schema."""
+    def events(x):
+        if x is None:
+            return None
+        return IndexedEvents(
+            events=x.events,
+            records=x.records,
+            query_terms=[IndexedQueryTerms(query_terms=q.query_terms,
+                                           records=q.records,
+                                           times=q.times)
+                         for q in x.query_terms],
+            query_countries=[IndexedQueryCountry(query_country=q.query_country,
+                                                 times=q.times)
+                             for q in x.query_countries],
+            query_dates=[IndexedQueryDate(query_date=q.query_date,
+                                          times=q.times)
+                         for q in x.query_dates]
+        )
+    return IndexedReportBenchmark(
+        id=report.key.id(),
+        created=report.created,
+        sha=report.sha,
+        reported_period=report.reported_period,
+        reported_resource=report.reported_resource,
+        searches=events(report.searches),
+        downloads=events(report.downloads),
+        stored=report.stored,
+        issue_sent=report.issue_sent
+    )
+
+def unindexed_copy(report):
+    """Copy a Report into the current schema, in the ReportBenchmark kind."""
+    return ReportBenchmark(
+        id=report.key.id(),
+        created=report.created,
+        sha=report.sha,
+        reported_period=report.reported_period,
+        reported_resource=report.reported_resource,
+        searches=report.searches,
+        downloads=report.downloads,
+        stored=report.stored,
+        issue_sent=report.issue_sent
+    )
@@ -9,13 +9,14 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "Status.py 2018-11-01T19:34-03:00"
+__version__ = "Status.py 2026-10-19T08:00-03:00"
 
 import json
 from google.appengine.api.modules import modules
 from google.appengine.ext import ndb
 import jinja2
 from models import Period, Dataset, Report, CartoDownloadEntry
+from entitycache import entity_cache
 from util import *
 import webapp2
 
@@ -64,7 +65,9 @@ class Status(webapp2.RequestHandler):
                 {"Periods completed": num_periods_done},
                 {"Periods in progress": num_periods_progress},
                 {"Periods failed": num_periods_failed},
-            ]
+            ],
+            # Counters of the instance that serves this request only
+            "Entity cache": entity_cache.snapshot()
         }
 
         if c != d or c == 0:
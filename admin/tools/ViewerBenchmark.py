@@ -0,0 +1,164 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "ViewerBenchmark.py 2026-10-19T08:00-03:00"
+
+import json
+import logging
+import time
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+import webapp2
+from models import Report
+from entitycache import entity_cache
+from jinjafilters import JINJA_ENVIRONMENT
+from renderer import RENDERERS, dataset_key, render_cache_key
+
+# Viewer routes measured: format and suffix of the report URL
+ROUTES = [('html', ''), ('txt', 'txt'), ('json', 'json')]
+
+class ViewerBenchmark(webapp2.RequestHandler):
+    """Compare the latency of the viewer routes with the former serial reads.
+
+Each route is requested in-process for n Reports of a period, three ways:
+  serial: the former code, reading the Report, then its Dataset, then its
+          Period, and rendering it
+  cold: the current route, with the rendered Report and the entities dropped
+        from memcache and the entity cache, so it reads the datastore
+  warm: the current route again, served from memcache
+The dataset route is measured the same way, its former code running the query
+and then reading the Dataset. Run it against the local datastore of the
+development server to measure the datastore round trips alone. Published
+artifacts are read as they are, so "cold" reads them instead of rendering for
+the Reports already published.
+
+Parameters:
+  period: YYYYMM period whose Reports are requested
+  n: number of Reports (default 10)
+  rounds: times each Report is requested each way (default 3)
+"""
+    def get(self):
+        # Imported here, usagestats imports this module
+        from usagestats import app
+
+        self.response.headers['Content-Type'] = 'application/json'
+
+        period = self.request.get('period', None)
+        n = int(self.request.get('n', 10))
+        rounds = int(self.request.get('rounds', 3))
+
+        report_keys = []
+        if period:
+            report_keys = Report.query(
+                Report.reported_period == ndb.Key("Period", period)
+            ).fetch(n, keys_only=True)
+
+        if len(report_keys) == 0:
+            self.error(404)
+            resp = {
+                "status": "error",
+                "message": "No Reports found for period",
+                "data": {"period": period}
+            }
+            self.response.write(json.dumps(resp) + "\n")
+            return
+
+        data = {
+            "period": period,
+            "reports": len(report_keys),
+            "rounds": rounds
+        }
+        for fmt, suffix in ROUTES:
+            paths = ["/reports/%s/%s/%s" % (dataset_key(x).id(), period, suffix)
+                     for x in report_keys]
+            data[fmt] = self.measure(
+                app, report_keys, paths, rounds,
+                lambda x: serial_report(x, fmt),
+                lambda x: [render_cache_key(x, fmt), x.parent(), x,
+                           dataset_key(x)]
+            )
+        data["dataset"] = self.measure(
+            app, report_keys,
+            ["/reports/%s/" % dataset_key(x).id() for x in report_keys],
+            rounds, serial_dataset, lambda x: [dataset_key(x)]
+        )
+
+        resp = {
+            "status": "success",
+            "data": data
+        }
+        logging.info(resp)
+        self.response.write(json.dumps(resp) + "\n")
+
+    def measure(self, app, report_keys, paths, rounds, serial, cached):
+        """Time the serial code and the route for each Report. Return the
+median and mean latencies of each way, in milliseconds."""
+        times = {"serial": [], "cold": [], "warm": []}
+        errors = []
+        for i in range(rounds):
+            for report_key, path in zip(report_keys, paths):
+                drop_cached(cached(report_key))
+                start = time.time()
+                serial(report_key)
+                times["serial"].append(time.time() - start)
+
+                for way in ["cold", "warm"]:
+                    if way == "cold":
+                        drop_cached(cached(report_key))
+                    start = time.time()
+                    response = webapp2.Request.blank(path).get_response(app)
+                    times[way].append(time.time() - start)
+                    if response.status_int != 200:
+                        errors.append("%s: %s" % (path, response.status))
+
+        result = dict([(k, summary(v)) for k, v in times.items()])
+        result["errors"] = errors[:10]
+        return result
+
+def drop_cached(keys):
+    """Drop rendered Reports (by memcache key) and entities from the caches."""
+    ndb.get_context().clear_cache()
+    entity_cache.invalidate([x for x in keys if isinstance(x, ndb.Key)])
+    memcache.delete_multi([x for x in keys if not isinstance(x, ndb.Key)])
+    memcache.delete_multi([x.urlsafe() for x in keys if isinstance(x, ndb.Key)],
+                          key_prefix=ndb.Context._memcache_prefix)
+
+def serial_report(report_key, fmt):
+    """Render a Report as the viewers did, reading one entity at a time."""
+    report = report_key.get()
+    dataset = report.reported_resource.get()
+    period = report.reported_period.get()
+    return RENDERERS[fmt][0](report, period, dataset)
+
+def serial_dataset(report_key):
+    """Render a dataset page as its viewer did, querying then reading."""
+    key = dataset_key(report_key)
+    query = Report.query(Report.reported_resource == key)
+    query = query.order(-Report.reported_period)
+    report_keys = query.fetch(keys_only=True)
+    period_list = [
+        {
+            "text": x.id().split("|")[0][:4]+"-"+x.id().split("|")[0][4:],
+            "url": x.id().split("|")[0]
+        } for x in report_keys]
+    template = JINJA_ENVIRONMENT.get_template('dataset.html')
+    return template.render(
+        dataset=key.get(),
+        period_list=period_list,
+        periods=len(period_list)
+    )
+
+def summary(times):
+    times = sorted(times)
+    return {
+        "median_ms": round(1000 * times[len(times) // 2], 1),
+        "mean_ms": round(1000 * sum(times) / len(times), 1)
+    }
@@ -0,0 +1,326 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "aggregate.py 2026-10-19T10:00-03:00"
+
+import json
+import logging
+import zlib
+from datetime import datetime
+from models import QueryCountry, QueryDate, QueryTerms, QueryTermsOther
+
+# Version of the binary encoding, first element of every encoded payload
+# 1: exact query terms
+# 2: bounded query terms, with their sketch state
+CODEC_VERSION = 2
+
+class ResourceAggregate(object):
+    """Usage statistics of one resource for one event type.
+
+Holds the number of events and records, and counters of events by country, by
+date ('YYYY-MM-DD') and by query terms (events and records). Aggregates built
+from different pages, days, shards or processes are combined with merge(),
+which is associative and commutative.
+
+If a terms_capacity is given, query terms are counted with a Space-Saving
+sketch: once there are twice as many distinct terms, only the terms_capacity
+with most records are kept. Counts of kept terms are lower bounds, and their
+records may be short by up to their error (see terms_error()). Events, records,
+countries and dates are always exact.
+"""
+    __slots__ = ['events', 'records', 'countries', 'dates', 'terms',
+                 'capacity', 'floor', 'errors']
+
+    def __init__(self, terms_capacity=None):
+        self.events = 0
+        self.records = 0
+        self.countries = {}
+        self.dates = {}
+        # Query terms, or their IDs in a TermDictionary: [times, records]
+        self.terms = {}
+        # Sketch state: maximum records of any dropped term, and the records
+        # each kept term may have had before it was (re)admitted, if not 0
+        self.capacity = terms_capacity
+        self.floor = 0
+        self.errors = {}
+
+    def add_event(self, records, country, date, terms):
+        """Count a single event that retrieved 'records' from the resource."""
+        self.events += 1
+        self.records += records
+        self.countries[country] = self.countries.get(country, 0) + 1
+        self.dates[date] = self.dates.get(date, 0) + 1
+        t = self.terms.get(terms)
+        if t is None:
+            self.admit(terms, [1, records])
+        else:
+            t[0] += 1
+            t[1] += records
+
+    def add_country(self, country, times):
+        self.countries[country] = self.countries.get(country, 0) + times
+
+    def add_date(self, date, times):
+        self.dates[date] = self.dates.get(date, 0) + times
+
+    def add_terms(self, terms, times, records):
+        t = self.terms.get(terms)
+        if t is None:
+            self.admit(terms, [times, records])
+        else:
+            t[0] += times
+            t[1] += records
+
+    def admit(self, terms, counts):
+        """Start counting a new query terms string, pruning if needed."""
+        self.terms[terms] = counts
+        if self.floor > 0:
+            # It may have been counted, and dropped, before
+            self.errors[terms] = self.floor
+        if self.capacity is not None and len(self.terms) > 2 * self.capacity:
+            self.prune()
+
+    def prune(self):
+        """Keep only the 'capacity' query terms with most records.
+
+Pruning in batches, down to half of the table, keeps the cost of each new term
+constant on average. The floor is raised to the highest number of records any
+dropped term may have had.
+"""
+        ranked = self.ranked_terms()
+        for k, v in ranked[self.capacity:]:
+            self.floor = max(self.floor, v[1] + self.errors.get(k, 0))
+        self.terms = dict(ranked[:self.capacity])
+        self.errors = dict((k, v) for k, v in self.errors.items()
+                           if k in self.terms)
+
+    def rename_terms(self, names):
+        """Replace the query term IDs by their names, given as a list."""
+        self.terms = dict((names[k], v) for k, v in self.terms.items())
+        self.errors = dict((names[k], v) for k, v in self.errors.items())
+
+    def terms_error(self, terms):
+        """Return the records a kept query term may be short of, 0 if exact."""
+        return self.errors.get(terms, 0)
+
+    def merge(self, other):
+        """Add the counts of another aggregate to this one. Return self."""
+        self.events += other.events
+        self.records += other.records
+        for k, v in other.countries.items():
+            self.add_country(k, v)
+        for k, v in other.dates.items():
+            self.add_date(k, v)
+
+        if self.capacity is None:
+            self.capacity = other.capacity
+        elif other.capacity is not None:
+            self.capacity = max(self.capacity, other.capacity)
+        if self.floor > 0 or other.floor > 0:
+            # A term missing from one side may have been dropped there, with up
+            # to its floor records
+            errors = {}
+            for k in set(self.terms) | set(other.terms):
+                e = self.errors.get(k, 0) if k in self.terms else self.floor
+                e += other.errors.get(k, 0) if k in other.terms else other.floor
+                if e > 0:
+                    errors[k] = e
+            self.errors = errors
+            self.floor += other.floor
+        for k, v in other.terms.items():
+            t = self.terms.get(k)
+            if t is None:
+                self.terms[k] = [v[0], v[1]]
+            else:
+                t[0] += v[0]
+                t[1] += v[1]
+        if self.capacity is not None and len(self.terms) > 2 * self.capacity:
+            self.prune()
+        return self
+
+    def check(self):
+        """Log a warning if the counters do not add up to the event count."""
+        sums = {
+            'countries': sum(self.countries.values()),
+            'dates': sum(self.dates.values())
+        }
+        # Dropped query terms are not counted anymore
+        if self.floor == 0:
+            sums['terms'] = sum([x[0] for x in self.terms.values()])
+        if len(set(list(sums.values()) + [self.events])) > 1:
+            logging.warning("Event counts do not match: %s events, %s"
+                            % (self.events, sums))
+            return False
+        return True
+
+    def to_dict(self):
+        """Return a compact, JSON-serializable representation."""
+        d = {
+            'e': self.events,
+            'r': self.records,
+            'c': self.countries,
+            'd': self.dates,
+            't': self.terms
+        }
+        if self.capacity is not None:
+            d['k'] = self.capacity
+            d['f'] = self.floor
+            d['x'] = self.errors
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        """Build an aggregate from to_dict() output.
+
+The nested format used before this class existed, with 'query_countries',
+'query_dates' and 'query_terms' dicts, is also accepted.
+"""
+        agg = cls()
+        if 'query_countries' in d:
+            agg.records = d['records']
+            for x in d['query_countries'].values():
+                agg.add_country(x['query_country'], x['times'])
+            for x in d['query_dates'].values():
+                agg.add_date(x['query_date'], x['times'])
+            for x in d['query_terms'].values():
+                agg.add_terms(x['query_terms'], x['times'], x['records'])
+            agg.events = sum(agg.dates.values())
+            return agg
+        agg.events = d['e']
+        agg.records = d['r']
+        agg.countries = dict(d['c'])
+        agg.dates = dict(d['d'])
+        agg.terms = dict((k, list(v)) for k, v in d['t'].items())
+        agg.capacity = d.get('k')
+        agg.floor = d.get('f', 0)
+        agg.errors = dict(d.get('x', {}))
+        return agg
+
+    def encode(self):
+        """Return a compact, zlib-compressed binary representation.
+
+Every country, date and term string is stored once in a string table and the
+counters refer to it by position, as flat arrays:
+  [version, strings, events, records,
+   [country, times, ...], [date, times, ...], [terms, times, records, ...],
+   capacity, floor, [terms, error, ...]]
+The last three elements are only written for bounded query terms.
+"""
+        strings = []
+        index = {}
+
+        def intern(x):
+            i = index.get(x)
+            if i is None:
+                i = index[x] = len(strings)
+                strings.append(x)
+            return i
+
+        countries = []
+        for k, v in self.countries.items():
+            countries.extend([intern(k), v])
+        dates = []
+        for k, v in self.dates.items():
+            dates.extend([intern(k), v])
+        terms = []
+        for k, v in self.terms.items():
+            terms.extend([intern(k), v[0], v[1]])
+
+        payload = [CODEC_VERSION, strings, self.events, self.records,
+                   countries, dates, terms]
+        if self.capacity is not None:
+            errors = []
+            for k, v in self.errors.items():
+                errors.extend([intern(k), v])
+            payload.extend([self.capacity, self.floor, errors])
+        return zlib.compress(json.dumps(payload, separators=(',', ':')), 9)
+
+    @classmethod
+    def decode(cls, data):
+        """Build an aggregate from encode() output."""
+        payload = json.loads(zlib.decompress(data))
+        if payload[0] not in [1, CODEC_VERSION]:
+            raise ValueError("Unknown aggregate encoding version %s" % payload[0])
+        strings, events, records, countries, dates, terms = payload[1:7]
+        agg = cls()
+        agg.events = events
+        agg.records = records
+        for i in range(0, len(countries), 2):
+            agg.countries[strings[countries[i]]] = countries[i + 1]
+        for i in range(0, len(dates), 2):
+            agg.dates[strings[dates[i]]] = dates[i + 1]
+        for i in range(0, len(terms), 3):
+            agg.terms[strings[terms[i]]] = [terms[i + 1], terms[i + 2]]
+        if len(payload) > 7:
+            agg.capacity, agg.floor, errors = payload[7:10]
+            for i in range(0, len(errors), 2):
+                agg.errors[strings[errors[i]]] = errors[i + 1]
+        return agg
+
+    def terms_only(self):
+        """Return a copy holding only the query terms, and their sketch state."""
+        agg = ResourceAggregate(self.capacity)
+        agg.terms = self.terms
+        agg.floor = self.floor
+        agg.errors = self.errors
+        return agg
+
+    def ranked_terms(self):
+        """Return the (terms, [times, records]) pairs, most records first."""
+        return sorted(self.terms.items(),
+                      key=lambda x: (-x[1][1], -x[1][0], x[0]))
+
+    def terms_to_model(self, top_n=None):
+        """Build the query_terms and other_terms of a Search or Download.
+
+If there are more than top_n query terms, only the top_n with most records are
+returned as QueryTerms, and the rest are summed up in a QueryTermsOther. If
+some terms were dropped by the sketch, the other row is the rest of the exact
+totals, and its count of terms is a lower bound.
+"""
+        if self.floor == 0 and (top_n is None or len(self.terms) <= top_n):
+            return [QueryTerms(query_terms=k, times=v[0], records=v[1])
+                    for k, v in self.terms.items()], None
+        ranked = self.ranked_terms()
+        if top_n is None:
+            top_n = len(ranked)
+        if self.floor == 0:
+            # Exact counts: the other row is the sum of the dropped terms
+            other = QueryTermsOther(
+                terms=len(ranked) - top_n,
+                times=sum([v[0] for k, v in ranked[top_n:]]),
+                records=sum([v[1] for k, v in ranked[top_n:]])
+            )
+        else:
+            other = QueryTermsOther(
+                terms=max(len(ranked) - top_n, 0),
+                times=self.events - sum([v[0] for k, v in ranked[:top_n]]),
+                records=self.records - sum([v[1] for k, v in ranked[:top_n]])
+            )
+            other.records_error = max([self.terms_error(k)
+                                       for k, v in ranked[:top_n]] + [0])
+        return [QueryTerms(query_terms=k, times=v[0], records=v[1])
+                for k, v in ranked[:top_n]], other
+
+    def to_model(self, cls, top_n=None):
+        """Build a Search or Download structured property value."""
+        query_terms, other_terms = self.terms_to_model(top_n)
+        return cls(
+            events=self.events,
+            records=self.records,
+            query_countries=[QueryCountry(query_country=k, times=v)
+                             for k, v in self.countries.items()],
+            query_dates=[QueryDate(query_date=datetime.strptime(k, '%Y-%m-%d').date(),
+                                   times=v)
+                         for k, v in self.dates.items()],
+            query_terms=query_terms,
+            other_terms=other_terms
+        )
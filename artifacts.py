@@ -0,0 +1,191 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "artifacts.py 2026-10-19T13:45-03:00"
+
+import errno
+import json
+import logging
+import os
+import zlib
+from google.appengine.ext import ndb
+from models import ReportArtifact
+from config import *
+
+def gzip_bytes(data):
+    """Compress bytes in gzip format."""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def gunzip_bytes(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+class Artifact(object):
+    """A published file: its stored bytes and how to serve them."""
+    __slots__ = ['name', 'data', 'content_type', 'encoding', 'etag',
+                 'version']
+
+    def __init__(self, name, data, content_type, encoding=None, etag=None,
+                 version=None):
+        self.name = name
+        # Stored bytes, compressed if encoding is 'gzip'
+        self.data = data
+        self.content_type = content_type
+        self.encoding = encoding
+        # Hash of the uncompressed bytes
+        self.etag = etag
+        # Version of the code that rendered it
+        self.version = version
+
+    def body(self):
+        """Return the uncompressed bytes."""
+        if self.encoding == 'gzip':
+            return gunzip_bytes(self.data)
+        return self.data
+
+class ArtifactStore(object):
+    """Storage of published artifacts, by name.
+
+Backends implement get_multi, put_multi and delete_multi. Names are relative
+paths, such as reports/201604/<gbifdatasetid>.html. Backends that can run
+their calls in the background also implement get_multi_async and
+put_multi_async; otherwise these run the calls and return completed Futures.
+"""
+    def get(self, name):
+        return self.get_multi([name])[0]
+
+    @ndb.tasklet
+    def get_async(self, name):
+        artifacts = yield self.get_multi_async([name])
+        raise ndb.Return(artifacts[0])
+
+    def get_multi_async(self, names):
+        future = ndb.Future()
+        future.set_result(self.get_multi(names))
+        return future
+
+    def put_multi_async(self, artifacts):
+        future = ndb.Future()
+        future.set_result(self.put_multi(artifacts))
+        return future
+
+    def get_multi(self, names):
+        """Return the Artifact of each name, or None if not stored."""
+        raise NotImplementedError
+
+    def put_multi(self, artifacts):
+        raise NotImplementedError
+
+    def delete_multi(self, names):
+        raise NotImplementedError
+
+class DatastoreArtifactStore(ArtifactStore):
+    """Artifacts stored as ReportArtifact entities, keyed by name."""
+    def get_multi(self, names):
+        return self.get_multi_async(names).get_result()
+
+    @ndb.tasklet
+    def get_multi_async(self, names):
+        entities = yield ndb.get_multi_async(
+            [ndb.Key(ReportArtifact, x) for x in names]
+        )
+        raise ndb.Return([None if x is None else
+                          Artifact(x.key.id(), x.data, x.content_type,
+                                   x.encoding, x.etag, x.version)
+                          for x in entities])
+
+    def put_multi(self, artifacts):
+        self.put_multi_async(artifacts).get_result()
+
+    @ndb.tasklet
+    def put_multi_async(self, artifacts):
+        entities = []
+        for artifact in artifacts:
+            if len(artifact.data) > ReportArtifact.MAX_SIZE:
+                logging.warning("Artifact %s too large to store: %d bytes"
+                                % (artifact.name, len(artifact.data)))
+                continue
+            entities.append(ReportArtifact(
+                id=artifact.name,
+                data=artifact.data,
+                content_type=artifact.content_type,
+                encoding=artifact.encoding,
+                etag=artifact.etag,
+                version=artifact.version
+            ))
+        yield ndb.put_multi_async(entities)
+
+    def delete_multi(self, names):
+        ndb.delete_multi([ndb.Key(ReportArtifact, x) for x in names])
+
+class LocalArtifactStore(ArtifactStore):
+    """Artifacts stored as files under a local directory, for testing.
+
+Each artifact is a file with its stored bytes, next to a .meta JSON file with
+the rest of its attributes.
+"""
+    def __init__(self, root=ARTIFACT_LOCAL_ROOT):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def get_multi(self, names):
+        result = []
+        for name in names:
+            try:
+                with open(self.path(name), 'rb') as f:
+                    data = f.read()
+                with open(self.path(name) + '.meta') as f:
+                    meta = json.load(f)
+            except IOError:
+                result.append(None)
+                continue
+            result.append(Artifact(name, data, meta['content_type'],
+                                   meta['encoding'], meta['etag'],
+                                   meta.get('version')))
+        return result
+
+    def put_multi(self, artifacts):
+        for artifact in artifacts:
+            path = self.path(artifact.name)
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            with open(path, 'wb') as f:
+                f.write(artifact.data)
+            with open(path + '.meta', 'w') as f:
+                json.dump({
+                    'content_type': artifact.content_type,
+                    'encoding': artifact.encoding,
+                    'etag': artifact.etag,
+                    'version': artifact.version
+                }, f)
+
+    def delete_multi(self, names):
+        for name in names:
+            for path in [self.path(name), self.path(name) + '.meta']:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+# Storage backends, by the name used in ARTIFACT_STORE
+ARTIFACT_STORES = {
+    'datastore': DatastoreArtifactStore,
+    'local': LocalArtifactStore
+}
+
+def get_store():
+    """Return the artifact store configured in ARTIFACT_STORE."""
+    return ARTIFACT_STORES[ARTIFACT_STORE]()
@@ -17,7 +17,7 @@
 __author__ = "Javier Otegui"
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "config.py 2018-10-15T23:18-03:00"
+__version__ = "config.py 2026-10-19T08:00-03:00"
 
 from google.appengine.api import modules
 
@@ -29,9 +29,68 @@ MODULE = modules.get_hostname(module=MODULE_NAME).replace("prod.", "")
 # Carto
 CDB_URL = "https://vertnet.carto.com/api/v2/sql"
 CDB_TABLE = "query_log_master"
+# Number of events requested per page when walking CDB_TABLE by cartodb_id.
+# A page_size of 0 extracts the whole period in a single query.
+CDB_PAGE_SIZE = 10000
 
 # Geonames
 GNM_URL = "http://api.geonames.org/countryCodeJSON"
+# Resolve coordinates against the bundled country boundaries (geocoder.py)
+# before calling GeoNames
+GNM_OFFLINE = True
+# Call GeoNames for coordinates that are not inside any bundled boundary
+GNM_HTTP_FALLBACK = True
+# Maximum number of concurrent GeoNames requests when resolving in bulk
+GNM_POOL_SIZE = 10
+# Maximum number of locations kept in each instance's country cache
+COUNTRY_CACHE_SIZE = 50000
+# Maximum number of Dataset and Period entities kept in each instance's cache
+ENTITY_CACHE_SIZE = 10000
+# Seconds a cached Dataset or Period is used before reading it again
+ENTITY_CACHE_SECONDS = 600
+
+# Long tasks
+# Seconds a task works before checkpointing and chaining a continuation,
+# below the 10 minute deadline of push queue requests
+TASK_TIME_BUDGET = 540
+# Minimum seconds left to start another unit of work
+TASK_TIME_MARGIN = 30
+
+# Processing
+# Number of parallel ProcessEvents tasks, each over a range of gbifdatasetid
+PROCESS_SHARDS = 8
+# Maximum number of resources (one per dataset and event type) kept in memory
+# by the direct pipeline mode before spilling them to ReportToProcess entities
+PIPELINE_MAX_RESOURCES = 20000
+# Number of Reports read and written per batch by the direct pipeline mode
+PIPELINE_BATCH_SIZE = 100
+# Number of Reports rewritten by each task of a migration
+MIGRATION_BATCH_SIZE = 50
+# Number of query terms per resource and event type kept by the sketch of
+# extractions run with terms_sketch=true. Resources with up to twice as many
+# distinct query terms are counted exactly
+TERMS_SKETCH_CAPACITY = 1000
+# Count together the query strings that only differ in case, spacing or order
+# of their terms (see queryterms.py)
+CANONICAL_QUERY_TERMS = True
+
+# Report viewers (see renderer.py)
+# Seconds a rendered report of a finished period is kept in memcache
+RENDER_CACHE_SECONDS = 7 * 24 * 3600
+# Seconds a rendered report of a period still in progress is kept in memcache
+RENDER_CACHE_SECONDS_IN_PROGRESS = 300
+# Seconds browsers and proxies may keep a report of a finished period
+RENDER_MAX_AGE = 24 * 3600
+# Backend of the published reports (see artifacts.py): 'datastore', or 'local'
+# to write them under ARTIFACT_LOCAL_ROOT when testing outside App Engine
+ARTIFACT_STORE = "datastore"
+ARTIFACT_LOCAL_ROOT = "/tmp/usagestats-artifacts"
+
+# Reports
+# Number of query terms, those with most records, kept in each Report and its
+# rendered versions. The rest are summed up in a single row, and the full list
+# is stored in a QueryTermsArchive entity
+QUERY_TERMS_TOP_N = 100
 
 # GitHub
 GH_URL = "https://api.github.com"
@@ -45,20 +104,28 @@ GH_COMMITTER = {
 URI_BASE = "/admin/parser/"
 URI_INIT = URI_BASE + "init"
 URI_GET_EVENTS = URI_BASE + "get_events"
+URI_MERGE_EVENTS = URI_BASE + "merge_events"
+URI_DAILY_ROLLUP = URI_BASE + "daily_rollup"
 URI_PROCESS_EVENTS = URI_BASE + "process_events"
 URI_GITHUB_STORE = URI_BASE + "github_store"
 URI_GITHUB_ISSUE = URI_BASE + "github_issue"
+URI_PUBLISH_REPORTS = URI_BASE + "publish_reports"
 
 # URLs
 URL_BASE = "http://" + MODULE
 URL_INIT = URL_BASE + URI_INIT
 URL_GET_EVENTS = URL_BASE + URI_GET_EVENTS
+URL_MERGE_EVENTS = URL_BASE + URI_MERGE_EVENTS
+URL_DAILY_ROLLUP = URL_BASE + URI_DAILY_ROLLUP
 URL_PROCESS_EVENTS = URL_BASE + URI_PROCESS_EVENTS
 URL_GITHUB_STORE = URL_BASE + URI_GITHUB_STORE
 URL_GITHUB_ISSUE = URL_BASE + URI_GITHUB_ISSUE
+URL_PUBLISH_REPORTS = URL_BASE + URI_PUBLISH_REPORTS
 
 # Other module-wide variables
 QUEUENAME = "usagestatsqueue"
+# Low-rate queue for background jobs that must not compete with the viewers
+MIGRATION_QUEUENAME = "migrationqueue"
 EMAIL_SENDER = "VertNet Tools - Usage Stats <vertnetinfo@vertnet.org>"
 EMAIL_RECIPIENT = "John Wieczorek <tuco@berkeley.edu>"
 EMAIL_ADMINS = [
@@ -0,0 +1,61 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "counters.py 2026-10-18T21:15-03:00"
+
+import random
+from google.appengine.ext import ndb
+from models import CounterShard
+
+# Number of entities each counter is split into. Each one is its own entity
+# group, so up to this many transactions can increment a counter at once
+NUM_SHARDS = 20
+
+def shard_keys(name):
+    """Return the keys of all the shards of a counter."""
+    return [ndb.Key(CounterShard, "%s|%d" % (name, i))
+            for i in range(NUM_SHARDS)]
+
+@ndb.transactional
+def increment(name, delta=1):
+    """Add delta to a random shard of a counter.
+
+Joins the current transaction, if any, so the increment is committed or
+rolled back along with the writes it counts.
+"""
+    key = ndb.Key(CounterShard, "%s|%d" % (name, random.randint(0, NUM_SHARDS - 1)))
+    shard = key.get()
+    if shard is None:
+        shard = CounterShard(key=key, name=name)
+    shard.count += delta
+    shard.put()
+
+def get_counts(names):
+    """Return a dict with the value of each counter, in a single batch get."""
+    keys = []
+    for name in names:
+        keys.extend(shard_keys(name))
+    counts = dict((name, 0) for name in names)
+    for shard in ndb.get_multi(keys):
+        if shard is not None:
+            counts[shard.name] += shard.count
+    return counts
+
+def get_count(name):
+    """Return the value of a counter, the sum of all its shards."""
+    return get_counts([name])[name]
+
+def period_counter(period_entity, field):
+    """Name of the counter of a Period progress field for its current run.
+
+Counters are named after the run, so a new run of a period starts at zero.
+"""
+    return "|".join([period_entity.key.id(), str(period_entity.run_id), field])
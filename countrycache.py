@@ -0,0 +1,101 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "countrycache.py 2026-10-18T12:30-03:00"
+
+import threading
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from lrucache import LRUCache
+from models import CountryLookup
+from config import *
+
+class CountryCache(object):
+    """Tiered cache of country names by rounded location key ("lat|lon").
+
+Lookups go through an in-process LRU, then memcache, then the CountryLookup
+entities in the datastore. Values found in a lower tier are copied to the
+tiers above it. Only actual country names are made durable; "Unknown" answers
+are kept in memory and memcache only, so that a GeoNames failure is never
+stored for good.
+
+Hit and miss counters are kept for each tier, and for the two resolvers behind
+the cache: the bundled boundaries and GeoNames.
+"""
+    TIERS = ['lru', 'memcache', 'datastore', 'boundaries', 'geonames']
+
+    def __init__(self, max_size=COUNTRY_CACHE_SIZE):
+        self.lru = LRUCache(max_size)
+        self.lock = threading.Lock()
+        self.stats = dict((t, {'hits': 0, 'misses': 0}) for t in self.TIERS)
+
+    def count(self, tier, hits=0, misses=0):
+        with self.lock:
+            self.stats[tier]['hits'] += hits
+            self.stats[tier]['misses'] += misses
+
+    def snapshot(self):
+        """Return a copy of the counters, to compute deltas with since()."""
+        with self.lock:
+            return dict((t, dict(v)) for t, v in self.stats.items())
+
+    def since(self, snapshot):
+        """Return the counters accumulated after 'snapshot' was taken."""
+        current = self.snapshot()
+        return dict((t, {
+            'hits': current[t]['hits'] - snapshot[t]['hits'],
+            'misses': current[t]['misses'] - snapshot[t]['misses']
+        }) for t in self.TIERS)
+
+    def get(self, k):
+        return self.get_multi([k]).get(k)
+
+    def get_multi(self, keys):
+        """Return a dict with the countries of the keys found in any tier."""
+        keys = list(keys)
+
+        found = self.lru.get_multi(keys)
+        self.count('lru', len(found), len(keys) - len(found))
+        misses = [k for k in keys if k not in found]
+        if len(misses) == 0:
+            return found
+
+        cached = memcache.get_multi(misses)
+        self.count('memcache', len(cached), len(misses) - len(cached))
+        self.lru.set_multi(cached)
+        found.update(cached)
+        misses = [k for k in misses if k not in cached]
+        if len(misses) == 0:
+            return found
+
+        entities = ndb.get_multi([ndb.Key(CountryLookup, k) for k in misses])
+        stored = dict((e.key.id(), e.country) for e in entities if e is not None)
+        self.count('datastore', len(stored), len(misses) - len(stored))
+        if len(stored) > 0:
+            self.lru.set_multi(stored)
+            memcache.set_multi(stored)
+            found.update(stored)
+
+        return found
+
+    def set(self, k, v):
+        self.set_multi({k: v})
+
+    def set_multi(self, mapping):
+        """Store new countries in every tier."""
+        if len(mapping) == 0:
+            return
+        self.lru.set_multi(mapping)
+        memcache.set_multi(mapping)
+        ndb.put_multi([CountryLookup(id=k, country=v)
+                       for k, v in mapping.items() if v != "Unknown"])
+
+country_cache = CountryCache()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Build the country boundaries file used by geocoder.CountryGeocoder.
+
+Usage:
+    python data/build_countries.py <admin0.geojson> <countryInfo.txt> [output]
+
+<admin0.geojson> is a country boundaries FeatureCollection with ISO 3166-1
+alpha-2 codes in its properties, such as Natural Earth's
+ne_10m_admin_0_countries. <countryInfo.txt> is the GeoNames country table
+(http://download.geonames.org/export/dump/countryInfo.txt), used to label each
+boundary with the same countryName the GeoNames API returns. Output defaults to
+data/countries.json.gz.
+"""
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "build_countries.py 2026-10-18T10:05-03:00"
+
+import gzip
+import json
+import os
+import sys
+
+# Property names holding the ISO alpha-2 code, in order of preference
+ISO_PROPERTIES = ['iso_a2_eh', 'iso_a2', 'wb_a2', 'iso']
+
+# Decimal places kept for boundary coordinates
+PRECISION = 3
+
+def geonames_names(path):
+    """Read the ISO code to countryName mapping from countryInfo.txt."""
+    names = {}
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            cols = line.rstrip('\n').split('\t')
+            names[cols[0]] = cols[4]
+    return names
+
+def iso_code(properties):
+    """Return the first valid ISO alpha-2 code in a feature's properties."""
+    props = dict((k.lower(), v) for k, v in properties.items())
+    for p in ISO_PROPERTIES:
+        code = props.get(p)
+        if code and len(code) == 2 and code.isalpha():
+            return code.upper()
+    return None
+
+def simplify(rings):
+    """Round coordinates and drop repeated vertices."""
+    result = []
+    for ring in rings:
+        r = []
+        for lon, lat in [p[:2] for p in ring]:
+            p = [round(lon, PRECISION), round(lat, PRECISION)]
+            if not r or r[-1] != p:
+                r.append(p)
+        if len(r) >= 4:
+            result.append(r)
+    return result
+
+def build(geojson_path, countryinfo_path, output_path):
+    names = geonames_names(countryinfo_path)
+    with open(geojson_path) as f:
+        features = json.load(f)['features']
+
+    countries = {}
+    skipped = []
+    for feature in features:
+        code = iso_code(feature['properties'])
+        if code not in names:
+            skipped.append(feature['properties'].get('NAME', code))
+            continue
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['coordinates']]
+        else:
+            polygons = geometry['coordinates']
+        polygons = [simplify(x) for x in polygons]
+        countries.setdefault(names[code], []).extend([x for x in polygons if x])
+
+    with gzip.open(output_path, 'wb') as f:
+        f.write(json.dumps(sorted(countries.items()),
+                           separators=(',', ':')).encode('utf-8'))
+
+    print("Wrote %d countries to %s" % (len(countries), output_path))
+    if skipped:
+        print("Skipped %d features without a GeoNames country: %s"
+              % (len(skipped), ", ".join([str(x) for x in skipped])))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    if len(sys.argv) > 3:
+        output = sys.argv[3]
+    else:
+        output = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'countries.json.gz')
+    build(sys.argv[1], sys.argv[2], output)
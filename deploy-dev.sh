@@ -1 +1,6 @@
-gcloud preview app deploy --version dev usagestats.yaml
\ No newline at end of file
+# Offline country lookups need the bundled boundaries (see geocoder.py)
+if grep -q "^GNM_OFFLINE = True" config.py && [ ! -f data/countries.json.gz ]; then
+    echo "data/countries.json.gz not found. Build it with data/build_countries.py"
+    exit 1
+fi
+gcloud preview app deploy --version dev usagestats.yaml
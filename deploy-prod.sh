@@ -1 +1,6 @@
+# Offline country lookups need the bundled boundaries (see geocoder.py)
+if grep -q "^GNM_OFFLINE = True" config.py && [ ! -f data/countries.json.gz ]; then
+    echo "data/countries.json.gz not found. Build it with data/build_countries.py"
+    exit 1
+fi
 gcloud app deploy --version prod --promote usagestats.yaml
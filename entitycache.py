@@ -0,0 +1,110 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "entitycache.py 2026-10-19T08:00-03:00"
+
+import threading
+import time
+from google.appengine.ext import ndb
+from lrucache import LRUCache
+from config import *
+
+class EntityCache(object):
+    """In-process cache of Dataset and Period entities, by key.
+
+These kinds change about once a month, so they are kept in a bounded LRU for
+ENTITY_CACHE_SECONDS and shared by all the requests of the instance. Putting
+or deleting one of them drops it from the cache of the instance that wrote it
+(see the hooks in models.py); other instances read it again when their copy
+expires. Cached entities are shared: callers must not modify them, and
+processes that update a Period read it from the datastore instead.
+
+Hit, miss and expiry counters are kept for each kind. Expired entries count
+as misses too.
+"""
+    KINDS = ['Dataset', 'Period']
+
+    def __init__(self, max_size=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_SECONDS):
+        self.lru = LRUCache(max_size)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.stats = dict((k, {'hits': 0, 'misses': 0, 'expired': 0})
+                          for k in self.KINDS)
+
+    def count(self, kind, field):
+        with self.lock:
+            self.stats.setdefault(
+                kind, {'hits': 0, 'misses': 0, 'expired': 0}
+            )[field] += 1
+
+    def snapshot(self):
+        """Return a copy of the counters, to compute deltas with since()."""
+        with self.lock:
+            return dict((k, dict(v)) for k, v in self.stats.items())
+
+    def since(self, snapshot):
+        """Return the counters accumulated after 'snapshot' was taken."""
+        current = self.snapshot()
+        empty = {'hits': 0, 'misses': 0, 'expired': 0}
+        return dict((k, dict((f, v[f] - snapshot.get(k, empty)[f])
+                             for f in v))
+                    for k, v in current.items())
+
+    def lookup(self, keys):
+        """Return a dict with the cached entities of the keys not expired."""
+        now = time.time()
+        found = {}
+        for k in keys:
+            item = self.lru.get(k)
+            if item is not None and item[0] < now:
+                self.lru.delete(k)
+                self.count(k.kind(), 'expired')
+                item = None
+            if item is None:
+                self.count(k.kind(), 'misses')
+            else:
+                self.count(k.kind(), 'hits')
+                found[k] = item[1]
+        return found
+
+    def get(self, key):
+        return self.get_multi([key])[0]
+
+    def get_multi(self, keys):
+        """Return the entity of each key, or None, like ndb.get_multi."""
+        return self.get_multi_async(keys).get_result()
+
+    @ndb.tasklet
+    def get_async(self, key):
+        entities = yield self.get_multi_async([key])
+        raise ndb.Return(entities[0])
+
+    @ndb.tasklet
+    def get_multi_async(self, keys):
+        """Return a Future with the entity of each key, or None. Only the keys
+not cached are read, in one batch."""
+        keys = list(keys)
+        found = self.lookup(keys)
+        misses = list(set([k for k in keys if k not in found]))
+        if len(misses) > 0:
+            entities = yield ndb.get_multi_async(misses)
+            expires = time.time() + self.ttl
+            self.lru.set_multi(dict((x.key, (expires, x))
+                                    for x in entities if x is not None))
+            found.update(zip(misses, entities))
+        raise ndb.Return([found.get(k) for k in keys])
+
+    def invalidate(self, keys):
+        """Drop entities from the cache of this instance."""
+        for k in keys:
+            self.lru.delete(k)
+
+entity_cache = EntityCache()
@@ -0,0 +1,148 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "geocoder.py 2026-10-19T13:30-03:00"
+
+import gzip
+import json
+import logging
+import os
+
+# Bundled country boundaries, built by data/build_countries.py
+COUNTRIES_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                              'data', 'countries.json.gz')
+
+# Size, in degrees, of the cells of the spatial index
+GRID_CELL_SIZE = 1.0
+
+# Decimals kept of the coordinates of a point before it is resolved. Matches
+# the granularity of the country cache, so every point of a cached location
+# resolves to the same country
+LOCATION_DECIMALS = 2
+
+def round_location(lat, lon):
+    """Return a point rounded to LOCATION_DECIMALS."""
+    return (round(lat, LOCATION_DECIMALS), round(lon, LOCATION_DECIMALS))
+
+class CountryGeocoder(object):
+    """Resolve coordinates to GeoNames country names without network calls.
+
+Boundaries are loaded from the bundled dataset, a gzipped JSON list of
+[countryName, polygons] pairs, where each polygon is a list of rings (outer
+ring first, then holes) and each ring a list of [lon, lat] pairs. Polygons are
+indexed in a regular lat/lon grid; a lookup only tests the polygons whose
+bounding box overlaps the cell of the point.
+"""
+    def __init__(self, path=COUNTRIES_PATH, cell_size=GRID_CELL_SIZE):
+        self.path = path
+        self.cell_size = cell_size
+        self.polygons = []
+        self.grid = {}
+        self.available = False
+        self.load()
+
+    def load(self):
+        """Read the boundaries file and build the grid index."""
+        if not check_boundaries(self.path):
+            return
+
+        with gzip.open(self.path, 'rb') as f:
+            countries = json.loads(f.read().decode('utf-8'))
+
+        for name, polygons in countries:
+            for rings in polygons:
+                lons = [p[0] for p in rings[0]]
+                lats = [p[1] for p in rings[0]]
+                bbox = (min(lons), min(lats), max(lons), max(lats))
+                self.polygons.append((name, bbox, rings))
+                idx = len(self.polygons) - 1
+                for cell in self.cells(bbox):
+                    self.grid.setdefault(cell, []).append(idx)
+
+        self.available = True
+        logging.info("Loaded %d country polygons into %d grid cells"
+                     % (len(self.polygons), len(self.grid)))
+
+    def cell(self, lat, lon):
+        """Return the grid cell containing a point."""
+        return (int((lon + 180) // self.cell_size),
+                int((lat + 90) // self.cell_size))
+
+    def cells(self, bbox):
+        """Return all grid cells overlapped by a bounding box."""
+        x0, y0 = self.cell(bbox[1], bbox[0])
+        x1, y1 = self.cell(bbox[3], bbox[2])
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def country(self, lat, lon):
+        """Return the country name for a point, or None if not in any country.
+
+The point is rounded with round_location() first, like in countries().
+"""
+        lat, lon = round_location(lat, lon)
+        for idx in self.grid.get(self.cell(lat, lon), []):
+            name, bbox, rings = self.polygons[idx]
+            if lon < bbox[0] or lon > bbox[2] or lat < bbox[1] or lat > bbox[3]:
+                continue
+            if point_in_polygon(lon, lat, rings):
+                return name
+        return None
+
+    def countries(self, lats, lons):
+        """Bulk version of country(), for parallel arrays of coordinates.
+
+Coordinates are resolved once per distinct location, rounded with
+round_location() as in country().
+"""
+        resolved = {}
+        result = []
+        for lat, lon in zip(lats, lons):
+            k = round_location(lat, lon)
+            if k not in resolved:
+                resolved[k] = self.country(*k)
+            result.append(resolved[k])
+        return result
+
+def point_in_polygon(x, y, rings):
+    """Even-odd ray casting test of a point against a polygon with holes."""
+    inside = False
+    for ring in rings:
+        j = len(ring) - 1
+        for i in range(len(ring)):
+            xi, yi = ring[i]
+            xj, yj = ring[j]
+            if (yi > y) != (yj > y) and \
+                    x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+                inside = not inside
+            j = i
+    return inside
+
+def check_boundaries(path=COUNTRIES_PATH):
+    """Log an error and return False if the boundaries file is missing.
+
+Called at startup too, so that a deploy without the file shows up in the logs
+before every lookup falls back to GeoNames.
+"""
+    if os.path.exists(path):
+        return True
+    logging.error("Country boundaries not found at %s. Offline geocoding "
+                  "disabled, every country lookup goes to GeoNames. Build "
+                  "them with data/build_countries.py" % path)
+    return False
+
+_geocoder = None
+
+def get_geocoder():
+    """Return the instance-wide CountryGeocoder, loading it on first use."""
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = CountryGeocoder()
+    return _geocoder
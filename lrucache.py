@@ -0,0 +1,65 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "lrucache.py 2026-10-18T12:30-03:00"
+
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """Bounded, thread-safe, in-process least-recently-used cache."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, k, default=None):
+        with self.lock:
+            if k not in self.items:
+                self.misses += 1
+                return default
+            v = self.items.pop(k)
+            self.items[k] = v
+            self.hits += 1
+            return v
+
+    def get_multi(self, keys):
+        """Return a dict with the cached values of 'keys'."""
+        result = {}
+        for k in keys:
+            v = self.get(k, self)
+            if v is not self:
+                result[k] = v
+        return result
+
+    def set(self, k, v):
+        with self.lock:
+            self.items.pop(k, None)
+            self.items[k] = v
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def set_multi(self, mapping):
+        for k, v in mapping.items():
+            self.set(k, v)
+
+    def delete(self, k):
+        with self.lock:
+            self.items.pop(k, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
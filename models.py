@@ -9,11 +9,12 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "models.py 2018-12-11T12:55-03:00"
+__version__ = "models.py 2026-10-19T14:15-03:00"
 MODELS_VERSION=__version__
 
 from datetime import datetime
 from google.appengine.ext import ndb
+from entitycache import entity_cache
 
 class Dataset(ndb.Model):
     """Identifies a Dataset.
@@ -34,6 +35,14 @@ Ancestor: None
     # Other stuff
     source_url = ndb.StringProperty()
 
+    def _post_put_hook(self, future):
+        # Drop the copy cached by this instance
+        entity_cache.invalidate([self.key])
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        entity_cache.invalidate([key])
+
 class Period(ndb.Model):
     """Identifies an extraction.
 Key name: YYYYMM
@@ -67,12 +76,92 @@ Ancestor: None
     github_store = ndb.BooleanProperty()
     github_issue = ndb.BooleanProperty()
     table_name = ndb.StringProperty()
+    page_size = ndb.IntegerProperty()
+    aggregation = ndb.StringProperty(choices=['client', 'server'])
+    sharded = ndb.BooleanProperty()
+    refresh_rollups = ndb.BooleanProperty()
+    pipeline = ndb.BooleanProperty()
+    terms_sketch = ndb.BooleanProperty()
+    run_id = ndb.StringProperty()
+    # Last fan-out of the day shards of a sharded extraction in this run
+    extraction_attempt = ndb.StringProperty(indexed=False)
     # Process tracking variables
     searches_extracted = ndb.BooleanProperty()
     downloads_extracted = ndb.BooleanProperty()
+    # While processing, progress is kept in sharded counters (see counters.py)
+    # and copied here when the run finishes
     processed_searches = ndb.IntegerProperty()
     processed_downloads = ndb.IntegerProperty()
 
+    def _post_put_hook(self, future):
+        # Drop the copy cached by this instance
+        entity_cache.invalidate([self.key])
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        entity_cache.invalidate([key])
+
+class ProcessShard(ndb.Model):
+    """Progress of one of the parallel 'ProcessEvents' tasks of a Period run.
+Key name: concatenation of period, run and shard number: YYYYMM|run_id|shard
+Ancestor: None
+"""
+    period = ndb.StringProperty(required=True)
+    run_id = ndb.StringProperty()
+    shard = ndb.IntegerProperty(required=True, indexed=False)
+    # Fan-out the shard belongs to, new each time process_events fans out
+    attempt = ndb.StringProperty(indexed=False)
+    done = ndb.BooleanProperty(default=False, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+    @classmethod
+    def build_key(cls, period, run_id, shard):
+        return ndb.Key(cls, "|".join([period, str(run_id), str(shard)]))
+
+class TaskCheckpoint(ndb.Model):
+    """Progress of a long task run in time-budgeted slices (see timebudget.py).
+Key name: task, period, run and shard (if any), separated by '-'
+Ancestor: None
+"""
+    cursor = ndb.StringProperty(indexed=False)
+    done = ndb.BooleanProperty(default=False)
+    units = ndb.IntegerProperty(default=0, indexed=False)
+    # Summary of each slice: units of work, seconds and slowest unit
+    slices = ndb.JsonProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+class MigrationStatus(ndb.Model):
+    """Progress of a background migration of existing entities.
+Key name: migration name, e.g., report-v2
+Ancestor: None
+"""
+    run_id = ndb.StringProperty()
+    status = ndb.StringProperty(choices=['running', 'walked', 'done'])
+    started = ndb.DateTimeProperty(indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+    # Position and progress of the task walking the keys
+    cursor = ndb.StringProperty(indexed=False)
+    walked = ndb.IntegerProperty(default=0, indexed=False)
+    batches = ndb.IntegerProperty(default=0, indexed=False)
+
+class MigrationBatch(ndb.Model):
+    """Marks a batch of a background migration as done, so it is counted once.
+Key name: name of the batch task
+Ancestor: None
+"""
+    run_id = ndb.StringProperty(indexed=False)
+    migrated = ndb.IntegerProperty(default=0, indexed=False)
+    skipped = ndb.IntegerProperty(default=0, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class CounterShard(ndb.Model):
+    """One shard of a sharded counter (see counters.py).
+Key name: concatenation of counter name and shard number: name|n
+Ancestor: None
+"""
+    name = ndb.StringProperty(required=True)
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
 class StatsRun(ndb.Model):
     """Holds the period information for the stat processing run.
 Key name: VNStats
@@ -93,36 +182,56 @@ class CartoDownloadEntry(CartoEntry):
 class CartoSearchEntry(CartoEntry):
     pass
 
+class CountryLookup(ndb.Model):
+    """Durable tier of the coordinate to country cache.
+Key name: latitude and longitude rounded to 2 decimals: lat|lon
+Ancestor: None
+"""
+    country = ndb.StringProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
 class QueryTerms(ndb.Model):
     """
 Key name: query_terms
 Ancestor: Report
 """
-    query_terms = ndb.StringProperty()
-    records = ndb.IntegerProperty(default=0)
-    times = ndb.IntegerProperty(default=0)
+    query_terms = ndb.StringProperty(indexed=False)
+    records = ndb.IntegerProperty(default=0, indexed=False)
+    times = ndb.IntegerProperty(default=0, indexed=False)
+
+class QueryTermsOther(ndb.Model):
+    """Summary of the query terms left out of a Report, the ones with the least
+records beyond QUERY_TERMS_TOP_N. All of them are kept in a QueryTermsArchive.
+"""
+    # Number of different query terms left out
+    terms = ndb.IntegerProperty(default=0, indexed=False)
+    records = ndb.IntegerProperty(default=0, indexed=False)
+    times = ndb.IntegerProperty(default=0, indexed=False)
+    # Set if query terms were counted with a sketch (see aggregate.py): the
+    # records of each query term of the Report may be short by up to this
+    records_error = ndb.IntegerProperty(indexed=False)
 
 class QueryCountry(ndb.Model):
     """
 Key name: query_country
 Ancestor: Report
 """
-    query_country = ndb.StringProperty()
-    times = ndb.IntegerProperty(default=0)
+    query_country = ndb.StringProperty(indexed=False)
+    times = ndb.IntegerProperty(default=0, indexed=False)
 
 class QueryDate(ndb.Model):
     """
 Key name: query_date
 Ancestor: Report
 """
-    query_date = ndb.DateProperty()
-    times = ndb.IntegerProperty(default=0)
+    query_date = ndb.DateProperty(indexed=False)
+    times = ndb.IntegerProperty(default=0, indexed=False)
 
 class PastData(ndb.Model):
-    searches = ndb.IntegerProperty(default=0)
-    searched_records = ndb.IntegerProperty(default=0)
-    downloads = ndb.IntegerProperty(default=0)
-    downloaded_records = ndb.IntegerProperty(default=0)
+    searches = ndb.IntegerProperty(default=0, indexed=False)
+    searched_records = ndb.IntegerProperty(default=0, indexed=False)
+    downloads = ndb.IntegerProperty(default=0, indexed=False)
+    downloaded_records = ndb.IntegerProperty(default=0, indexed=False)
     query_terms = ndb.StructuredProperty(QueryTerms, repeated=True)
     query_countries = ndb.StructuredProperty(QueryCountry, repeated=True)
     query_dates = ndb.StructuredProperty(QueryDate, repeated=True)
@@ -134,32 +243,42 @@ class HistoryData(PastData):
     pass
 
 class Download(ndb.Model):
-    events = ndb.IntegerProperty(default=0)
-    records = ndb.IntegerProperty(default=0)
+    events = ndb.IntegerProperty(default=0, indexed=False)
+    records = ndb.IntegerProperty(default=0, indexed=False)
     # unique = ndb.IntegerProperty(default=0)
     query_terms = ndb.StructuredProperty(QueryTerms, repeated=True)
+    other_terms = ndb.StructuredProperty(QueryTermsOther)
     query_countries = ndb.StructuredProperty(QueryCountry, repeated=True)
     query_dates = ndb.StructuredProperty(QueryDate, repeated=True)
     # status = ndb.StringProperty(choices=['done', 'in progress', 'failed'])
 
 class Search(ndb.Model):
-    events = ndb.IntegerProperty(default=0)
-    records = ndb.IntegerProperty(default=0)
+    events = ndb.IntegerProperty(default=0, indexed=False)
+    records = ndb.IntegerProperty(default=0, indexed=False)
     query_terms = ndb.StructuredProperty(QueryTerms, repeated=True)
+    other_terms = ndb.StructuredProperty(QueryTermsOther)
     query_countries = ndb.StructuredProperty(QueryCountry, repeated=True)
     query_dates = ndb.StructuredProperty(QueryDate, repeated=True)
     # status = ndb.StringProperty(choices=['done', 'in progress', 'failed'])
 
+# Version of the Report schema written by this code
+# 1: statistics indexed
+# 2: statistics unindexed
+# 3: query terms beyond QUERY_TERMS_TOP_N moved to a QueryTermsArchive
+REPORT_SCHEMA_VERSION = 3
+
 class Report(ndb.Model):
     """Identifies a Report.
 Key name: concatenation of period and gbifdatasetid: YYYYMM|0000-0000-0000-0000
 Ancestor: Period
 """
-    created = ndb.DateProperty(required=True)
+    created = ndb.DateProperty(required=True, indexed=False)
     # url = ndb.StringProperty()
-    sha = ndb.StringProperty(default="")
+    sha = ndb.StringProperty(default="", indexed=False)
     reported_period = ndb.KeyProperty(kind=Period, required=True)
     reported_resource = ndb.KeyProperty(kind=Dataset, required=True)
+    # Statistics are never queried. Their sub-models (Search, Download,
+    # QueryTerms...) define all their properties with indexed=False
     searches = ndb.StructuredProperty(Search)
     downloads = ndb.StructuredProperty(Download, default=Download())
     year_data = ndb.StructuredProperty(YearData)
@@ -170,13 +289,157 @@ Ancestor: Period
                                 # self.downloads.status == 'done' and
                                 # self.searches.status == 'done' and
                                 self.issue_sent is True and
-                                self.stored is True)
+                                self.stored is True,
+                                indexed=False)
+    # Schema the entity was last written with. Not set in entities written
+    # before REPORT_SCHEMA_VERSION 2
+    schema_version = ndb.IntegerProperty(indexed=False)
+
+    def _pre_put_hook(self):
+        # Every put writes the entity with the current schema
+        self.schema_version = REPORT_SCHEMA_VERSION
+
+class QueryTermsArchive(ndb.Model):
+    """Full list of query terms of a Report with more than QUERY_TERMS_TOP_N.
+Only read when all the query terms of the report are requested.
+Key name: event type: search or download
+Ancestor: Report
+"""
+    # Maximum size of the encoded query terms
+    MAX_SIZE = 900000
+
+    # Encoded ResourceAggregate holding only the query terms (see aggregate.py)
+    data = ndb.BlobProperty(required=True)
+    # Number of different query terms
+    terms = ndb.IntegerProperty(default=0, indexed=False)
+
+class ReportArtifact(ndb.Model):
+    """A Report rendered in one format, as published by 'PublishReports'.
+Used by the datastore backend of artifacts.py.
+Key name: artifact name: reports/YYYYMM/gbifdatasetid.format
+Ancestor: None
+"""
+    # Maximum size of the stored bytes
+    MAX_SIZE = 1000000
+
+    data = ndb.BlobProperty(required=True)
+    content_type = ndb.StringProperty(indexed=False)
+    encoding = ndb.StringProperty(indexed=False)
+    etag = ndb.StringProperty(indexed=False)
+    # Deployed version that rendered it (see renderer.render_version)
+    version = ndb.StringProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class PeriodSummary(ndb.Model):
+    """Headline numbers of the Report of a Dataset for a period. None if the
+period was seeded from the Report keys, without reading the Report."""
+    period = ndb.StringProperty()
+    searches = ndb.IntegerProperty()
+    search_records = ndb.IntegerProperty()
+    downloads = ndb.IntegerProperty()
+    download_records = ndb.IntegerProperty()
+
+class DatasetPeriodIndex(ndb.Model):
+    """Periods with a Report of a Dataset, most recent first, with their
+headline numbers. Kept by the processes that write and delete Reports (see
+reportbuilder.py), so the dataset page is a single get instead of a query.
+Key name: GBIFDATASETID
+Ancestor: None
+"""
+    periods = ndb.LocalStructuredProperty(PeriodSummary, repeated=True)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+    def add(self, summary):
+        """Add or replace the summary of a period."""
+        self.periods = [x for x in self.periods if x.period != summary.period]
+        self.periods.append(summary)
+        self.periods.sort(key=lambda x: x.period, reverse=True)
+
+    def remove(self, period):
+        self.periods = [x for x in self.periods if x.period != period]
+
+class DailyAggregate(ndb.Model):
+    """Holds the resources aggregated from a single day of events of one type.
+Written by 'DailyRollup' and by each 'GetEvents' day shard, and merged by
+'MergeEvents'. Rollups of complete days are kept and reused by later runs.
+Key name: concatenation of event type and day: t|YYYYMMDD
+Ancestor: None
+"""
+    period = ndb.StringProperty(required=True)
+    run_id = ndb.StringProperty()
+    t = ndb.StringProperty(required=True)
+    day = ndb.DateProperty(required=True)
+    # False if the day had not ended yet when it was extracted
+    complete = ndb.BooleanProperty(default=False)
+    created = ndb.DateTimeProperty(auto_now=True, indexed=False)
+    events = ndb.IntegerProperty(default=0, indexed=False)
+    records = ndb.IntegerProperty(default=0, indexed=False)
+    resources = ndb.JsonProperty(compressed=True)
+
+    @classmethod
+    def build_key(cls, t, day):
+        return ndb.Key(cls, "|".join([t, day.strftime('%Y%m%d')]))
+
+    def ready_for(self, period_entity):
+        """Whether this rollup can be merged into the given Period run.
+
+Rollups of complete days are reused, unless the run asked to refresh them, in
+which case only those written during the run itself are valid.
+"""
+        if self.run_id == period_entity.run_id:
+            return True
+        return self.complete is True and period_entity.refresh_rollups is not True
 
 class ReportToProcess(ndb.Model):
     """Identifies a Report to be processed.
 This helper class is called by 'GetEvents' to temporarily store some basic data
 on all the reports that need to be processed.
+Key name: concatenation of event type and gbifdatasetid: t|gbifdatasetid
+Ancestor: None
 """
+    # Maximum size of the encoded resource stored in a single entity
+    CHUNK_SIZE = 900000
+
     t = ndb.StringProperty(required=True)
     gbifdatasetid = ndb.StringProperty(required=True)
-    resource = ndb.JsonProperty(required=True)
+    # Encoded ResourceAggregate (see aggregate.py). First chunk only, the rest
+    # are stored in ReportToProcessChunk child entities
+    data = ndb.BlobProperty()
+    chunks = ndb.IntegerProperty(default=1, indexed=False)
+    # Resource in the former JSON format, only read
+    resource = ndb.JsonProperty()
+
+    @classmethod
+    def build_key(cls, t, gbifdatasetid):
+        return ndb.Key(cls, "|".join([t, gbifdatasetid]))
+
+    @classmethod
+    def build(cls, t, gbifdatasetid, aggregate):
+        """Return the entities that store the given ResourceAggregate."""
+        data = aggregate.encode()
+        pieces = [data[i:i + cls.CHUNK_SIZE]
+                  for i in range(0, len(data), cls.CHUNK_SIZE)]
+        key = cls.build_key(t, gbifdatasetid)
+        entities = [cls(key=key, t=t, gbifdatasetid=gbifdatasetid,
+                        data=pieces[0], chunks=len(pieces))]
+        entities += [ReportToProcessChunk(id=i, parent=key, data=pieces[i])
+                     for i in range(1, len(pieces))]
+        return entities
+
+    def chunk_keys(self):
+        return [ndb.Key(ReportToProcessChunk, i, parent=self.key)
+                for i in range(1, self.chunks or 1)]
+
+    def get_data(self):
+        """Return the full encoded resource, fetching the chunks if needed."""
+        if self.chunks is None or self.chunks <= 1:
+            return self.data
+        chunks = ndb.get_multi(self.chunk_keys())
+        return self.data + "".join([x.data for x in chunks])
+
+class ReportToProcessChunk(ndb.Model):
+    """Continuation of an encoded resource too large for a ReportToProcess.
+Key name: chunk number, from 1
+Ancestor: ReportToProcess
+"""
+    data = ndb.BlobProperty(required=True)
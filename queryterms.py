@@ -0,0 +1,87 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "queryterms.py 2026-10-19T04:00-03:00"
+
+import json
+import re
+
+# Terms of a query: quoted phrases or runs of non-space characters
+_TOKENS = re.compile(r'"[^"]*"|\S+')
+# Spaces around the colon of a field:value term
+_FIELD_SEPARATOR = re.compile(r'\s*:\s*')
+# Terms that make the order of the other terms meaningful
+_OPERATORS = set(['and', 'or', 'not', '-'])
+
+def canonical_terms(query):
+    """Return the canonical form of a portal query string.
+
+Queries that only differ in case, spacing or the order of their terms get the
+same canonical form: lowercased, single spaced, and with the terms sorted.
+Terms are not sorted in queries with boolean operators or parentheses, where
+their order matters. JSON objects are written back with sorted keys.
+"""
+    if query is None:
+        return query
+    query = query.strip()
+    if query.startswith('{'):
+        try:
+            return json.dumps(json.loads(query.lower()), sort_keys=True,
+                              separators=(',', ':'))
+        except ValueError:
+            pass
+
+    query = _FIELD_SEPARATOR.sub(':', query.lower())
+    tokens = [" ".join(x.split()) for x in _TOKENS.findall(query)]
+    if not any([x in _OPERATORS or '(' in x or ')' in x for x in tokens]):
+        tokens.sort()
+    return " ".join(tokens)
+
+class TermDictionary(object):
+    """Integer IDs for the distinct canonical query terms of an extraction.
+
+Each raw query string is canonicalized once, and every resource refers to its
+query terms by ID, so a query string is stored and hashed once no matter how
+many resources it retrieved records from. IDs are only valid within the
+dictionary: aggregates must be resolved (see resolve()) before they are
+stored or merged with others.
+"""
+    def __init__(self, canonical=True):
+        self.canonical = canonical
+        # Raw query string: ID
+        self.ids = {}
+        # Canonical query terms: ID
+        self.term_ids = {}
+        # ID: canonical query terms
+        self.terms = []
+
+    def intern(self, query):
+        """Return the ID of the canonical form of a query string."""
+        i = self.ids.get(query)
+        if i is None:
+            term = canonical_terms(query) if self.canonical else query
+            i = self.term_ids.get(term)
+            if i is None:
+                i = self.term_ids[term] = len(self.terms)
+                self.terms.append(term)
+            self.ids[query] = i
+        return i
+
+    def resolve(self, resources):
+        """Replace the query term IDs of a dict of aggregates by their terms."""
+        for aggregate in resources.values():
+            aggregate.rename_terms(self.terms)
+
+    def summary(self):
+        return {
+            "queries": len(self.ids),
+            "terms": len(self.terms)
+        }
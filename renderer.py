@@ -0,0 +1,254 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "renderer.py 2026-10-19T15:15-03:00"
+
+import hashlib
+import json
+import logging
+import os
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from artifacts import Artifact, get_store, gzip_bytes
+from entitycache import entity_cache
+from jinjafilters import JINJA_ENVIRONMENT
+from config import *
+
+# Templates of the formats rendered with Jinja
+TEMPLATES = {
+    'html': 'report.html',
+    'txt': 'report.txt'
+}
+
+def render_html(report, period, dataset):
+    template = JINJA_ENVIRONMENT.get_template(TEMPLATES['html'])
+    return template.render(
+        dataset=dataset,
+        report=report,
+        period=period
+    )
+
+def render_txt(report, period, dataset):
+    template = JINJA_ENVIRONMENT.get_template(TEMPLATES['txt'])
+    return template.render(
+        dataset=dataset,
+        report=report,
+        period=period
+    )
+
+def render_json(report, period, dataset):
+    # sha = report.sha
+
+    # if sha != '':
+    #     report_call = urlfetch.fetch(
+    #         url='/'.join([ghb_url, "repos",
+    #                       ghb_org, ghb_rep,
+    #                       "git", "blobs", sha]),
+    #         headers=ghb_headers,
+    #         method=urlfetch.GET
+    #     )
+    #     report_enc = json.loads(report_call.content)['content']
+    #     content = base64.b64decode(report_enc)
+    # else:
+
+    # Get dictionary representation of Report
+    content = report.to_dict()
+
+    # Remove unwanted properties, and the internal ones, so the published
+    # format does not change along with the storage of the Report
+    content.pop("status", None)
+    content.pop("sha", None)
+    content.pop("url", None)
+    content.pop("schema_version", None)
+    for x in ["downloads", "searches"]:
+        if content.get(x) is not None:
+            content[x].pop("other_terms", None)
+
+    # Transform Key properties
+    content["reported_period"] = content["reported_period"].id()
+    content["reported_resource"] = content["reported_resource"].id()
+    content["created"] = content["created"].strftime("%Y-%m-%d")
+
+    # Transform Date properties
+    for x in ["downloads", "searches"]:
+        for i in range(len(content[x]['query_dates'])):
+            content[x]["query_dates"][i]["query_date"] = \
+                content[x]["query_dates"][i]["query_date"].\
+                strftime("%Y-%m-%d")
+
+    # Transform to JSON
+    return json.dumps(content)
+
+# Formats a Report is rendered in: render function and content type
+RENDERERS = {
+    'html': (render_html, "text/html; charset=utf-8"),
+    'txt': (render_txt, "text/plain"),
+    'json': (render_json, "application/json")
+}
+RENDER_FORMATS = ['html', 'txt', 'json']
+# Formats stored gzipped as artifacts
+GZIPPED_FORMATS = ['json']
+
+def render_version():
+    """Version of the deployed code, which renders the Reports."""
+    return os.environ.get('CURRENT_VERSION_ID', '')
+
+def render_cache_key(report_key, fmt):
+    """Memcache key of a rendered Report.
+
+Keys include the deployed version, so new templates are never served from the
+cache of a previous deployment.
+"""
+    return "render|%s|%s|%s" % (render_version(), report_key.id(), fmt)
+
+def artifact_name(report_key, fmt):
+    """Name of the published artifact of a Report in a format.
+
+Names do not change between deployments, so publishing again replaces the
+artifact. Artifacts store the version that rendered them instead, and those of
+a previous deployment are not served.
+"""
+    period, gbifdatasetid = report_key.id().split("|", 1)
+    name = "reports/%s/%s.%s" % (period, gbifdatasetid, fmt)
+    if fmt in GZIPPED_FORMATS:
+        name += ".gz"
+    return name
+
+def dataset_key(report_key):
+    """Key of the Dataset of a Report, from the Report key."""
+    return ndb.Key("Dataset", report_key.id().split("|", 1)[1])
+
+def build_artifact(report, period, dataset, fmt):
+    """Render a Report in a format as an Artifact."""
+    render, content_type = RENDERERS[fmt]
+    body = render(report, period, dataset)
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()
+    if fmt in GZIPPED_FORMATS:
+        return Artifact(artifact_name(report.key, fmt), gzip_bytes(body),
+                        content_type, 'gzip', etag, render_version())
+    return Artifact(artifact_name(report.key, fmt), body, content_type,
+                    None, etag, render_version())
+
+def publish_reports(reports, period, formats=RENDER_FORMATS):
+    """Render Reports of a period in the given formats and store the artifacts.
+
+The cached renderings are replaced with the new ones. Return the number of
+artifacts published.
+"""
+    artifacts = []
+    entries = {}
+    datasets = entity_cache.get_multi(
+        [x.reported_resource for x in reports]
+    )
+    for report, dataset in zip(reports, datasets):
+        for fmt in formats:
+            artifact = build_artifact(report, period, dataset, fmt)
+            artifacts.append(artifact)
+            entries[render_cache_key(report.key, fmt)] = \
+                cache_entry(artifact, period)
+    get_store().put_multi(artifacts)
+    set_cached(entries, period)
+    return len(artifacts)
+
+def cache_entry(artifact, period):
+    return {
+        "body": artifact.body(),
+        "etag": artifact.etag,
+        "final": period is not None and period.status == 'done'
+    }
+
+def set_cached(entries, period):
+    # Reports of periods still in progress may change without being rewritten
+    # (e.g. GitHub flags, period totals), so they are kept for less time
+    if period is not None and period.status == 'done':
+        seconds = RENDER_CACHE_SECONDS
+    else:
+        seconds = RENDER_CACHE_SECONDS_IN_PROGRESS
+    failed = memcache.set_multi(entries, time=seconds)
+    if len(failed) > 0:
+        logging.warning("Could not cache rendered reports %s" % failed)
+
+@ndb.tasklet
+def get_rendered_async(report_key, fmt):
+    """Return a Future with the rendered Report, or None if it does not exist.
+
+The result is a dict with the rendered 'body', its 'etag' (a hash of the body)
+and whether its period is 'final', i.e., done. It is read from memcache, else
+from the published artifact, else rendered from the Report. Renderings of
+finished periods are published, so they are only rendered once per deployment:
+artifacts rendered by another version are rendered and published again.
+
+All the keys are known from the Report key, so on a memcache miss the Period,
+the Dataset, the Report and the artifact are read at once, while the template
+is loaded. The Report and the Dataset are discarded if the artifact is used.
+"""
+    key = render_cache_key(report_key, fmt)
+    entry = yield ndb.get_context().memcache_get(key)
+    if entry is not None:
+        raise ndb.Return(entry)
+
+    store = get_store()
+    future = (entity_cache.get_multi_async([report_key.parent(),
+                                            dataset_key(report_key)]),
+              report_key.get_async(),
+              store.get_async(artifact_name(report_key, fmt)))
+    if fmt in TEMPLATES:
+        JINJA_ENVIRONMENT.get_template(TEMPLATES[fmt])
+    (period, dataset), report, artifact = yield future
+    if artifact is not None and artifact.version != render_version():
+        artifact = None
+    if artifact is None:
+        if report is None:
+            raise ndb.Return(None)
+        artifact = build_artifact(report, period, dataset, fmt)
+        if period is not None and period.status == 'done':
+            yield store.put_multi_async([artifact])
+
+    entry = cache_entry(artifact, period)
+    set_cached({key: entry}, period)
+    raise ndb.Return(entry)
+
+def get_rendered(report_key, fmt):
+    """Return the rendered Report, or None. See get_rendered_async."""
+    return get_rendered_async(report_key, fmt).get_result()
+
+def send_rendered(handler, entry, fmt):
+    """Write a rendered Report, or a 304 if the client already has it."""
+    etag = '"%s"' % entry["etag"]
+    handler.response.headers["ETag"] = etag
+    if entry["final"] is True:
+        handler.response.headers["Cache-Control"] = \
+            "public, max-age=%d" % RENDER_MAX_AGE
+    else:
+        handler.response.headers["Cache-Control"] = "no-cache"
+
+    header = handler.request.headers.get("If-None-Match", "")
+    tags = [x.strip() for x in header.split(",")]
+    if "*" in tags or etag in tags or "W/" + etag in tags:
+        handler.response.status_int = 304
+        return
+
+    # Artifacts are sent uncompressed: App Engine compresses responses for
+    # clients that accept it
+    handler.response.headers["content-type"] = RENDERERS[fmt][1]
+    handler.response.write(entry["body"])
+
+def invalidate(report_keys, formats=RENDER_FORMATS):
+    """Drop the cached and published renderings of the given Reports."""
+    report_keys = list(report_keys)
+    if len(report_keys) == 0:
+        return
+    memcache.delete_multi([render_cache_key(x, fmt) for x in report_keys
+                           for fmt in formats])
+    get_store().delete_multi([artifact_name(x, fmt) for x in report_keys
+                              for fmt in formats])
@@ -0,0 +1,252 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "reportbuilder.py 2026-10-19T14:45-03:00"
+
+import logging
+from datetime import datetime
+from google.appengine.ext import ndb
+from aggregate import ResourceAggregate
+from models import Report, Search, Download, QueryTermsArchive
+from models import DatasetPeriodIndex, PeriodSummary
+from config import *
+
+def report_key(period, gbifdatasetid):
+    """Return the key of the Report of a dataset for a period."""
+    return ndb.Key(Report, "|".join([period, gbifdatasetid]),
+                   parent=ndb.Key("Period", period))
+
+def new_report(period, gbifdatasetid):
+    """Create an empty Report entity."""
+    return Report(
+        key=report_key(period, gbifdatasetid),
+        created=datetime.today(),
+        reported_period=ndb.Key("Period", period),
+        reported_resource=ndb.Key("Dataset", gbifdatasetid),
+        searches=Search(
+            events=0,
+            records=0,
+            query_countries=[],
+            query_dates=[],
+            query_terms=[],
+            # status="in progress"
+        ),
+        downloads=Download(
+            events=0,
+            records=0,
+            query_countries=[],
+            query_dates=[],
+            query_terms=[],
+            # status="in progress"
+        ),
+        stored=False,
+        issue_sent=False
+    )
+
+def add_aggregate(report, t, aggregate):
+    """Set the searches or downloads of a Report from a ResourceAggregate.
+
+Only the QUERY_TERMS_TOP_N query terms with most records are kept in the
+Report. Return the QueryTermsArchive with all of them, or None if the Report
+has no other row, i.e., holds all of them itself. Any archive stored for an
+earlier version of the Report must then be deleted.
+"""
+    aggregate.check()
+    if t == 'search':
+        events = report.searches = aggregate.to_model(Search, QUERY_TERMS_TOP_N)
+    elif t == 'download':
+        events = report.downloads = aggregate.to_model(Download,
+                                                       QUERY_TERMS_TOP_N)
+    if events.other_terms is None:
+        return None
+    return build_archive(report.key, t, aggregate)
+
+def archive_key(report_key, t):
+    """Return the key of the QueryTermsArchive of a Report and event type."""
+    return ndb.Key(QueryTermsArchive, t, parent=report_key)
+
+def build_archive(report_key, t, aggregate):
+    """Build the QueryTermsArchive with all the query terms of an aggregate.
+
+If the encoded terms do not fit in an entity, the ones with least records are
+dropped until they do.
+"""
+    terms = aggregate.terms_only()
+    data = terms.encode()
+    if len(data) > QueryTermsArchive.MAX_SIZE:
+        ranked = aggregate.ranked_terms()
+        while len(data) > QueryTermsArchive.MAX_SIZE:
+            ranked = ranked[:len(ranked) // 2]
+            terms.terms = dict(ranked)
+            data = terms.encode()
+        logging.warning("Archiving only %d of %d query terms of %s %s"
+                        % (len(ranked), len(aggregate.terms), t,
+                           report_key.id()))
+    return QueryTermsArchive(key=archive_key(report_key, t), data=data,
+                             terms=len(terms.terms))
+
+@ndb.tasklet
+def load_archive_async(report_key, t):
+    """Return a Future with all the query terms of a Report, as
+(terms, [times, records]) pairs, most records first, or None if the Report
+does not exist. The Report and its archive are read together."""
+    report, archive = yield (report_key.get_async(),
+                             archive_key(report_key, t).get_async())
+    if report is None:
+        raise ndb.Return(None)
+    events = report.searches if t == 'search' else report.downloads
+    if events is None:
+        raise ndb.Return([])
+    if events.other_terms is None:
+        raise ndb.Return(sorted([(x.query_terms, [x.times, x.records])
+                                 for x in events.query_terms],
+                                key=lambda x: (-x[1][1], -x[1][0], x[0])))
+    if archive is None:
+        logging.error("Missing query terms archive of %s %s"
+                      % (t, report_key.id()))
+        raise ndb.Return([])
+    raise ndb.Return(ResourceAggregate.decode(archive.data).ranked_terms())
+
+def cap_terms(report):
+    """Move the query terms beyond QUERY_TERMS_TOP_N of a Report stored with
+all of them to archives. Return the QueryTermsArchive entities to store."""
+    archives = []
+    for t in ['search', 'download']:
+        events = report.searches if t == 'search' else report.downloads
+        if events is None or events.other_terms is not None or \
+                len(events.query_terms) <= QUERY_TERMS_TOP_N:
+            continue
+        aggregate = ResourceAggregate()
+        aggregate.events = events.events
+        aggregate.records = events.records
+        for x in events.query_terms:
+            aggregate.add_terms(x.query_terms, x.times, x.records)
+        times = sum([x.times for x in events.query_terms])
+        records = sum([x.records for x in events.query_terms])
+        events.query_terms, events.other_terms = \
+            aggregate.terms_to_model(QUERY_TERMS_TOP_N)
+
+        # The capped terms and the other row must add up to the full list
+        other = events.other_terms
+        if other.times < 0 or other.records < 0 or \
+                other.times + sum([x.times for x in events.query_terms]) \
+                != times or \
+                other.records + sum([x.records for x in events.query_terms]) \
+                != records:
+            logging.error("Query terms of %s %s do not add up after capping"
+                          % (t, report.key.id()))
+        archives.append(build_archive(report.key, t, aggregate))
+    return archives
+
+def build_reports(period, datasets):
+    """Build the Reports of a batch of datasets.
+
+'datasets' maps each gbifdatasetid to a dict of ResourceAggregate by event
+type. Existing Reports are read with a single get_multi and updated, so event
+types not in the batch keep their data. Return the entities to store, not yet
+stored: the Reports and the QueryTermsArchive of their event types with more
+than QUERY_TERMS_TOP_N query terms; and the keys to delete: the archives of
+the event types that no longer need one.
+"""
+    ids = sorted(datasets.keys())
+    reports = ndb.get_multi([report_key(period, x) for x in ids])
+
+    result = []
+    archives = []
+    stale = []
+    for gbifdatasetid, report in zip(ids, reports):
+        new = report is None
+        if new is True:
+            logging.info("Creating new report for %s" % gbifdatasetid)
+            report = new_report(period, gbifdatasetid)
+        for t, aggregate in datasets[gbifdatasetid].items():
+            archive = add_aggregate(report, t, aggregate)
+            if archive is not None:
+                archives.append(archive)
+            elif new is False:
+                stale.append(archive_key(report.key, t))
+        result.append(report)
+    return result + archives, stale
+
+def period_summary(report):
+    """Return the PeriodSummary of a Report, for its DatasetPeriodIndex."""
+    summary = PeriodSummary(period=report.reported_period.id(),
+                            searches=0, search_records=0,
+                            downloads=0, download_records=0)
+    if report.searches is not None:
+        summary.searches = report.searches.events
+        summary.search_records = report.searches.records
+    if report.downloads is not None:
+        summary.downloads = report.downloads.events
+        summary.download_records = report.downloads.records
+    return summary
+
+@ndb.tasklet
+def update_index_async(gbifdatasetid, summaries=(), removed=()):
+    """Add PeriodSummary entities to the DatasetPeriodIndex of a dataset, and
+remove periods from it, in a transaction of its own.
+
+A dataset without an index gets one seeded with the periods of its existing
+Reports, without their numbers until /admin/tools/period_index adds them, so
+the dataset page does not lose its earlier periods.
+"""
+    key = ndb.Key(DatasetPeriodIndex, gbifdatasetid)
+    index = yield key.get_async()
+    seed = []
+    if index is None:
+        # Queries cannot run in the transaction, so the seed is read first
+        report_keys = yield Report.query(
+            Report.reported_resource == ndb.Key("Dataset", gbifdatasetid)
+        ).fetch_async(keys_only=True)
+        seed = [PeriodSummary(period=x.parent().id()) for x in report_keys]
+    yield _update_index_async(key, seed, summaries, removed)
+
+@ndb.transactional_tasklet
+def _update_index_async(key, seed, summaries, removed):
+    index = yield key.get_async()
+    if index is None:
+        index = DatasetPeriodIndex(key=key, periods=[])
+        for summary in seed:
+            index.add(summary)
+    for summary in summaries:
+        index.add(summary)
+    for period in removed:
+        index.remove(period)
+    yield index.put_async()
+
+def index_reports(reports):
+    """Add the periods of stored Reports to the indexes of their datasets.
+
+Each index is updated once, in its own transaction, and all of them
+concurrently, after the Reports are stored: adding the index entity groups to
+the transactions that store the Reports would exceed the limit of cross-group
+transactions.
+"""
+    summaries = {}
+    for report in reports:
+        if report.key.kind() == 'Report':
+            summaries.setdefault(report.reported_resource.id(), [])\
+                .append(period_summary(report))
+    futures = [update_index_async(k, summaries=v)
+               for k, v in summaries.items()]
+    for future in futures:
+        future.get_result()
+
+def unindex_reports(report_keys):
+    """Remove the periods of deleted Reports from the indexes of their
+datasets."""
+    periods = {}
+    for key in report_keys:
+        periods.setdefault(key.id().split("|", 1)[1], [])\
+            .append(key.parent().id())
+    futures = [update_index_async(k, removed=v) for k, v in periods.items()]
+    for future in futures:
+        future.get_result()
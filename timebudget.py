@@ -0,0 +1,112 @@
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = '@jotegui'
+__contributors__ = "Javier Otegui, John Wieczorek"
+__copyright__ = "Copyright 2026 vertnet.org"
+__version__ = "timebudget.py 2026-10-19T01:00-03:00"
+
+import logging
+import time
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from models import TaskCheckpoint
+from config import *
+
+class TimeBudget(object):
+    """Time left to a task before it should hand over to a continuation.
+
+Long-running handlers call tick() after each unit of work (a batch, a report)
+and stop at that safe boundary as soon as exhausted() returns True, instead of
+waiting for a DeadlineExceededError to interrupt them halfway through a unit.
+"""
+    def __init__(self, seconds=TASK_TIME_BUDGET, margin=TASK_TIME_MARGIN):
+        self.seconds = seconds
+        self.margin = margin
+        self.start = time.time()
+        self.last = self.start
+        self.units = 0
+        # Duration of the slowest unit of work so far
+        self.slowest = 0
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def tick(self, units=1):
+        """Record that some units of work were completed."""
+        now = time.time()
+        self.slowest = max(self.slowest, now - self.last)
+        self.last = now
+        self.units += units
+
+    def exhausted(self):
+        """Whether another unit of work could overrun the budget."""
+        return self.seconds - self.elapsed() < max(self.margin, 2 * self.slowest)
+
+    def summary(self):
+        return {
+            "units": self.units,
+            "seconds": round(self.elapsed(), 1),
+            "slowest_unit_seconds": round(self.slowest, 1)
+        }
+
+def checkpoint_name(*parts):
+    """Build a checkpoint name, also valid as a task name prefix."""
+    return "-".join([str(x) for x in parts if x is not None])
+
+def save_checkpoint(name, slice_number, budget, cursor=None, done=False):
+    """Store the progress of a task slice and return the checkpoint."""
+    key = ndb.Key(TaskCheckpoint, name)
+    checkpoint = key.get()
+    if checkpoint is None:
+        checkpoint = TaskCheckpoint(key=key, slices=[])
+    checkpoint.cursor = cursor
+    checkpoint.done = done
+    checkpoint.units = (checkpoint.units or 0) + budget.units
+    checkpoint.slices.append(dict(budget.summary(), slice=slice_number))
+    checkpoint.put()
+    return checkpoint
+
+def next_slice_number(name, requested):
+    """Return the number of the current slice of a task.
+
+Continuations carry their number, so a retried slice chains the same named
+continuation. A task launched by hand continues after the last known slice.
+"""
+    try:
+        return int(requested)
+    except (TypeError, ValueError):
+        checkpoint = ndb.Key(TaskCheckpoint, name).get()
+        if checkpoint is None:
+            return 0
+        return len(checkpoint.slices)
+
+def continue_task(name, slice_number, budget, url, params, cursor,
+                  queue_name=QUEUENAME):
+    """Checkpoint a task slice at a safe boundary and chain the next one.
+
+The continuation is named after the checkpoint and the slice, so a slice that
+is retried after chaining does not launch a second continuation.
+"""
+    save_checkpoint(name, slice_number, budget, cursor=cursor)
+    params = dict(params, cursor=cursor, slice=slice_number + 1)
+    task_name = "%s-%d" % (name, slice_number + 1)
+    try:
+        taskqueue.add(name=task_name, url=url, params=params,
+                      queue_name=queue_name)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        s =  "Version: %s\n" % __version__
+        s += "Task %s already enqueued" % task_name
+        logging.info(s)
+        return params
+
+    s =  "Version: %s\n" % __version__
+    s += "Time budget used after %s. " % budget.summary()
+    s += "Task %s enqueued" % task_name
+    logging.info(s)
+    return params
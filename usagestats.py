@@ -9,43 +9,71 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "usagestats.py 2019-03-19T10:53-03:00"
+__version__ = "usagestats.py 2026-10-19T13:30-03:00"
 
 from admin.parser.InitExtraction import InitExtraction
 from admin.parser.GetEvents import GetEvents
+from admin.parser.MergeEvents import MergeEvents
+from admin.parser.DailyRollup import DailyRollup
 from admin.parser.ProcessEvents import ProcessEvents
 from admin.parser.GitHubStore import GitHubStore
 from admin.parser.GitHubIssue import GitHubIssue
+from admin.parser.PublishReports import PublishReports
 from admin.setup.DatasetsSetup import DatasetsSetup
 from admin.tools.Status import Status
 from admin.tools.PeriodStatus import PeriodStatus
+from admin.tools.PeriodPreview import PeriodPreview
 from admin.tools.RepoChecker import RepoChecker
 from admin.tools.WatchChecker import WatchChecker
 from admin.tools.EmailTester import EmailTester
 from admin.tools.EntityCleaner import EntityCleaner
+from admin.tools.GeocoderBenchmark import GeocoderBenchmark
+from admin.tools.CodecBenchmark import CodecBenchmark
+from admin.tools.ReportWriteBenchmark import ReportWriteBenchmark
+from admin.tools.ViewerBenchmark import ViewerBenchmark
+from admin.tools.ReportMigration import ReportMigration
+from admin.tools.PeriodIndexBuilder import PeriodIndexBuilder
+from admin.tools.CountryCacheWarmer import CountryCacheWarmer
 from viewer.DatasetViewer import DatasetViewer
 from viewer.ReportViewer import ReportViewer, TXTReportViewer, JSONReportViewer
+from viewer.ReportViewer import QueryTermsViewer
+from geocoder import check_boundaries
+from config import GNM_OFFLINE
 import webapp2
 
+if GNM_OFFLINE is True:
+    check_boundaries()
+
 # Administrative processes
 admin = webapp2.WSGIApplication([
 
     # Report generator
     ('/admin/parser/init', InitExtraction),
     ('/admin/parser/get_events', GetEvents),
+    ('/admin/parser/merge_events', MergeEvents),
+    ('/admin/parser/daily_rollup', DailyRollup),
     ('/admin/parser/process_events', ProcessEvents),
     ('/admin/parser/github_store', GitHubStore),
     ('/admin/parser/github_issue', GitHubIssue),
+    ('/admin/parser/publish_reports', PublishReports),
 
     # Accessory tools
     ('/admin/setup/datasets', DatasetsSetup),
     ('/admin/status', Status),
     webapp2.Route(r'/admin/status/period/<period>', handler=PeriodStatus),
+    webapp2.Route(r'/admin/status/preview/<period>', handler=PeriodPreview),
     ('/admin/tools/repo_checker', RepoChecker),
     ('/admin/tools/watch_checker', WatchChecker),
     webapp2.Route(r'/admin/tools/watch_checker/watcher/<watcher>', handler=WatchChecker),
     ('/admin/tools/email_tester', EmailTester),
     ('/admin/tools/entity_cleaner', EntityCleaner),
+    ('/admin/tools/geocoder_benchmark', GeocoderBenchmark),
+    ('/admin/tools/codec_benchmark', CodecBenchmark),
+    ('/admin/tools/report_write_benchmark', ReportWriteBenchmark),
+    ('/admin/tools/viewer_benchmark', ViewerBenchmark),
+    ('/admin/tools/report_migration', ReportMigration),
+    ('/admin/tools/period_index', PeriodIndexBuilder),
+    ('/admin/tools/country_cache_warmer', CountryCacheWarmer),
 
 ], debug=True)
 
@@ -62,5 +90,7 @@ app = webapp2.WSGIApplication([
                   handler=JSONReportViewer),
     webapp2.Route(r'/reports/<gbifdatasetid>/<period>/txt',
                   handler=TXTReportViewer),
+    webapp2.Route(r'/reports/<gbifdatasetid>/<period>/terms/<t:(search|download)>',
+                  handler=QueryTermsViewer),
 
 ], debug=True)
@@ -9,16 +9,18 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "util.py 2018-10-15T23:19-03:00"
+__version__ = "util.py 2026-10-19T12:45-03:00"
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
 import json
 import logging
 import os
 from urllib import urlencode
-from google.appengine.api import urlfetch, memcache
+from google.appengine.api import urlfetch
 from config import *
+from countrycache import country_cache
+from geocoder import get_geocoder, round_location
 
 CDB_QUERY_TOO_LARGE_ERROR = 'Your query was not able to finish.' + \
     ' Either you have too many queries running or the one you are trying' + \
@@ -27,6 +29,9 @@ CDB_QUERY_TOO_LARGE_ERROR = 'Your query was not able to finish.' + \
 class ApiQueryMaxRetriesExceededError(Exception):
     pass
 
+class CartoQueryTooLargeError(Exception):
+    pass
+
 def apikey(serv):
     """Return credentials file as a JSON object."""
     path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
@@ -54,10 +59,33 @@ Default behavior is to extract stats from just the last month.
 
     return query
 
+def add_time_window(query, start, end):
+    """Restrict a Carto query to events created in [start, end)."""
+    query += " and created_at>='%s'" % start.strftime('%Y-%m-%d %H:%M:%S')
+    query += " and created_at<'%s'" % end.strftime('%Y-%m-%d %H:%M:%S')
+    return query
+
+def month_window(period):
+    """Return the [start, end) datetimes of a YYYYMM period."""
+    start = datetime(int(period[:4]), int(period[-2:]), 1)
+    if start.month == 12:
+        end = datetime(start.year + 1, 1, 1)
+    else:
+        end = datetime(start.year, start.month + 1, 1)
+    return start, end
+
+def month_days(period):
+    """Return the datetimes of all days in a YYYYMM period."""
+    start, end = month_window(period)
+    return [start + timedelta(days=x) for x in range((end - start).days)]
+
 def api_query(api_url, params):
     """Launch query to an API.
 
-Send the specified query and retrieve the specified field.
+Send the specified query and retrieve the specified field. Carto errors for
+queries that are too expensive are not retried, since the same query would fail
+again; CartoQueryTooLargeError is raised instead, so that the caller can split
+the query.
 """
     urlfetch.set_default_fetch_deadline(60)
     finished = False
@@ -76,6 +104,14 @@ Send the specified query and retrieve the specified field.
         ).content
         d = json.loads(d)
         if "error" in d.keys():
+            errors = d['error']
+            if not isinstance(errors, list):
+                errors = [errors]
+            if len([x for x in errors
+                    if CDB_QUERY_TOO_LARGE_ERROR in unicode(x)]) > 0:
+                err_msg = "Query too large for Carto"
+                logging.warning(err_msg)
+                raise CartoQueryTooLargeError(err_msg)
             logging.warning("Warning, something went wrong with the query.")
             logging.warning(d['error'])
             logging.warning("This is the call that caused it:")
@@ -96,37 +132,175 @@ def carto_query(query):
     logging.info("Returned %d rows" % len(d))
     return d
 
-def geonames_query(lat, lon):
-    """Build parameters for launching a query to the GeoNames API."""
-    error = False
+def valid_coordinates(lat, lon):
+    """Check that a point can be resolved to a country."""
+    if lat is None or lon is None:
+        return False
     if lat == 0 and lon == 0:
-        error = True
+        return False
     if abs(lat) > 90 or abs(lon) > 180:
-        error = True
-    if error is True:
+        return False
+    return True
+
+def country_key(lat, lon):
+    """Build the cache key of a point, rounded as the geocoder rounds it."""
+    if not valid_coordinates(lat, lon):
+        return "Unknown"
+    return "|".join([str(x) for x in round_location(lat, lon)])
+
+def geonames_query(lat, lon):
+    """Build parameters for launching a query to the GeoNames API."""
+    if not valid_coordinates(lat, lon):
         d = "Unknown"
         return d
 
-    k = "|".join([str(round(lat, 2)), str(round(lon, 2))])
-    d = memcache.get(k)
+    k = country_key(lat, lon)
+    d = country_cache.get(k)
 
     if d is not None:
-        # logging.info("Retrieved country from memcache")
+        # logging.info("Retrieved country from cache")
         return d
-    else:
-        params = {
-            'formatted': 'true',
-            'lat': lat,
-            'lng': lon,
-            'username': 'jotegui',
-            'style': 'full'
-        }
+
+    # Try the bundled country boundaries first
+    if GNM_OFFLINE is True:
+        d = get_geocoder().country(lat, lon)
+        if d is None:
+            country_cache.count('boundaries', misses=1)
+        else:
+            country_cache.count('boundaries', hits=1)
+
+    # And call GeoNames only if they could not resolve the point
+    if d is None and GNM_HTTP_FALLBACK is True:
+        d = geonames_http_query(lat, lon)
+
+    if d is None:
+        d = "Unknown"
+    country_cache.set(k, d)
+    return d
+
+def geonames_http_query(lat, lon):
+    """Resolve a single point with the GeoNames API."""
+    params = geonames_params(lat, lon)
+    try:
+        d = api_query(api_url=GNM_URL, params=params)['countryName']
+        country_cache.count('geonames', hits=1)
+    except KeyError:
+        d = "Unknown"
+        country_cache.count('geonames', misses=1)
+    return d
+
+def geonames_params(lat, lon):
+    """Build the parameters of a GeoNames countryCode request."""
+    return {
+        'formatted': 'true',
+        'lat': lat,
+        'lng': lon,
+        'username': 'jotegui',
+        'style': 'full'
+    }
+
+def resolve_countries(coords, resolved=None):
+    """Resolve the countries of many points at once.
+
+Points are deduplicated by their rounded key first. Keys already in 'resolved'
+are skipped, the rest are looked up in the tiered country cache with a single
+get_multi, then in the bundled boundaries, and the remaining ones are sent to
+GeoNames through a pool of at most GNM_POOL_SIZE concurrent requests. New
+results are written back to the cache with a single set_multi.
+
+Return the 'resolved' dict (or a new one), updated with a country name for the
+key of every point in 'coords'.
+"""
+    if resolved is None:
+        resolved = {}
+    resolved["Unknown"] = "Unknown"
+
+    # Unique keys not resolved yet, with one point for each
+    points = {}
+    for lat, lon in coords:
+        k = country_key(lat, lon)
+        if k not in resolved and k not in points:
+            points[k] = (lat, lon)
+    if len(points) == 0:
+        return resolved
+
+    # Cached countries
+    cached = country_cache.get_multi(points.keys())
+    resolved.update(cached)
+    misses = [k for k in points if k not in cached]
+
+    # Bundled country boundaries
+    found = {}
+    if GNM_OFFLINE is True and len(misses) > 0:
+        geocoder = get_geocoder()
+        for k in misses:
+            d = geocoder.country(*points[k])
+            if d is not None:
+                found[k] = d
+        country_cache.count('boundaries', len(found), len(misses) - len(found))
+    misses = [k for k in misses if k not in found]
+
+    # GeoNames, for whatever is left
+    if GNM_HTTP_FALLBACK is True and len(misses) > 0:
+        found.update(geonames_http_query_multi([points[k] for k in misses]))
+
+    for k in misses:
+        if k not in found:
+            found[k] = "Unknown"
+
+    country_cache.set_multi(found)
+    resolved.update(found)
+
+    s = "Resolved %d locations: " % len(points)
+    s += "%d cached, " % len(cached)
+    s += "%d from boundaries, " % (len(points) - len(cached) - len(misses))
+    s += "%d from GeoNames" % len(misses)
+    logging.info(s)
+    return resolved
+
+def geonames_http_query_multi(points):
+    """Resolve many points with the GeoNames API, concurrently.
+
+At most GNM_POOL_SIZE requests are in flight at any time. Points whose request
+fails are retried serially through geonames_http_query. Return a dict of
+country key to country name.
+"""
+    result = {}
+    pending = list(points)
+    running = []
+
+    def collect(rpc, lat, lon):
+        k = country_key(lat, lon)
         try:
-            d = api_query(api_url=GNM_URL, params=params)['countryName']
-        except KeyError:
-            d = "Unknown"
-        memcache.add(k, d)
-        return d
+            d = json.loads(rpc.get_result().content)
+            if 'countryName' in d:
+                result[k] = d['countryName']
+                country_cache.count('geonames', hits=1)
+            else:
+                result[k] = "Unknown"
+                country_cache.count('geonames', misses=1)
+        except Exception as e:
+            logging.warning("Async GeoNames query failed for %s: %s" % (k, e))
+            result[k] = geonames_http_query(lat, lon)
+
+    while len(pending) > 0 or len(running) > 0:
+        # Fill the pool
+        while len(pending) > 0 and len(running) < GNM_POOL_SIZE:
+            lat, lon = pending.pop()
+            rpc = urlfetch.create_rpc(deadline=60)
+            urlfetch.make_fetch_call(
+                rpc,
+                url=GNM_URL,
+                method=urlfetch.POST,
+                payload=urlencode(geonames_params(lat, lon))
+            )
+            running.append((rpc, lat, lon))
+
+        # Wait for the oldest request to free a slot
+        rpc, lat, lon = running.pop(0)
+        collect(rpc, lat, lon)
+
+    return result
 
 # GitHub params
 ghb_headers = {
@@ -9,32 +9,50 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "DatasetViewer.py 2018-10-15T23:17-03:00"
+__version__ = "DatasetViewer.py 2026-10-19T10:00-03:00"
 
 from google.appengine.ext import ndb
 import webapp2
-from models import Report
+from models import Report, DatasetPeriodIndex
+from entitycache import entity_cache
 from util import *
 from jinjafilters import *
 
 class DatasetViewer(webapp2.RequestHandler):
+    @ndb.toplevel
     def get(self, gbifdatasetid):
 
         dataset_key = ndb.Key("Dataset", gbifdatasetid)
+        index_key = ndb.Key(DatasetPeriodIndex, gbifdatasetid)
 
-        query = Report.query(Report.reported_resource == dataset_key)
-        query = query.order(-Report.reported_period)
-        report_keys = query.fetch(keys_only=True)
+        # Read the period index and the dataset at once, while loading the
+        # template
+        future = (index_key.get_async(), entity_cache.get_async(dataset_key))
+        template = JINJA_ENVIRONMENT.get_template('dataset.html')
+        index, dataset = yield future
 
-        period_list = [
-            {
-                "text": x.id().split("|")[0][:4]+"-"+x.id().split("|")[0][4:],
-                "url": x.id().split("|")[0]
-            } for x in report_keys]
+        if index is not None:
+            # Periods seeded from the Report keys have no numbers yet
+            period_list = [
+                {
+                    "text": x.period[:4]+"-"+x.period[4:],
+                    "url": x.period,
+                    "summary": x if x.searches is not None else None
+                } for x in index.periods]
+        else:
+            # Datasets without any Report processed since the index exists
+            query = Report.query(Report.reported_resource == dataset_key)
+            query = query.order(-Report.reported_period)
+            report_keys = yield query.fetch_async(keys_only=True)
+            periods = [x.id().split("|")[0] for x in report_keys]
+            period_list = [
+                {
+                    "text": x[:4]+"-"+x[4:],
+                    "url": x
+                } for x in periods]
 
-        template = JINJA_ENVIRONMENT.get_template('dataset.html')
         self.response.write(template.render(
-            dataset=dataset_key.get(),
+            dataset=dataset,
             period_list=period_list,
             periods=len(period_list)
         ))
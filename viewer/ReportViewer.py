@@ -9,7 +9,7 @@
 __author__ = '@jotegui'
 __contributors__ = "Javier Otegui, John Wieczorek"
 __copyright__ = "Copyright 2018 vertnet.org"
-__version__ = "ReportViewer.py 2018-10-09T16:09-03:00"
+__version__ = "ReportViewer.py 2026-10-19T07:00-03:00"
 REPORTVIEWER_VERSION=__version__
 
 import json
@@ -17,95 +17,82 @@ from google.appengine.api import urlfetch
 import webapp2
 from models import *
 from jinjafilters import *
+from reportbuilder import load_archive_async
+from renderer import get_rendered_async, send_rendered
 
 class ReportViewer(webapp2.RequestHandler):
+    @ndb.toplevel
     def get(self, gbifdatasetid, period):
 
         report_key = ndb.Key("Period", period,
                              "Report", "|".join([period, gbifdatasetid]))
-        report = report_key.get()
+        entry = yield get_rendered_async(report_key, 'html')
 
-        if not report:
+        if not entry:
             self.error(404)
             self.response.write("Sorry, that report does not exist")
             logging.error("Attempted to view a non-existing report: %s"
                           % gbifdatasetid)
             return
 
-        template = JINJA_ENVIRONMENT.get_template('report.html')
-        self.response.write(template.render(
-            dataset=report.reported_resource.get(),
-            report=report,
-            period=report.reported_period.get()
-        ))
+        send_rendered(self, entry, 'html')
 
 class TXTReportViewer(webapp2.RequestHandler):
+    @ndb.toplevel
     def get(self, gbifdatasetid, period):
         urlfetch.set_default_fetch_deadline(60)
 
         report_key = ndb.Key("Period", period,
                              "Report", "|".join([period, gbifdatasetid]))
-        report = report_key.get()
+        entry = yield get_rendered_async(report_key, 'txt')
 
-        if not report:
+        if not entry:
             self.error(404)
             self.response.write("Sorry, that report does not exist")
             logging.error("Attempted to view a non-existing report: %s"
                           % gbifdatasetid)
             return
 
-        template = JINJA_ENVIRONMENT.get_template('report.txt')
-        self.response.headers["content-type"] = "text/plain"
-        self.response.write(template.render(
-            dataset=report.reported_resource.get(),
-            report=report,
-            period=report.reported_period.get()
-        ))
+        send_rendered(self, entry, 'txt')
 
 class JSONReportViewer(webapp2.RequestHandler):
+    @ndb.toplevel
     def get(self, gbifdatasetid, period):
         urlfetch.set_default_fetch_deadline(60)
 
         report_key = ndb.Key("Period", period,
                              "Report", "|".join([period, gbifdatasetid]))
-        report = report_key.get()
-        # sha = report.sha
-
-        # if sha != '':
-        #     report_call = urlfetch.fetch(
-        #         url='/'.join([ghb_url, "repos",
-        #                       ghb_org, ghb_rep,
-        #                       "git", "blobs", sha]),
-        #         headers=ghb_headers,
-        #         method=urlfetch.GET
-        #     )
-        #     report_enc = json.loads(report_call.content)['content']
-        #     content = base64.b64decode(report_enc)
-        # else:
-
-        # Get dictionary representation of Report
-        content = report.to_dict()
-
-        # Remove unwanted properties
-        content.pop("status", None)
-        content.pop("sha", None)
-        content.pop("url", None)
-
-        # Transform Key properties
-        content["reported_period"] = content["reported_period"].id()
-        content["reported_resource"] = content["reported_resource"].id()
-        content["created"] = content["created"].strftime("%Y-%m-%d")
-
-        # Transform Date properties
-        for x in ["downloads", "searches"]:
-            for i in range(len(content[x]['query_dates'])):
-                content[x]["query_dates"][i]["query_date"] = \
-                    content[x]["query_dates"][i]["query_date"].\
-                    strftime("%Y-%m-%d")
-
-        # Transform to JSON
-        content = json.dumps(content)
+        entry = yield get_rendered_async(report_key, 'json')
+
+        if not entry:
+            self.error(404)
+            self.response.write("Sorry, that report does not exist")
+            logging.error("Attempted to view a non-existing report: %s"
+                          % gbifdatasetid)
+            return
 
         # Return JSON string
-        self.response.headers["content-type"] = "application/json"
-        self.response.write(content)
+        send_rendered(self, entry, 'json')
+
+class QueryTermsViewer(webapp2.RequestHandler):
+    """All the query terms of a report for an event type, including the ones
+left out of the report, most records first."""
+    @ndb.toplevel
+    def get(self, gbifdatasetid, period, t):
+
+        report_key = ndb.Key("Period", period,
+                             "Report", "|".join([period, gbifdatasetid]))
+        terms = yield load_archive_async(report_key, t)
+
+        if terms is None:
+            self.error(404)
+            self.response.write("Sorry, that report does not exist")
+            logging.error("Attempted to view a non-existing report: %s"
+                          % gbifdatasetid)
+            return
+
+        self.response.headers["content-type"] = "text/plain"
+        self.response.write("".join(
+            [u'Query: "%s" ; Times: %d ; Records: %d\n' % (k, v[0], v[1])
+             for k, v in terms]
+        ))